@@ -41,4 +41,18 @@ curl -X POST http://localhost:8000/predictive_analysis \
   }'
 echo -e "\n"
 
+# Test 5: The same analyses as one batch request (one data fetch per interval)
+echo "Test 5: Batch Analysis"
+curl -X POST http://localhost:8000/batch \
+  -H "Content-Type: application/json" \
+  -d '{
+    "requests": [
+      {"endpoint": "analyze_data", "interval": "1min", "analysis_type": "grid_stability"},
+      {"endpoint": "analyze_data", "interval": "3min", "analysis_type": "renewable_integration"},
+      {"endpoint": "detect_anomalies", "interval": "5min"},
+      {"endpoint": "predictive_analysis", "interval": "1min"}
+    ]
+  }'
+echo -e "\n"
+
 echo "===== Analysis Complete ====="
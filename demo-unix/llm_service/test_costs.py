@@ -0,0 +1,149 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import llm_service
+from test_llm_scheduling import FakeOpenAI, ask, completion
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = llm_service.MetricsRegistry()
+    monkeypatch.setattr(llm_service, "metrics_registry", registry)
+    return registry
+
+
+@pytest.mark.parametrize("model, expected", [
+    ("gpt-4o-2024-08-06", (1000 * 2.50 + 500 * 10.00) / 1e6),
+    ("gpt-4o-mini-2024-07-18", (1000 * 0.15 + 500 * 0.60) / 1e6),
+    ("gpt-4-0613", (1000 * 30.00 + 500 * 60.00) / 1e6),
+    ("gpt-3.5-turbo-0125", (1000 * 0.50 + 500 * 1.50) / 1e6),
+    ("claude-unknown", None),
+    (None, None)
+])
+def test_models_are_priced_by_their_longest_prefix(model, expected):
+    cost = llm_service.CloudCostCalculator().llm_call_cost(model, 1000, 500)
+    assert cost == (pytest.approx(expected) if expected is not None else None)
+
+
+def test_configured_prices_override_and_extend_the_table():
+    calculator = llm_service.CloudCostCalculator(llm_prices={"gpt-4o": [1.0, 2.0], "local-llama": [0, 0]})
+    assert calculator.llm_call_cost("gpt-4o-2024-08-06", 1_000_000, 1_000_000) == pytest.approx(3.0)
+    assert calculator.llm_call_cost("local-llama-3", 5000, 5000) == 0.0
+    assert calculator.llm_call_cost("gpt-4o-mini", 1_000_000, 0) == pytest.approx(0.15)
+
+
+def test_completions_are_billed_to_the_request_and_its_batch(registry):
+    client = FakeOpenAI([
+        completion(prompt_tokens=1000, completion_tokens=500, model="gpt-4o-mini-2024-07-18"),
+        completion(prompt_tokens=200, completion_tokens=100, model="mystery-model")
+    ])
+    dispatcher = llm_service.LLMDispatcher(client)
+    monitor = llm_service.PerformanceMonitor()
+
+    async def batch():
+        outer = monitor.start_monitoring("batch")
+        inner = monitor.start_monitoring("detect_anomalies")
+        await ask(dispatcher, "first", endpoint="detect_anomalies")
+        await ask(dispatcher, "second", endpoint="detect_anomalies")
+        monitor.end_monitoring(inner)
+        monitor.end_monitoring(outer)
+        return inner["llm_usage"].summary(), outer["llm_usage"].summary()
+
+    request, whole_batch = asyncio.run(batch())
+    assert request["calls"] == 2 and request["unpriced_calls"] == 1
+    assert request["prompt_tokens"] == 1200 and request["completion_tokens"] == 600
+    assert request["cost"] == pytest.approx(0.00045)
+    assert request["by_model"]["mystery-model"]["cost"] == 0.0
+    assert whole_batch == request
+
+    assert registry.counter_total("llm_cost_dollars_total", endpoint="detect_anomalies") == pytest.approx(0.00045)
+    assert registry.counter_total("llm_tokens_total", model="gpt-4o-mini-2024-07-18", type="prompt") == 1000
+
+
+def test_llm_spend_is_added_to_every_provider_total():
+    usage = llm_service.LLMUsage()
+    usage.add("gpt-4o", 1000, 500, 0.0075)
+    calculator = llm_service.CloudCostCalculator()
+    with_llm = calculator.calculate_interval_costs("5min", 2.0, 1.0, llm_usage=usage)
+    without = calculator.calculate_interval_costs("5min", 2.0, 1.0)
+    for provider, costs in with_llm["costs_by_provider"].items():
+        assert costs["llm_tokens"] == 0.0075
+        assert costs["total"] == pytest.approx(without["costs_by_provider"][provider]["total"] + 0.0075)
+    assert with_llm["llm_usage"]["by_model"]["gpt-4o"]["calls"] == 1
+
+
+def test_llm_cost_report_ranks_endpoints_by_spend(registry):
+    registry.increment("llm_requests_total", endpoint="cluster_analysis", outcome="success")
+    registry.increment("llm_cost_dollars_total", 0.002, endpoint="cluster_analysis", model="gpt-4o")
+    registry.increment("llm_requests_total", 2, endpoint="query_gpt", outcome="success")
+    registry.increment("llm_cost_dollars_total", 0.01, endpoint="query_gpt", model="gpt-4o")
+    registry.increment("llm_cache_hits_total", 3, endpoint="query_gpt")
+
+    report = asyncio.run(llm_service.llm_costs())
+    assert [entry["endpoint"] for entry in report["by_endpoint"]] == ["query_gpt", "cluster_analysis"]
+    top = report["by_endpoint"][0]
+    assert top["avg_cost_per_call"] == 0.005
+    assert top["cache_savings_estimate"] == 0.015
+    assert report["total_cost"] == 0.012
+
+
+def test_simulation_matches_the_per_request_calculation():
+    calculator = llm_service.CloudCostCalculator()
+    intervals, sizes, durations = ["15s", "1min", "1h"], [0.5, 10.0, 250.0], [1.0, 12.0, 90.0]
+    result = calculator.simulate(intervals, sizes, durations, [10, 100], [24, 720], llm_cost_per_request=0.001)
+
+    for provider in calculator.pricing:
+        per_analysis = np.array(result["cost_per_analysis"][provider])
+        for i, interval in enumerate(intervals):
+            for s, size in enumerate(sizes):
+                for d, duration in enumerate(durations):
+                    scalar = calculator.calculate_interval_costs(interval, size, duration)["costs_by_provider"][provider]
+                    assert per_analysis[i, s, d] == pytest.approx(scalar["total"] + 0.001, abs=2e-6)
+        # Totals are per-analysis cost x requests per hour x hours
+        per_request = np.array(result["total_cost"][provider]) / np.multiply.outer([10, 100], [24, 720])
+        np.testing.assert_allclose(per_request, np.broadcast_to(per_analysis[..., None, None], per_request.shape), atol=1e-6)
+    assert result["cells"] == 3 * 3 * 3 * 3 * 2 * 2
+
+
+def test_break_even_sizes_are_where_providers_cost_the_same():
+    calculator = llm_service.CloudCostCalculator()
+    points = calculator.simulate(["1min"], [1.0, 1000.0], [1.0], [1], [1])["break_even"]["data_size_mb"]
+    assert len(points) == 3
+    for point in points:
+        first, second = point["providers"]
+        if point["data_size_mb"] is None:
+            grid = calculator.simulate(["1min"], [0.01, 1.0, 1e4], [1.0], [1], [1])["cost_per_analysis"]
+            cheaper = point["always_cheaper"]
+            other = second if cheaper == first else first
+            assert (np.array(grid[cheaper]) <= np.array(grid[other])).all()
+            continue
+        size = point["data_size_mb"]
+        costs = calculator.simulate(["1min"], [size * 0.5, size, size * 2], [1.0], [1], [1])["cost_per_analysis"]
+        low, high = point["cheaper_below"], point["cheaper_above"]
+        assert costs[low][0][1][0] == pytest.approx(costs[high][0][1][0], abs=1e-6)
+        assert costs[low][0][0][0] < costs[high][0][0][0]
+        assert costs[low][0][2][0] > costs[high][0][2][0]
+
+
+def test_budget_gives_the_sustainable_request_rate():
+    calculator = llm_service.CloudCostCalculator()
+    result = calculator.simulate(["5min"], [10.0], [2.0], [1], [24, 720], budget=100.0)
+    for provider, rates in result["break_even"]["max_requests_per_hour_within_budget"].items():
+        per_analysis = result["cost_per_analysis"][provider][0][0][0]
+        for rate, horizon in zip(rates[0][0][0], [24, 720]):
+            assert rate * per_analysis * horizon == pytest.approx(100.0, rel=1e-3)
+
+
+@pytest.mark.parametrize("payload", [
+    {"intervals": ["soon"]},
+    {"data_sizes_mb": [-1]},
+    {"durations_seconds": "slow"},
+    {"data_sizes_mb": list(range(1, 200)), "durations_seconds": list(range(1, 200))}
+])
+def test_simulation_rejects_bad_or_oversized_grids(payload):
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(llm_service.simulate_costs(payload))
+    assert raised.value.status_code == 400
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import llm_service
+
+
+class Handlers:
+    """Analysis handlers that record their calls; ``slow`` runs until released or cancelled"""
+
+    def __init__(self):
+        self.calls = []
+        self.cancelled = []
+        self.release = None
+
+    async def quick(self, payload):
+        self.calls.append(("quick", payload))
+        return {"answer": payload.get("n", 0) * 2}
+
+    async def slow(self, payload):
+        self.calls.append(("slow", payload))
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(payload)
+            raise
+        return {"done": True}
+
+    async def broken(self, payload):
+        return {"error": "Not enough data"}
+
+    async def rejected(self, payload):
+        raise HTTPException(status_code=400, detail="'budget' must be a number")
+
+    def table(self):
+        return {"quick": self.quick, "slow": self.slow, "broken": self.broken, "rejected": self.rejected}
+
+
+async def settle(queue, job, statuses=llm_service.JobQueue.FINISHED):
+    while (await queue.get(job["job_id"]))["status"] not in statuses:
+        await asyncio.sleep(0.005)
+    return await queue.get(job["job_id"])
+
+
+def test_jobs_run_in_the_background_and_keep_their_result(tmp_path):
+    handlers = Handlers()
+    path = str(tmp_path / "state" / "jobs.db")
+
+    async def scenario():
+        queue = llm_service.JobQueue(handlers.table(), db_path=path)
+        done = await settle(queue, await queue.submit("quick", {"n": 21}))
+        failed = await settle(queue, await queue.submit("broken", {}))
+        rejected = await settle(queue, await queue.submit("rejected", {}))
+        return done, failed, rejected
+
+    done, failed, rejected = asyncio.run(scenario())
+    assert done["status"] == "completed" and done["result"] == {"answer": 42}
+    assert done["started"] <= done["finished"]
+    assert failed["status"] == "failed" and failed["error"] == "Not enough data"
+    assert rejected["status"] == "failed" and rejected["error"] == "'budget' must be a number"
+
+    # The SQLite record outlives the queue, in a directory created on demand
+    restarted = llm_service.JobQueue(handlers.table(), db_path=path)
+    assert asyncio.run(restarted.get(done["job_id"]))["result"] == {"answer": 42}
+
+
+def test_cancelling_a_queued_job_skips_it():
+    handlers = Handlers()
+
+    async def scenario():
+        handlers.release = asyncio.Event()
+        queue = llm_service.JobQueue(handlers.table(), max_workers=1)
+        blocking = await queue.submit("slow", {"id": 1})
+        waiting = await queue.submit("quick", {"n": 1})
+        await settle(queue, blocking, ("running",))
+        assert (await queue.cancel(waiting["job_id"]))["status"] == "cancelled"
+        handlers.release.set()
+        await settle(queue, blocking)
+        await asyncio.sleep(0.01)
+        return await queue.get(waiting["job_id"])
+
+    assert asyncio.run(scenario())["status"] == "cancelled"
+    assert handlers.calls == [("slow", {"id": 1})]
+
+
+def test_cancelling_a_running_job_stops_its_handler():
+    handlers = Handlers()
+
+    async def scenario():
+        handlers.release = asyncio.Event()
+        queue = llm_service.JobQueue(handlers.table())
+        job = await queue.submit("slow", {"id": 1})
+        await settle(queue, job, ("running",))
+        await queue.cancel(job["job_id"])
+        return await settle(queue, job), queue.stats()
+
+    job, stats = asyncio.run(scenario())
+    assert job["status"] == "cancelled" and job["result"] is None
+    assert handlers.cancelled == [{"id": 1}]
+    assert stats["running"] == 0
+
+
+def test_unknown_analysis_types_are_rejected():
+    queue = llm_service.JobQueue(Handlers().table())
+    with pytest.raises(ValueError, match="Unknown analysis_type 'nope'"):
+        asyncio.run(queue.submit("nope", {}))
+
+
+def test_unfinished_jobs_are_interrupted_by_a_restart(tmp_path):
+    handlers = Handlers()
+    path = str(tmp_path / "jobs.db")
+
+    async def scenario():
+        handlers.release = asyncio.Event()
+        queue = llm_service.JobQueue(handlers.table(), max_workers=1, db_path=path)
+        running = await queue.submit("slow", {})
+        queued = await queue.submit("quick", {})
+        await settle(queue, running, ("running",))
+        return running, queued
+
+    jobs = asyncio.run(scenario())
+    restarted = llm_service.JobQueue(handlers.table(), db_path=path)
+    for job in jobs:
+        record = asyncio.run(restarted.get(job["job_id"]))
+        assert record["status"] == "interrupted"
+        assert record["error"] == "Service restarted before the job finished"
@@ -0,0 +1,252 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pandas as pd
+import pytest
+from openai import RateLimitError
+
+import llm_service
+
+
+def completion(content="ok", prompt_tokens=100, completion_tokens=20, model="gpt-3.5-turbo-0125"):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens),
+        model=model
+    )
+
+
+def rate_limited(retry_after=None):
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return RateLimitError("Rate limit reached", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+
+class FakeOpenAI:
+    """Stands in for AsyncOpenAI; ``script`` gives the outcome of successive calls"""
+
+    def __init__(self, script=None, delay=0.0):
+        self.script = list(script or [])
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.cancelled = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **request):
+        self.calls.append((time.monotonic(), request))
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            outcome = self.script.pop(0) if self.script else completion(request["messages"][-1]["content"])
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+
+def ask(dispatcher, content, endpoint="default"):
+    return dispatcher.create(endpoint=endpoint, model="gpt-3.5-turbo", messages=[{"role": "user", "content": content}])
+
+
+def test_rate_limit_pauses_for_retry_after_then_retries():
+    client = FakeOpenAI([rate_limited(retry_after=0.2), completion("done")])
+    dispatcher = llm_service.LLMDispatcher(client, max_in_flight=2)
+
+    response = asyncio.run(ask(dispatcher, "hi"))
+    assert response.choices[0].message.content == "done"
+    assert dispatcher.rate_limited == 1
+    assert dispatcher.completed == 1
+    (first, _), (second, _) = client.calls
+    assert second - first >= 0.2
+
+
+def test_rate_limit_without_retry_after_backs_off_exponentially():
+    client = FakeOpenAI([rate_limited(), rate_limited(), completion()])
+    dispatcher = llm_service.LLMDispatcher(client, backoff_seconds=0.05)
+    asyncio.run(ask(dispatcher, "hi"))
+    times = [at for at, _ in client.calls]
+    # Jittered 0.5x-1.5x around 0.05s, then 0.1s
+    assert times[1] - times[0] >= 0.025
+    assert times[2] - times[1] >= 0.05
+
+
+def test_rate_limit_is_raised_once_retries_run_out():
+    client = FakeOpenAI([rate_limited(retry_after=0)] * 3)
+    dispatcher = llm_service.LLMDispatcher(client, max_retries=2)
+    with pytest.raises(RateLimitError):
+        asyncio.run(ask(dispatcher, "hi"))
+    assert len(client.calls) == 3
+
+
+def test_in_flight_completions_are_bounded():
+    client = FakeOpenAI(delay=0.02)
+    dispatcher = llm_service.LLMDispatcher(client, max_in_flight=2)
+
+    async def burst():
+        return await asyncio.gather(*(ask(dispatcher, str(i)) for i in range(8)))
+
+    responses = asyncio.run(burst())
+    assert [response.choices[0].message.content for response in responses] == [str(i) for i in range(8)]
+    assert client.peak_in_flight == 2
+
+
+def test_interactive_queries_jump_the_bulk_queue():
+    client = FakeOpenAI(delay=0.01)
+    dispatcher = llm_service.LLMDispatcher(client, max_in_flight=1)
+
+    async def mixed():
+        bulk = [asyncio.ensure_future(ask(dispatcher, f"bulk{i}", endpoint="detect_anomalies")) for i in range(3)]
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(ask(dispatcher, "question", endpoint="query_gpt"))
+        await asyncio.gather(*bulk, interactive)
+
+    asyncio.run(mixed())
+    order = [request["messages"][-1]["content"] for _, request in client.calls]
+    # The first bulk request was already running; the query goes next
+    assert order[:2] == ["bulk0", "question"]
+
+
+def test_cache_keys_cover_the_whole_request():
+    messages = [{"role": "user", "content": "hi"}]
+    key = llm_service.LLMResponseCache.make_key("gpt-3.5-turbo", messages, 500, 0.3)
+    assert key == llm_service.LLMResponseCache.make_key("gpt-3.5-turbo", [dict(messages[0])], 500, 0.3)
+    assert key != llm_service.LLMResponseCache.make_key("gpt-3.5-turbo", messages, 500, 0.7)
+    assert key != llm_service.LLMResponseCache.make_key("gpt-4o", messages, 500, 0.3)
+
+
+def test_cache_expires_and_evicts(monkeypatch):
+    cache = llm_service.LLMResponseCache(max_entries=2, ttl_seconds=60)
+    now = [1000.0]
+    monkeypatch.setattr(llm_service.time, "time", lambda: now[0])
+
+    async def scenario():
+        await cache.set("a", "A")
+        await cache.set("b", "B")
+        assert await cache.get("a") == "A"
+        await cache.set("c", "C")  # evicts b, the least recently used
+        assert await cache.get("b") is None
+        now[0] += 61
+        assert await cache.get("a") is None
+
+    asyncio.run(scenario())
+    assert cache.stats["evictions"] == 1
+    assert cache.report()["hit_ratio"] == round(1 / 3, 3)
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "llm_cache.db")
+    asyncio.run(llm_service.LLMResponseCache(db_path=path).set("key", "answer"))
+    restarted = llm_service.LLMResponseCache(db_path=path)
+    assert asyncio.run(restarted.get("key")) == "answer"
+    assert restarted.stats["disk_hits"] == 1
+
+
+def test_analyzer_serves_repeats_from_the_cache():
+    client = FakeOpenAI()
+    analyzer = llm_service.GPTAnalyzer(llm_service.LLMDispatcher(client), cache=llm_service.LLMResponseCache())
+    data = pd.DataFrame({"W": [1.0, 2.0, 3.0]})
+
+    async def twice():
+        return [await analyzer.analyze_with_gpt(data, "summary") for _ in range(2)]
+
+    first, second = asyncio.run(twice())
+    assert first == second
+    assert len(client.calls) == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = llm_service.SingleFlight()
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.02)
+        return {"key": key}
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do(key, lambda key=key: work(key)) for key in ["a", "a", "b", "a"]))
+        # Finished calls are forgotten, so a later call runs again
+        await flight.do("a", lambda: work("a"))
+        return results
+
+    results = asyncio.run(scenario())
+    assert results[0] is results[1] is results[3]
+    assert calls == ["a", "b", "a"]
+    assert flight.stats == {"calls": 3, "coalesced": 2}
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    flight = llm_service.SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("k", slow))
+        second = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
+
+
+def test_concurrent_identical_prompts_share_one_completion():
+    client = FakeOpenAI(delay=0.02)
+    analyzer = llm_service.GPTAnalyzer(llm_service.LLMDispatcher(client))
+    data = pd.DataFrame({"W": [1.0, 2.0, 3.0]})
+
+    async def burst():
+        return await asyncio.gather(*(analyzer.analyze_with_gpt(data, "summary") for _ in range(5)))
+
+    assert len(set(asyncio.run(burst()))) == 1
+    assert len(client.calls) == 1
+    assert analyzer.inflight.stats["coalesced"] == 4
+
+
+def test_last_cancelled_waiter_cancels_the_shared_call():
+    flight = llm_service.SingleFlight()
+    finished = []
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(flight.do("k", slow)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.sleep(0.08)
+
+    asyncio.run(scenario())
+    assert finished == []
+    assert flight._calls == {}
+
+
+def test_cancelled_caller_stops_its_completion():
+    client = FakeOpenAI(delay=5)
+    dispatcher = llm_service.LLMDispatcher(client, max_in_flight=1)
+
+    async def scenario():
+        caller = asyncio.ensure_future(ask(dispatcher, "slow"))
+        await asyncio.sleep(0.02)
+        caller.cancel()
+        await asyncio.sleep(0.02)
+        # The worker is free again for the next request
+        client.delay = 0
+        return await ask(dispatcher, "next")
+
+    assert asyncio.run(scenario()).choices[0].message.content == "next"
+    assert client.cancelled == 1
+    assert dispatcher.stats()["in_flight"] == 0
@@ -0,0 +1,320 @@
+import concurrent.futures
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import tracing
+
+
+def make_raw(start="2024-02-22 19:33:33", periods=600, freq="2s", seed=0):
+    """Raw DER telemetry shaped like data/der_data.csv"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=periods, freq=freq)
+    return pd.DataFrame({
+        "datetimestamp": times.strftime("%Y-%m-%d %H:%M:%S"),
+        "W": 3700 + rng.normal(0, 50, periods),
+        "VAr": 7 + rng.normal(0, 1, periods),
+        "Hz": 60 + rng.normal(0, 0.01, periods),
+        "St": rng.integers(1, 5, periods),
+    })
+
+
+def write_raw(path, frame):
+    frame.to_csv(path, index=False)
+
+
+def append_raw(path, frame):
+    frame.to_csv(path, index=False, header=False, mode="a")
+
+
+def make_aggregator(tmp_path, storage="feather"):
+    pyramid = app.ResolutionPyramid(app.pyramid_levels, str(tmp_path / "pyramid"), app.storage_backends[storage])
+    return app.IncrementalAggregator(str(tmp_path / "der_data.csv"), pyramid, str(tmp_path / "state.json"))
+
+
+def expected_rollup(raw, interval, stat="mean"):
+    frame = raw.assign(datetimestamp=pd.to_datetime(raw["datetimestamp"])).set_index("datetimestamp")
+    return getattr(frame.select_dtypes(include=["number"]).resample(interval), stat)()
+
+
+@pytest.fixture
+def aggregator(tmp_path):
+    write_raw(tmp_path / "der_data.csv", make_raw())
+    aggregator = make_aggregator(tmp_path)
+    aggregator.refresh()
+    return aggregator
+
+
+@pytest.fixture
+def client(aggregator, monkeypatch):
+    monkeypatch.setattr(app, "pyramid", aggregator.pyramid)
+    monkeypatch.setattr(app, "aggregator", aggregator)
+    monkeypatch.setattr(app, "aggregate_cache", app.AggregateCache(aggregator.pyramid))
+    return TestClient(app.app)
+
+
+def test_cache_reuses_rollup_until_the_pyramid_changes(aggregator, tmp_path):
+    cache = app.AggregateCache(aggregator.pyramid)
+    entry = cache.get("1min")
+    assert cache.get("1min") is entry
+
+    payload = cache.payload(entry, "json")
+    assert cache.payload(entry, "json") is payload
+
+    append_raw(tmp_path / "der_data.csv", make_raw(start="2024-02-22 20:00:00", periods=10))
+    aggregator.refresh()
+    refreshed = cache.get("1min")
+    assert refreshed is not entry
+    assert len(refreshed["frame"]) > len(entry["frame"])
+
+
+def test_cache_evicts_least_recently_used(aggregator):
+    cache = app.AggregateCache(aggregator.pyramid, max_entries=2)
+    first = cache.get("1min")
+    cache.get("5min")
+    cache.get("1min")
+    cache.get("10min")
+    assert cache.get("1min") is first
+    assert ("5min", "mean") not in cache._entries
+
+
+def test_appended_rows_match_a_full_rebuild(tmp_path):
+    raw = make_raw(periods=900)
+    write_raw(tmp_path / "der_data.csv", raw.iloc[:400])
+    aggregator = make_aggregator(tmp_path)
+    assert aggregator.refresh() == 400
+
+    append_raw(tmp_path / "der_data.csv", raw.iloc[400:])
+    assert aggregator.refresh() == 500
+    assert aggregator.refresh() == 0
+    pd.testing.assert_frame_equal(
+        aggregator.pyramid.rollup("1min"), expected_rollup(raw, "1min"), check_names=False, check_freq=False
+    )
+
+
+def test_partial_trailing_line_waits_for_the_next_refresh(tmp_path):
+    raw = make_raw(periods=20)
+    write_raw(tmp_path / "der_data.csv", raw.iloc[:10])
+    aggregator = make_aggregator(tmp_path)
+    aggregator.refresh()
+
+    line = raw.iloc[10:11].to_csv(index=False, header=False)
+    with open(tmp_path / "der_data.csv", "a") as f:
+        f.write(line[:15])
+    assert aggregator.refresh() == 0
+
+    with open(tmp_path / "der_data.csv", "a") as f:
+        f.write(line[15:])
+    assert aggregator.refresh() == 1
+    assert aggregator.pyramid.rollup("1s", "count")["W"].sum() == 11
+
+
+def test_malformed_rows_are_skipped_and_the_offset_advances(tmp_path, caplog):
+    raw = make_raw(periods=30)
+    write_raw(tmp_path / "der_data.csv", raw.iloc[:10])
+    aggregator = make_aggregator(tmp_path)
+    aggregator.refresh()
+
+    with open(tmp_path / "der_data.csv", "a") as f:
+        f.write("not-a-timestamp,1,2,3,4\n")
+        f.write("2024-02-22 19:40:00,1,2,3,4,5,6,7\n")
+    append_raw(tmp_path / "der_data.csv", raw.iloc[10:20])
+    assert aggregator.refresh() == 10
+    assert "Skipped 2 malformed row(s)" in caplog.text
+    assert aggregator._state["skipped_rows"] == 2
+
+    # The bad rows are behind the offset, so later appends keep flowing in
+    append_raw(tmp_path / "der_data.csv", raw.iloc[20:])
+    assert aggregator.refresh() == 10
+    assert aggregator.pyramid.rollup("1s", "count")["W"].sum() == 30
+
+
+@pytest.mark.parametrize("interval", ["1s", "15s", "1min", "7min", "1h", "2h"])
+@pytest.mark.parametrize("stat", ["mean", "sum", "count", "min", "max"])
+def test_rollup_matches_resample(tmp_path, interval, stat):
+    # Three hours with a gap, so some buckets are empty
+    raw = pd.concat([make_raw(periods=2000), make_raw(start="2024-02-22 21:30:00", periods=1500, freq="3s")])
+    write_raw(tmp_path / "der_data.csv", raw)
+    aggregator = make_aggregator(tmp_path)
+    aggregator.refresh()
+
+    pd.testing.assert_frame_equal(
+        aggregator.pyramid.rollup(interval, stat), expected_rollup(raw, interval, stat),
+        check_names=False, check_freq=False, check_dtype=False
+    )
+
+
+def test_unsupported_intervals_are_rejected(aggregator):
+    for interval in ["1500ms", "1M", "bogus", "-5min"]:
+        with pytest.raises(ValueError):
+            aggregator.pyramid.resolve(interval)
+    assert aggregator.pyramid.resolve("90s") == "1s"
+    assert aggregator.pyramid.resolve("30min") == "1min"
+    assert aggregator.pyramid.resolve("1D") == "1h"
+
+
+def test_spilled_base_partitions_roll_up_from_storage(tmp_path):
+    raw = make_raw(periods=4000, freq="3s")  # a little over three hours
+    write_raw(tmp_path / "der_data.csv", raw)
+    aggregator = make_aggregator(tmp_path)
+    aggregator.pyramid.resident_partitions = {"1s": 1}
+    aggregator.refresh()
+
+    base = aggregator.pyramid.partitions["1s"]
+    assert sum(part is not None for part in base.values()) == 1
+    assert len(base) == 4
+    pd.testing.assert_frame_equal(
+        aggregator.pyramid.rollup("15s"), expected_rollup(raw, "15s"), check_names=False, check_freq=False
+    )
+
+    # Appends into a spilled partition read it back before merging
+    append_raw(tmp_path / "der_data.csv", make_raw(start="2024-02-22 19:40:00", periods=5, seed=1))
+    aggregator.refresh()
+    counts = aggregator.pyramid.rollup("1h", "count")["W"]
+    assert counts.sum() == 4005
+
+    reloaded = app.ResolutionPyramid(
+        app.pyramid_levels, aggregator.pyramid.storage_dir, aggregator.pyramid.storage, resident_partitions={"1s": 2}
+    )
+    reloaded.load()
+    assert sum(part is not None for part in reloaded.partitions["1s"].values()) == 2
+    pd.testing.assert_frame_equal(reloaded.rollup("15s"), aggregator.pyramid.rollup("15s"))
+
+
+def test_slow_rollup_does_not_block_other_intervals(aggregator):
+    release = threading.Event()
+    rollup = aggregator.pyramid.rollup
+    builds = []
+
+    def slow_rollup(interval, stat="mean"):
+        builds.append(interval)
+        if interval == "1s":
+            release.wait(5)
+        return rollup(interval, stat)
+
+    aggregator.pyramid.rollup = slow_rollup
+    cache = app.AggregateCache(aggregator.pyramid)
+    with concurrent.futures.ThreadPoolExecutor(3) as pool:
+        slow = [pool.submit(cache.get, "1s") for _ in range(2)]
+        assert not cache.get("5min")["frame"].empty
+        assert not any(future.done() for future in slow)
+        release.set()
+        first, second = (future.result(5) for future in slow)
+    # Both waiters on the stale key shared one build
+    assert first is second
+    assert builds.count("1s") == 1
+
+
+def test_timezone_aware_bounds_are_converted_to_utc(client):
+    naive = client.get("/data/1min", params={"start": "2024-02-22 19:35:00", "end": "2024-02-22 19:40:00"})
+    assert naive.status_code == 200
+    assert naive.json()[0]["datetimestamp"] == "2024-02-22 19:35:00"
+    assert len(naive.json()) == 6
+
+    for start, end in [
+        ("2024-02-22 19:35:00+00:00", "2024-02-22T19:40:00Z"),
+        ("2024-02-22 13:35:00-06:00", "2024-02-22 20:40:00+01:00"),
+    ]:
+        aware = client.get("/data/1min", params={"start": start, "end": end})
+        assert aware.status_code == 200
+        assert aware.json() == naive.json()
+
+
+def test_bad_bounds_are_a_client_error(client):
+    for start in ["yesterday-ish", "NaT"]:
+        response = client.get("/data/1min", params={"start": start})
+        assert response.status_code == 400
+    assert client.get("/data/1min", params={"columns": "W,nope"}).status_code == 400
+
+
+def test_json_keeps_full_precision(client, aggregator):
+    frame = aggregator.pyramid.rollup("1min")
+    for fmt in ["json", "ndjson"]:
+        response = client.get("/data/1min", params={"format": fmt, "limit": 50} if fmt == "ndjson" else {"format": fmt})
+        rows = response.json() if fmt == "json" else [json.loads(line) for line in response.text.splitlines()]
+        served = np.array([row["W"] for row in rows])
+        np.testing.assert_allclose(served, frame["W"].to_numpy()[:len(rows)], rtol=1e-14, atol=0)
+
+
+@pytest.mark.parametrize("accept, decode", [
+    ("application/vnd.apache.arrow.stream", lambda content: pa.ipc.open_stream(content).read_pandas()),
+    ("application/vnd.apache.parquet", lambda content: pq.read_table(pa.BufferReader(content)).to_pandas()),
+])
+def test_binary_formats_are_negotiated_from_accept(client, aggregator, accept, decode):
+    response = client.get("/data/1min", headers={"Accept": accept})
+    assert response.headers["content-type"] == accept
+    served = decode(response.content).set_index("datetimestamp")
+    pd.testing.assert_frame_equal(
+        served, aggregator.pyramid.rollup("1min"), check_names=False, check_freq=False, check_index_type=False
+    )
+    assert client.get("/data/1min", params={"format": "xml"}).status_code == 400
+
+
+def test_size_headers_report_rows_and_memory_not_the_payload(client, aggregator):
+    frame = aggregator.pyramid.rollup("1min")[["W", "VAr"]].iloc[:10]
+    sizes = {}
+    for fmt in ["json", "arrow"]:
+        response = client.get("/data/1min", params={"format": fmt, "columns": "W,VAr", "limit": 10})
+        assert response.headers["X-Row-Count"] == "10"
+        assert int(response.headers["X-Memory-Bytes"]) == frame.memory_usage(index=True).sum()
+        sizes[fmt] = int(response.headers["content-length"])
+        assert sizes[fmt] == len(response.content)
+    # The in-memory size is the same for every format; the wire size is not
+    assert sizes["arrow"] != sizes["json"]
+
+    meta = client.get("/data/1min/meta", params={"columns": "W,VAr", "limit": 10}).json()
+    assert (meta["rows"], meta["memory_bytes"]) == (10, frame.memory_usage(index=True).sum())
+
+
+@pytest.mark.parametrize("storage", ["feather", "parquet"])
+def test_restart_resumes_from_stored_partitions(tmp_path, storage):
+    raw = make_raw(periods=1200)
+    write_raw(tmp_path / "der_data.csv", raw.iloc[:700])
+    make_aggregator(tmp_path, storage).refresh()
+    files = list((tmp_path / "pyramid" / "1min").iterdir())
+    assert files and all(path.suffix == f".{storage}" for path in files)
+
+    append_raw(tmp_path / "der_data.csv", raw.iloc[700:])
+    restarted = make_aggregator(tmp_path, storage)
+    # Only the appended rows are parsed; the rest comes back from storage
+    assert restarted.refresh() == 500
+    pd.testing.assert_frame_equal(
+        restarted.pyramid.rollup("5min"), expected_rollup(raw, "5min"), check_names=False, check_freq=False
+    )
+
+
+def test_switching_storage_rebuilds_the_pyramid(tmp_path):
+    write_raw(tmp_path / "der_data.csv", make_raw(periods=300))
+    make_aggregator(tmp_path, "feather").refresh()
+    rebuilt = make_aggregator(tmp_path, "parquet")
+    assert rebuilt.refresh() == 300
+    assert list((tmp_path / "pyramid" / "1min").glob("*.feather")) == []
+
+
+def test_ndjson_is_streamed_in_bounded_chunks(client, aggregator):
+    frame = aggregator.pyramid.rollup("15s")
+    chunks = list(app.iter_ndjson(frame, chunk_rows=7))
+    assert len(chunks) == -(-len(frame) // 7)
+    assert all(chunk.count(b"\n") <= 7 for chunk in chunks)
+
+    streamed = [json.loads(line) for line in client.get("/data/15s", params={"format": "ndjson"}).text.splitlines()]
+    assert streamed == client.get("/data/15s").json()
+
+
+def test_requests_join_the_callers_trace(client, monkeypatch):
+    monkeypatch.setattr(app.tracer, "store", tracing.TraceStore())
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    response = client.get("/data/1min", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+
+    assert response.headers["X-Trace-Id"] == trace_id
+    spans = {span["name"]: span for span in app.tracer.store.get(trace_id)}
+    root = spans["GET /data/{interval}"]
+    assert root["parent_id"] == parent_id and root["kind"] == "server"
+    assert spans["encode"]["trace_id"] == trace_id
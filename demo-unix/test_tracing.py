@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+import tracing
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class ListExporter(tracing.SpanExporter):
+    """Collects written batches; fails every write while ``broken`` is set"""
+
+    def __init__(self, **kwargs):
+        # Flushed by the test, not the background thread
+        super().__init__(flush_seconds=3600, **kwargs)
+        self.batches = []
+        self.broken = False
+
+    def write(self, spans):
+        if self.broken:
+            raise ConnectionError("collector unreachable")
+        self.batches.append(list(spans))
+
+
+def span(name, span_id, parent_id, start_ms, end_ms):
+    return {
+        "trace_id": TRACE_ID, "span_id": span_id, "parent_id": parent_id, "name": name, "service": "llm_service",
+        "kind": "internal", "start_ns": start_ms * 1_000_000, "end_ns": end_ms * 1_000_000,
+        "duration_ms": float(end_ms - start_ms), "attributes": {}, "error": None
+    }
+
+
+@pytest.mark.parametrize("header, expected", [
+    (f"00-{TRACE_ID}-{PARENT_ID}-01", (TRACE_ID, PARENT_ID)),
+    (f" 00-{TRACE_ID.upper()}-{PARENT_ID}-00 ", (TRACE_ID, PARENT_ID)),
+    (f"00-{'0' * 32}-{PARENT_ID}-01", None),
+    (f"00-{TRACE_ID}-{'0' * 16}-01", None),
+    (f"00-{TRACE_ID[:-1]}z-{PARENT_ID}-01", None),
+    (f"00-{TRACE_ID}-{PARENT_ID}", None),
+    (None, None)
+])
+def test_traceparent_parsing(header, expected):
+    assert tracing.Tracer.parse_traceparent(header) == expected
+
+
+def test_spans_nest_and_continue_the_callers_trace():
+    tracer = tracing.Tracer("test", store=tracing.TraceStore())
+
+    def decode():
+        with tracer.span("decode"):
+            pass
+
+    async def request():
+        with tracer.span("GET /data", parent=(TRACE_ID, PARENT_ID), kind="server") as root:
+            downstream = tracer.traceparent()
+            with tracer.span("fetch"):
+                await asyncio.to_thread(decode)
+            with pytest.raises(ValueError), tracer.span("encode"):
+                raise ValueError("bad frame")
+        return root, downstream
+
+    root, downstream = asyncio.run(request())
+    spans = {span["name"]: span for span in tracer.store.get(TRACE_ID)}
+    assert root["parent_id"] == PARENT_ID
+    assert downstream == f"00-{TRACE_ID}-{root['span_id']}-01"
+    assert spans["fetch"]["parent_id"] == root["span_id"]
+    # Worker threads inherit the active span
+    assert spans["decode"]["parent_id"] == spans["fetch"]["span_id"]
+    assert spans["encode"]["error"] == "ValueError: bad frame"
+    assert tracer.current.get() is None
+
+
+def test_otlp_round_trip_keeps_every_field():
+    spans = [
+        dict(span("GET /data/1min", "a" * 16, PARENT_ID, 0, 40), kind="server", service="data_service",
+             attributes={"rows": 1440, "cached": True, "ratio": 0.5, "format": "arrow"}),
+        dict(span("rollup", "b" * 16, "a" * 16, 5, 30), service="data_service", error="TimeoutError: slow"),
+        span("llm", "c" * 16, PARENT_ID, 10, 20)
+    ]
+    body = json.loads(json.dumps(tracing.spans_to_otlp(spans)))
+    assert len(body["resourceSpans"]) == 2
+    decoded = sorted(tracing.spans_from_otlp(body), key=lambda span: span["span_id"])
+    assert decoded == spans
+
+
+def test_critical_path_follows_the_slowest_overlapping_child():
+    spans = [
+        span("POST /detect_anomalies", "r" * 16, None, 0, 100),
+        span("data_fetch", "a" * 16, "r" * 16, 0, 40),
+        span("feature_pipeline", "b" * 16, "r" * 16, 40, 50),
+        span("anomaly_detection", "c" * 16, "r" * 16, 42, 48),
+        span("gpt_analysis", "d" * 16, "r" * 16, 50, 95),
+        span("llm", "e" * 16, "d" * 16, 55, 95)
+    ]
+    path = tracing.TraceStore.critical_path(spans)
+    assert [(step["name"], step["depth"]) for step in path] == [
+        ("POST /detect_anomalies", 0), ("data_fetch", 1), ("feature_pipeline", 1), ("gpt_analysis", 1), ("llm", 2)
+    ]
+    assert path[0]["self_ms"] == 5.0
+    assert path[3]["self_ms"] == 5.0
+
+
+def test_trace_store_keeps_the_most_recent_traces():
+    store = tracing.TraceStore(max_traces=2, max_spans=3)
+    for trace in ("t1", "t2", "t3"):
+        for i in range(5):
+            store.add(dict(span("op", f"{trace}-{i}", None, i, i + 1), trace_id=trace))
+    assert store.get("t1") == []
+    assert len(store.get("t3")) == 3
+    assert [summary["trace_id"] for summary in store.recent()] == ["t3", "t2"]
+
+
+def test_exporter_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        tracing.SpanExporter()
+
+
+def test_exporters_bound_their_buffer_and_log_failures(caplog):
+    exporter = ListExporter(max_batch=10, max_queue=4)
+    for i in range(5):
+        exporter.export({"span_id": i})
+    exporter.flush()
+    assert [[span["span_id"] for span in batch] for batch in exporter.batches] == [[0, 1, 2, 3]]
+
+    exporter.broken = True
+    exporter.export({"span_id": 5})
+    with caplog.at_level(logging.WARNING, logger="tracing"):
+        exporter.flush()
+    assert "Span export failed: collector unreachable" in caplog.text
+    assert exporter.stats() == {"exporter": "ListExporter", "exported": 4, "dropped": 2, "buffered": 0}
+
+
+def test_file_exporter_appends_json_lines(tmp_path):
+    path = tmp_path / "traces" / "spans.jsonl"
+    exporter = tracing.make_span_exporter("file", str(path))
+    exporter.export(span("op", "a" * 16, None, 0, 1))
+    exporter.flush()
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["op"]
+    assert tracing.make_span_exporter("", str(path)) is None
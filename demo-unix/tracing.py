@@ -0,0 +1,370 @@
+"""Request tracing shared by the data service and the LLM service.
+
+Spans are plain dicts that nest through a context variable and continue a
+caller's W3C ``traceparent``. Finished spans are kept in an optional
+in-memory TraceStore and shipped by an optional exporter: JSON lines to a
+file, or OTLP/HTTP JSON to a collector such as the LLM service's /v1/traces.
+"""
+import abc
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+class SpanExporter(abc.ABC):
+    """Ships finished spans in batches from a background thread.
+    
+    ``export`` only appends to a bounded buffer, so requests never wait on
+    the file or collector; spans arriving while ``max_queue`` are buffered
+    are dropped and counted. Subclasses implement ``write``.
+    """
+    
+    def __init__(self, flush_seconds=1.0, max_batch=512, max_queue=10000):
+        self.flush_seconds = flush_seconds
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.exported = 0
+        self.dropped = 0
+        self._buffer = deque()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+    
+    def export(self, span):
+        if len(self._buffer) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._buffer.append(span)
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+    
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+    
+    def flush(self):
+        with self._flush_lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.max_batch, len(self._buffer)))]
+                try:
+                    self.write(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.dropped += len(batch)
+                    logger.warning(f"Span export failed: {e}")
+    
+    @abc.abstractmethod
+    def write(self, spans):
+        """Deliver one batch of finished spans; exceptions count the batch as dropped"""
+    
+    def stats(self):
+        return {"exporter": type(self).__name__, "exported": self.exported,
+                "dropped": self.dropped, "buffered": len(self._buffer)}
+
+class FileSpanExporter(SpanExporter):
+    """Appends spans to a local file, one JSON object per line"""
+    
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+    
+    def write(self, spans):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(span, default=str) + "\n" for span in spans))
+
+class OTLPSpanExporter(SpanExporter):
+    """POSTs spans as OTLP/HTTP JSON to a collector's /v1/traces"""
+    
+    def __init__(self, endpoint, timeout=5.0, **kwargs):
+        super().__init__(**kwargs)
+        self.endpoint = endpoint
+        self.timeout = timeout
+    
+    def write(self, spans):
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(spans_to_otlp(spans)).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _from_otlp_value(value):
+    for kind, parse in (("stringValue", str), ("intValue", int), ("doubleValue", float), ("boolValue", bool)):
+        if kind in value:
+            return parse(value[kind])
+    return None
+
+def spans_to_otlp(spans):
+    """OTLP/JSON ExportTraceServiceRequest body with one resource per service"""
+    by_service = defaultdict(list)
+    for span in spans:
+        by_service[span["service"]].append({
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "parentSpanId": span["parent_id"] or "",
+            "name": span["name"],
+            "kind": SPAN_KINDS.get(span["kind"], 1),
+            "startTimeUnixNano": str(span["start_ns"]),
+            "endTimeUnixNano": str(span["end_ns"]),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span["attributes"].items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1}
+        })
+    return {"resourceSpans": [
+        {
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"scope": {"name": "der-tracing"}, "spans": service_spans}]
+        }
+        for service, service_spans in by_service.items()
+    ]}
+
+def spans_from_otlp(body):
+    """Span records from an OTLP/JSON ExportTraceServiceRequest body"""
+    kinds = {code: kind for kind, code in SPAN_KINDS.items()}
+    for resource_spans in body.get("resourceSpans", []):
+        resource = {
+            attribute["key"]: _from_otlp_value(attribute["value"])
+            for attribute in resource_spans.get("resource", {}).get("attributes", [])
+        }
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                start_ns, end_ns = int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+                status = span.get("status") or {}
+                yield {
+                    "trace_id": span["traceId"],
+                    "span_id": span["spanId"],
+                    "parent_id": span.get("parentSpanId") or None,
+                    "name": span["name"],
+                    "service": resource.get("service.name", "unknown"),
+                    "kind": kinds.get(span.get("kind"), "internal"),
+                    "start_ns": start_ns,
+                    "end_ns": end_ns,
+                    "duration_ms": round((end_ns - start_ns) / 1e6, 3),
+                    "attributes": {
+                        attribute["key"]: _from_otlp_value(attribute["value"])
+                        for attribute in span.get("attributes", [])
+                    },
+                    "error": status.get("message") or ("error" if status.get("code") == 2 else None)
+                }
+
+class TraceStore:
+    """Most recent traces held in memory for /traces lookups"""
+    
+    def __init__(self, max_traces=500, max_spans=1000):
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def add(self, span):
+        with self._lock:
+            spans = self._traces.get(span["trace_id"])
+            if spans is None:
+                spans = self._traces[span["trace_id"]] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            else:
+                self._traces.move_to_end(span["trace_id"])
+            if len(spans) < self.max_spans:
+                spans.append(span)
+    
+    def get(self, trace_id):
+        with self._lock:
+            return sorted(self._traces.get(trace_id, []), key=lambda span: span["start_ns"])
+    
+    def recent(self, limit=20):
+        with self._lock:
+            traces = list(self._traces.items())[-limit:]
+        summaries = []
+        for trace_id, spans in reversed(traces):
+            root = self.root(spans)
+            summaries.append({
+                "trace_id": trace_id,
+                "root": root["name"] if root else None,
+                "duration_ms": root["duration_ms"] if root else None,
+                "spans": len(spans),
+                "services": sorted({span["service"] for span in spans}),
+                "error": any(span["error"] for span in spans)
+            })
+        return summaries
+    
+    @staticmethod
+    def root(spans):
+        span_ids = {span["span_id"] for span in spans}
+        roots = [span for span in spans if span["parent_id"] not in span_ids]
+        return max(roots, key=lambda span: span["duration_ms"]) if roots else None
+    
+    @classmethod
+    def critical_path(cls, spans):
+        """Spans that bound the trace's latency, in start order with their nesting depth.
+        
+        Walking back from a span's end, each step takes the child that ended
+        last before the current point, then jumps to that child's start, so
+        sequential phases are all on the path but only the slowest of
+        overlapping ones is; a child that outlives its parent (a background
+        job, or clock skew between hosts) is taken first. ``self_ms`` is a
+        span's time outside its critical children, e.g. the framework and
+        JSON serialization for the root HTTP span.
+        """
+        children = defaultdict(list)
+        for span in spans:
+            children[span["parent_id"]].append(span)
+        path = []
+        
+        def walk(span, depth):
+            chain, cursor = [], None
+            for child in sorted(children[span["span_id"]], key=lambda child: child["end_ns"], reverse=True):
+                if cursor is None or child["end_ns"] <= cursor:
+                    chain.append(child)
+                    cursor = child["start_ns"]
+            path.append({
+                "name": span["name"],
+                "service": span["service"],
+                "span_id": span["span_id"],
+                "depth": depth,
+                "duration_ms": span["duration_ms"],
+                "self_ms": round(max(0.0, span["duration_ms"] - sum(child["duration_ms"] for child in chain)), 3)
+            })
+            for child in reversed(chain):
+                walk(child, depth + 1)
+        
+        root = cls.root(spans)
+        if root is not None:
+            walk(root, 0)
+        return path
+
+class Tracer:
+    """Nested timing spans with W3C ``traceparent`` propagation.
+    
+    The active span lives in a context variable, so spans opened in tasks
+    and ``asyncio.to_thread`` workers nest under the span that started them.
+    Finished spans go to the in-memory store and the exporter, where set.
+    """
+    
+    def __init__(self, service, exporter=None, store=None):
+        self.service = service
+        self.exporter = exporter
+        self.store = store
+        self.current = contextvars.ContextVar("current_span", default=None)
+    
+    @staticmethod
+    def parse_traceparent(header):
+        """(trace_id, span_id) of a valid ``traceparent`` header, else None"""
+        parts = (header or "").strip().lower().split("-")
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            if int(parts[1], 16) == 0 or int(parts[2], 16) == 0:
+                return None
+        except ValueError:
+            return None
+        return parts[1], parts[2]
+    
+    def traceparent(self):
+        """Header value that continues the active span's trace downstream"""
+        span = self.current.get()
+        return f"00-{span['trace_id']}-{span['span_id']}-01" if span else None
+    
+    def start_span(self, name, parent=None, kind="internal", **attributes):
+        """Open a span under ``parent`` (a (trace_id, span_id) pair) or the active span.
+        
+        Returns the span and a token for end_span, which must run in the same context.
+        """
+        if parent is None:
+            active = self.current.get()
+            parent = (active["trace_id"], active["span_id"]) if active else None
+        span = {
+            "trace_id": parent[0] if parent else os.urandom(16).hex(),
+            "span_id": os.urandom(8).hex(),
+            "parent_id": parent[1] if parent else None,
+            "name": name,
+            "service": self.service,
+            "kind": kind,
+            "start_ns": time.time_ns(),
+            "end_ns": None,
+            "duration_ms": None,
+            "attributes": attributes,
+            "error": None,
+            "_started": time.perf_counter()
+        }
+        return span, self.current.set(span)
+    
+    def end_span(self, span, token, error=None):
+        self.current.reset(token)
+        elapsed = time.perf_counter() - span.pop("_started")
+        span["end_ns"] = span["start_ns"] + int(elapsed * 1e9)
+        span["duration_ms"] = round(elapsed * 1000, 3)
+        if error is not None:
+            span["error"] = f"{type(error).__name__}: {error}"
+        self.record(span)
+    
+    def record(self, span):
+        """Keep a finished span, local or received from another service"""
+        if self.store is not None:
+            self.store.add(span)
+        if self.exporter is not None:
+            self.exporter.export(span)
+    
+    @contextlib.contextmanager
+    def span(self, name, parent=None, kind="internal", **attributes):
+        span, token = self.start_span(name, parent=parent, kind=kind, **attributes)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.end_span(span, token, error)
+    
+    def traced(self, name):
+        """Decorator running each call of a function or coroutine function in a span"""
+        def decorate(fn):
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await fn(*args, **kwargs)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+    
+    def stats(self):
+        return self.exporter.stats() if self.exporter is not None else {"exporter": None}
+
+def make_span_exporter(kind, default_file):
+    """Span exporter selected by TRACE_EXPORTER: file (TRACE_FILE, else ``default_file``), otlp or none"""
+    if kind == "file":
+        return FileSpanExporter(os.getenv("TRACE_FILE", default_file))
+    if kind == "otlp":
+        return OTLPSpanExporter(os.getenv("OTLP_ENDPOINT", "http://localhost:4318/v1/traces"))
+    return None
@@ -1,75 +1,670 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from collections import OrderedDict
+from pandas.tseries.frequencies import to_offset
+from tracing import Tracer, make_span_exporter
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import concurrent.futures
+import io
+import json
+import logging
 import os
+import shutil
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 # FastAPI app setup
 app = FastAPI(title="DER Data Aggregation API")
 
+# Request tracing: TRACE_EXPORTER=file appends spans as JSON lines to
+# TRACE_FILE, otlp posts them as OTLP/HTTP JSON to OTLP_ENDPOINT
+tracer = Tracer(
+    "data_service",
+    exporter=make_span_exporter(os.getenv("TRACE_EXPORTER", "").lower(), "/app/data/traces/data_service.jsonl")
+)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Root span per request, continuing the caller's trace when it sends a traceparent."""
+    with tracer.span(
+        f"{request.method} {request.url.path}",
+        parent=Tracer.parse_traceparent(request.headers.get("traceparent")),
+        kind="server",
+    ) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            span["name"] = f"{request.method} {route.path}"
+        span["attributes"]["status_code"] = response.status_code
+        response.headers["X-Trace-Id"] = span["trace_id"]
+        return response
+
 # File paths
 input_file_path = "/app/data/der_data.csv"
 output_dir = "/app/data/processed_results/"
-data_files = {
-    "1min": os.path.join(output_dir, "data_1min.csv"),
-    "3min": os.path.join(output_dir, "data_3min.csv"),
-    "5min": os.path.join(output_dir, "data_5min.csv"),
+pyramid_dir = os.path.join(output_dir, "pyramid")
+state_file_path = os.path.join(output_dir, "aggregator_state.json")
+
+# Resolution pyramid: level resolution -> span of one persisted partition.
+# The first level is the base resolution; every level must divide one day.
+pyramid_levels = {
+    "1s": "1h",
+    "1min": "1D",
+    "1h": "30D",
 }
+pyramid_stats = ["sum", "count", "min", "max"]
+# Newest partitions per level kept in memory; older ones are read back from
+# storage on demand. 24 one-hour partitions keep the last day of 1s buckets.
+pyramid_resident_partitions = {"1s": int(os.getenv("PYRAMID_RESIDENT_BASE_PARTITIONS", "24"))}
+raw_block_bytes = 64 * 1024 * 1024
 
-# Function to preprocess data
-def preprocess_data():
-    try:
-        if not os.path.exists(input_file_path):
-            raise FileNotFoundError(f"The file '{input_file_path}' does not exist.")
-        
-        data = pd.read_csv(input_file_path)
+# Pyramid partition format: "feather" (memory-mapped) or "parquet" (smallest)
+aggregate_storage = os.getenv("AGGREGATE_STORAGE", "feather")
+
+class ParquetStorage:
+    """Columnar, compressed partition files; smallest on disk."""
+
+    name = "parquet"
+    extension = ".parquet"
+
+    def write(self, frame, path):
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path)
+
+    def read(self, path):
+        return pq.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+class FeatherStorage:
+    """Uncompressed Arrow files, memory-mapped on read for near-zero-copy loads."""
+
+    name = "feather"
+    extension = ".feather"
+
+    def write(self, frame, path):
+        feather.write_feather(frame, path, compression="uncompressed")
+
+    def read(self, path):
+        return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+storage_backends = {backend.name: backend for backend in [FeatherStorage(), ParquetStorage()]}
+
+def offset_step(interval):
+    """Length of a fixed pandas offset; ``nanos`` also covers days, which pandas 3 no longer converts."""
+    return pd.Timedelta(to_offset(interval).nanos, unit="ns")
+
+class ResolutionPyramid:
+    """Multi-resolution sum/count/min/max store for the DER channels.
+
+    Every level keeps mergeable statistics per bucket, split into time
+    partitions. New rows are folded into the partitions they touch, and any
+    fixed interval is served by rolling up the coarsest level that divides it.
+    Levels listed in ``resident_partitions`` keep only their newest partitions
+    in memory; the rest stay on disk (None in ``partitions``) and are read
+    back when a roll-up or update needs them, so a long 1s history does not
+    have to fit in memory between requests.
+    """
+
+    def __init__(self, levels, storage_dir, storage, resident_partitions=None):
+        self.levels = levels
+        self.storage_dir = storage_dir
+        self.storage = storage
+        self.resident_partitions = resident_partitions or {}
+        self.partitions = {level: {} for level in levels}
+        self.version = 0
+        self._steps = {level: offset_step(level) for level in levels}
+
+    def resolve(self, interval):
+        """Return the level used to serve ``interval``; ValueError if it can't be served."""
+        try:
+            step = offset_step(interval)
+        except (ValueError, TypeError):
+            raise ValueError(f"'{interval}' is not a fixed pandas offset (e.g. 15s, 10min, 1h, 1D).")
+        if step <= pd.Timedelta(0):
+            raise ValueError(f"Interval '{interval}' must be positive.")
+
+        candidates = [level for level, level_step in self._steps.items() if step % level_step == pd.Timedelta(0)]
+        if not candidates:
+            base = next(iter(self.levels))
+            raise ValueError(f"Interval '{interval}' is not a multiple of the {base} base resolution.")
+        return max(candidates, key=lambda level: self._steps[level])
+
+    def update(self, numeric_data):
+        """Fold raw rows into every level. Returns the touched (level, partition) keys."""
+        touched = []
+        for level, span in self.levels.items():
+            grouped = numeric_data.groupby(numeric_data.index.floor(level))
+            buckets = pd.concat({
+                "sum": grouped.sum(),
+                "count": grouped.count(),
+                "min": grouped.min(),
+                "max": grouped.max(),
+            }, axis=1)
+
+            for key, part in buckets.groupby(buckets.index.floor(span)):
+                existing = self._partition(level, key) if key in self.partitions[level] else None
+                self.partitions[level][key] = part if existing is None else self._combine(existing, part)
+                touched.append((level, key))
+
+        self.version += 1
+        return touched
+
+    @staticmethod
+    def _combine(old, new):
+        index = old.index.union(new.index)
+        old = old.reindex(index)
+        new = new.reindex(index)
+        return pd.concat({
+            "sum": old["sum"].add(new["sum"], fill_value=0),
+            "count": old["count"].add(new["count"], fill_value=0),
+            "min": np.fmin(old["min"], new["min"]),
+            "max": np.fmax(old["max"], new["max"]),
+        }, axis=1)
+
+    def rollup(self, interval, stat="mean"):
+        """Aggregate the pyramid to ``interval``, matching ``resample(interval).<stat>()``."""
+        level = self.resolve(interval)
+        # Partitions are replaced, never modified, so a snapshot of the dict is consistent
+        partitions = dict(self.partitions[level])
+        parts = [self._partition(level, key, partitions[key]) for key in sorted(partitions)]
+        if not parts:
+            return pd.DataFrame()
+
+        frame = pd.concat(parts)
+        frame.index.name = "datetimestamp"
+        if stat in ("sum", "count"):
+            return frame[stat].resample(interval).sum()
+        if stat == "min":
+            return frame["min"].resample(interval).min()
+        if stat == "max":
+            return frame["max"].resample(interval).max()
+
+        sums = frame["sum"].resample(interval).sum()
+        counts = frame["count"].resample(interval).sum()
+        return sums / counts.where(counts > 0)
+
+    def _partition_path(self, level, key):
+        return os.path.join(self.storage_dir, level, f"{key:%Y%m%dT%H%M%S}{self.storage.extension}")
+
+    def _partition(self, level, key, part=None):
+        """A partition's frame, read back from storage if it was spilled"""
+        part = self.partitions[level][key] if part is None else part
+        return self._read(self._partition_path(level, key)) if part is None else part
+
+    def _read(self, path):
+        flat = self.storage.read(path).set_index("datetimestamp")
+        flat.columns = pd.MultiIndex.from_tuples([tuple(c.split(":", 1)) for c in flat.columns])
+        return flat
+
+    def save(self, touched):
+        for level, key in set(touched):
+            path = self._partition_path(level, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            part = self.partitions[level][key]
+            flat = part.copy()
+            flat.columns = [f"{stat}:{column}" for stat, column in part.columns]
+            flat.index.name = "datetimestamp"
+            # Spilled partitions are read concurrently by roll-ups; never expose a half-written file
+            self.storage.write(flat.reset_index(), f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+        self._spill()
+
+    def _spill(self):
+        """Drop all but the newest resident partitions of each bounded level from memory"""
+        for level, limit in self.resident_partitions.items():
+            resident = sorted(key for key, part in self.partitions[level].items() if part is not None)
+            for key in resident[:max(0, len(resident) - limit)]:
+                self.partitions[level][key] = None
+
+    def load(self):
+        for level in self.levels:
+            level_dir = os.path.join(self.storage_dir, level)
+            if not os.path.isdir(level_dir):
+                continue
+            keys = sorted(
+                pd.Timestamp(os.path.splitext(name)[0])
+                for name in os.listdir(level_dir) if name.endswith(self.storage.extension)
+            )
+            limit = self.resident_partitions.get(level, len(keys))
+            for i, key in enumerate(keys):
+                resident = i >= len(keys) - limit
+                self.partitions[level][key] = self._read(self._partition_path(level, key)) if resident else None
+        self.version += 1
+
+    def clear(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+        self.partitions = {level: {} for level in self.levels}
+        self.version += 1
+
+class IncrementalAggregator:
+    """Keeps the resolution pyramid up to date as rows are appended.
+
+    The raw CSV is tailed from a persisted byte offset, so a refresh only
+    parses the new rows and rewrites the pyramid partitions they touch.
+    Malformed rows are skipped and counted rather than retried forever.
+    """
+
+    def __init__(self, input_path, pyramid, state_path):
+        self.input_path = input_path
+        self.pyramid = pyramid
+        self.state_path = state_path
+        self._state = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Fold newly appended raw rows into the pyramid. Returns the row count."""
+        with self._lock:
+            if not os.path.exists(self.input_path):
+                raise FileNotFoundError(f"The file '{self.input_path}' does not exist.")
+
+            size = os.path.getsize(self.input_path)
+            if self._state is None or self._state['offset'] > size:
+                self._state = self._load_state(size)
+            if size == self._state['offset']:
+                return 0
+
+            rows = 0
+            with open(self.input_path, "rb") as f:
+                f.seek(self._state['offset'])
+                while self._state['offset'] < size:
+                    block = f.read(min(raw_block_bytes, size - self._state['offset']))
+                    # Leave a partially written trailing line for the next refresh
+                    block = block[:block.rfind(b"\n") + 1]
+                    if not block:
+                        break
+                    f.seek(self._state['offset'] + len(block))
+                    rows += self._apply(block)
+            return rows
+
+    @property
+    def data_version(self):
+        """Opaque version of the aggregated data; changes whenever new rows are folded in."""
+        return str(self._state['offset']) if self._state else "0"
+
+    def _read_header(self):
+        with open(self.input_path, "rb") as f:
+            return f.readline().decode("utf-8")
+
+    def _initial_state(self):
+        self.pyramid.clear()
+        header = self._read_header()
+        return {
+            'header': header,
+            'storage': self.pyramid.storage.name,
+            'offset': len(header.encode("utf-8")),
+            'columns': None,
+            'pending': False,
+            'skipped_rows': 0
+        }
+
+    def _load_state(self, size):
+        """Load the persisted state, falling back to a full rebuild if it is stale."""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return self._initial_state()
+
+        if (state.get('pending') or state.get('header') != self._read_header()
+                or state.get('storage') != self.pyramid.storage.name
+                or state.get('offset', 0) > size):
+            return self._initial_state()
+        self.pyramid.load()
+        return state
+
+    def _save_state(self, state):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _parse(self, block):
+        """Numeric rows of a block; returns them with the number of malformed rows skipped"""
+        data = pd.read_csv(
+            io.BytesIO(self._state['header'].encode("utf-8") + block),
+            on_bad_lines="skip",
+            encoding_errors="replace"
+        )
         if 'datetimestamp' not in data.columns:
             raise KeyError("'datetimestamp' column is missing.")
         data['datetimestamp'] = pd.to_datetime(data['datetimestamp'], errors='coerce')
-        if data['datetimestamp'].isnull().any():
-            raise ValueError("Invalid 'datetimestamp' values detected.")
+        data = data[data['datetimestamp'].notnull()]
         data.set_index('datetimestamp', inplace=True)
-        if not isinstance(data.index, pd.DatetimeIndex):
-            raise TypeError("Index is not a DatetimeIndex.")
-        numeric_data = data.select_dtypes(include=['number'])
-        data_1min = numeric_data.resample('1min').mean()
-        data_3min = numeric_data.resample('3min').mean()
-        data_5min = numeric_data.resample('5min').mean()
-        os.makedirs(output_dir, exist_ok=True)
-        data_1min.to_csv(data_files["1min"])
-        data_3min.to_csv(data_files["3min"])
-        data_5min.to_csv(data_files["5min"])
-        print("Data aggregation completed successfully.")
+        skipped = block.count(b"\n") - len(data)
+
+        if self._state['columns'] is None:
+            self._state['columns'] = data.select_dtypes(include=['number']).columns.tolist()
+        return data[self._state['columns']].apply(pd.to_numeric, errors='coerce'), skipped
+
+    def _apply(self, block):
+        numeric_data, skipped = self._parse(block)
+        if skipped:
+            # Bad lines never parse; step past them so later rows still get in
+            logger.warning(
+                f"Skipped {skipped} malformed row(s) in {self.input_path} "
+                f"(bytes {self._state['offset']}-{self._state['offset'] + len(block)})"
+            )
+            self._state['skipped_rows'] = self._state.get('skipped_rows', 0) + skipped
+        if not numeric_data.empty:
+            touched = self.pyramid.update(numeric_data)
+            # Mark the state pending while partitions are rewritten, so a crash
+            # in between forces a rebuild instead of double-counting rows.
+            self._save_state(dict(self._state, pending=True))
+            self.pyramid.save(touched)
+        self._state['offset'] += len(block)
+        self._save_state(self._state)
+        return len(numeric_data)
+
+pyramid = ResolutionPyramid(
+    pyramid_levels, pyramid_dir, storage_backends[aggregate_storage], resident_partitions=pyramid_resident_partitions
+)
+aggregator = IncrementalAggregator(input_file_path, pyramid, state_file_path)
+
+# Function to preprocess data
+def preprocess_data():
+    try:
+        with tracer.span("refresh") as span:
+            rows = aggregator.refresh()
+            span["attributes"]["new_rows"] = rows or 0
+        if rows:
+            logger.info(f"Data aggregation completed successfully ({rows} new rows).")
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error(f"Data aggregation failed: {e}")
+
+# Wire formats for /data/{interval}: format name -> media type
+wire_formats = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+ndjson_chunk_rows = 10000
+# pandas rounds JSON floats to 10 digits by default; 15 is the most it keeps
+json_double_precision = 15
+
+def encode_frame(df, fmt="json"):
+    """Serialize a roll-up as JSON records, an Arrow IPC stream, Parquet or a CSV export."""
+    if fmt == "csv":
+        return df.to_csv().encode("utf-8")
+    if fmt == "ndjson":
+        return b"".join(iter_ndjson(df))
+    if fmt == "json":
+        return _json_records(df).to_json(orient="records", double_precision=json_double_precision).encode("utf-8")
+
+    records = df.reset_index()
+
+    table = pa.Table.from_pandas(records, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    if fmt == "arrow":
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+def _json_records(df):
+    records = df.reset_index()
+    if 'datetimestamp' in records.columns:
+        records['datetimestamp'] = records['datetimestamp'].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return records
+
+def iter_ndjson(df, chunk_rows=ndjson_chunk_rows):
+    """Yield a roll-up as newline-delimited JSON, one bounded chunk of rows at a time."""
+    for lo in range(0, len(df), chunk_rows):
+        chunk = _json_records(df.iloc[lo:lo + chunk_rows])
+        records = chunk.to_json(orient="records", lines=True, double_precision=json_double_precision)
+        yield records.rstrip("\n").encode("utf-8") + b"\n"
+
+def negotiate_format(fmt, accept):
+    """Pick the wire format from ``?format=`` or, failing that, the Accept header."""
+    if fmt:
+        if fmt not in wire_formats:
+            raise ValueError(f"Invalid format '{fmt}'. Valid formats: {', '.join(wire_formats)}.")
+        return fmt
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip()
+        for name, candidate in wire_formats.items():
+            if media_type == candidate:
+                return name
+    return "json"
+
+class AggregateCache:
+    """In-memory columnar store for the rolled-up interval data.
+
+    Each (interval, stat) roll-up is kept as a DataFrame together with its
+    already-serialized payload per wire format. Entries are rebuilt only when
+    the pyramid version changes, so repeated fetches cost a memory copy.
+    Roll-ups are built outside the cache lock: concurrent requests for the
+    same stale entry wait for one build, other keys are served meanwhile.
+    """
+
+    def __init__(self, pyramid, max_entries=32):
+        self.pyramid = pyramid
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def get(self, interval, stat="mean"):
+        key = (interval, stat)
+        with self._lock:
+            version = self.pyramid.version
+            entry = self._entries.get(key)
+            if entry is not None and entry['version'] == version:
+                self._entries.move_to_end(key)
+                return entry
+            build = self._building.get(key)
+            owner = build is None
+            if owner:
+                build = self._building[key] = concurrent.futures.Future()
+        if not owner:
+            return build.result()
+
+        try:
+            entry = {'version': version, 'frame': self.pyramid.rollup(interval, stat), 'payloads': {}}
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            build.set_exception(e)
+            raise
+        with self._lock:
+            del self._building[key]
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        build.set_result(entry)
+        return entry
+
+    @staticmethod
+    def payload(entry, fmt="json"):
+        """Serialized payload of a cached entry, encoded on first use."""
+        if fmt not in entry['payloads']:
+            entry['payloads'][fmt] = encode_frame(entry['frame'], fmt)
+        return entry['payloads'][fmt]
+
+aggregate_cache = AggregateCache(pyramid)
 
 # Preprocess the data on startup
 preprocess_data()
 
-@app.get("/data/{interval}")
-def get_data(interval: str):
+def parse_bound(value, index):
+    """A ``start``/``end`` bound as a Timestamp comparable with ``index``.
+
+    Naive bounds are read in the index's timezone. Aware bounds are converted
+    to it; a naive index holds UTC (datetimestamp is the UTC form of the raw
+    ``time`` column), so they are converted to UTC and made naive.
     """
-    Endpoint for fetching aggregated data.
+    bound = pd.Timestamp(value)
+    if bound is pd.NaT:
+        raise ValueError(f"Invalid timestamp '{value}'.")
+    if bound.tz is None:
+        return bound.tz_localize(index.tz) if index.tz is not None else bound
+    return bound.tz_convert(index.tz) if index.tz is not None else bound.tz_convert("UTC").tz_localize(None)
+
+def select_rows(frame, start=None, end=None, columns=None, limit=None):
+    """Slice a roll-up by time range and columns without scanning it.
+
+    The DatetimeIndex is sorted, so ``start``/``end`` (both inclusive) are
+    resolved with a binary search and the result is a positional slice.
     """
-    if interval not in data_files:
+    lo = frame.index.searchsorted(parse_bound(start, frame.index), side="left") if start else 0
+    hi = frame.index.searchsorted(parse_bound(end, frame.index), side="right") if end else len(frame)
+    if limit is not None:
+        hi = min(hi, lo + limit)
+
+    selected = frame.iloc[lo:max(lo, hi)]
+    if columns:
+        missing = [column for column in columns if column not in frame.columns]
+        if missing:
+            raise ValueError(f"Unknown columns: {', '.join(missing)}.")
+        selected = selected[columns]
+    return selected
+
+def load_rollup(interval, stat):
+    """Validate ``interval``/``stat`` and return the cached roll-up entry and its data version."""
+    try:
+        pyramid.resolve(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if stat not in ["mean"] + pyramid_stats:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid interval '{interval}'. Valid intervals: '1min', '3min', '5min'."
+            detail=f"Invalid stat '{stat}'. Valid stats: {', '.join(['mean'] + pyramid_stats)}."
         )
-    
-    file_path = data_files[interval]
-    try:
-        df = pd.read_csv(file_path)
-        return df.to_dict(orient="records")
-    except FileNotFoundError:
+
+    # Pick up rows appended to the raw file since the last refresh
+    preprocess_data()
+    # Read before the roll-up so a concurrent refresh can only make the version stale, never ahead
+    version = aggregator.data_version
+    with tracer.span("rollup", interval=interval, stat=stat) as span:
+        entry = aggregate_cache.get(interval, stat)
+        span["attributes"]["rows"] = len(entry['frame'])
+    if entry['frame'].empty:
         raise HTTPException(
             status_code=404,
-            detail=f"Aggregated data file for interval '{interval}' not found."
+            detail=f"Aggregated data for interval '{interval}' not found."
         )
+    return entry, version
+
+def select_request_rows(entry, start, end, columns, limit):
+    """Apply the request's time range, column and row-limit narrowing to a roll-up."""
+    if not any([start, end, columns, limit]):
+        return entry['frame']
+    try:
+        return select_rows(
+            entry['frame'],
+            start=start,
+            end=end,
+            columns=[c.strip() for c in columns.split(",") if c.strip()] if columns else None,
+            limit=limit
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def frame_meta(frame):
+    """Row count and in-memory size of a roll-up slice.
+
+    Roll-ups are all numeric with a DatetimeIndex, so the shallow memory
+    usage is exact and costs O(columns), not O(rows). It is the decoded
+    size, not the size on the wire, which depends on the format.
+    """
+    return {"rows": len(frame), "memory_bytes": int(frame.memory_usage(index=True, deep=False).sum())}
+
+@app.get("/data/{interval}")
+def get_data(
+    interval: str,
+    stat: str = "mean",
+    start: str = None,
+    end: str = None,
+    columns: str = None,
+    limit: int = Query(None, ge=1),
+    format: str = None,
+    accept: str = Header(None)
+):
+    """
+    Endpoint for fetching aggregated data.
+
+    ``interval`` may be any fixed pandas offset that is a multiple of the base
+    resolution (e.g. 15s, 1min, 10min, 1h, 1D). ``stat`` selects the bucket
+    statistic: mean (default), sum, count, min or max. ``start``/``end``
+    (inclusive timestamps, UTC unless they carry an offset), ``columns``
+    (comma-separated) and ``limit`` narrow the response. The body is JSON records unless ``format`` or the
+    Accept header asks for an Arrow IPC stream, Parquet, CSV or streamed
+    NDJSON. ``X-Data-Version`` identifies the aggregated data it was cut from;
+    ``X-Row-Count`` and ``X-Memory-Bytes`` give the rows served and their
+    in-memory size, so clients can size a pull without measuring it; the
+    encoded size is the Content-Length.
+    """
+    try:
+        fmt = negotiate_format(format, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    entry, version = load_rollup(interval, stat)
+    selected = select_request_rows(entry, start, end, columns, limit)
+    meta = frame_meta(selected)
+    headers = {"X-Data-Version": version, "X-Row-Count": str(meta["rows"]), "X-Memory-Bytes": str(meta["memory_bytes"])}
+
+    if selected is entry['frame'] and fmt != "ndjson":
+        with tracer.span("encode", format=fmt, cached=fmt in entry['payloads']) as span:
+            content = aggregate_cache.payload(entry, fmt)
+            span["attributes"]["bytes"] = len(content)
+        return Response(content=content, media_type=wire_formats[fmt], headers=headers)
+
+    if fmt == "ndjson":
+        # Stream in chunks rather than materializing the whole body
+        return StreamingResponse(iter_ndjson(selected), media_type=wire_formats[fmt], headers=headers)
+    with tracer.span("encode", format=fmt, cached=False, rows=len(selected)) as span:
+        content = encode_frame(selected, fmt)
+        span["attributes"]["bytes"] = len(content)
+    return Response(content=content, media_type=wire_formats[fmt], headers=headers)
+
+@app.get("/data/{interval}/meta")
+def get_data_meta(
+    interval: str,
+    stat: str = "mean",
+    start: str = None,
+    end: str = None,
+    columns: str = None,
+    limit: int = Query(None, ge=1)
+):
+    """
+    Size of a /data/{interval} pull without transferring it.
+
+    Takes the same ``stat``, ``start``, ``end``, ``columns`` and ``limit``
+    parameters and returns the row count, in-memory size, column names,
+    time range and data version of the rows /data would serve. For an
+    unfiltered pull, ``payload_bytes`` gives the size of each wire format
+    already encoded.
+    """
+    entry, version = load_rollup(interval, stat)
+    selected = select_request_rows(entry, start, end, columns, limit)
+    meta = dict(
+        frame_meta(selected),
+        interval=interval,
+        stat=stat,
+        columns=list(selected.columns),
+        start=str(selected.index[0]) if len(selected) else None,
+        end=str(selected.index[-1]) if len(selected) else None,
+        data_version=version
+    )
+    if selected is entry['frame']:
+        meta["payload_bytes"] = {fmt: len(payload) for fmt, payload in list(entry['payloads'].items())}
+    return meta
 
 # Sample welcome endpoint
 @app.get("/")
 def read_root():
     return {
         "message": "Welcome to the DER Data Aggregation FastAPI service!",
-        "endpoints": ["/data/1min", "/data/3min", "/data/5min"]
-    }
\ No newline at end of file
+        "endpoints": ["/data/1min", "/data/3min", "/data/5min", "/data/{interval}", "/data/{interval}/meta"],
+        "pyramid_levels": list(pyramid_levels)
+    }
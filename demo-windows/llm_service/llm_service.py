@@ -1,15 +1,29 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import hashlib
 import logging
+import math
 import os
+import random
+import shutil
+import sqlite3
 import time
 import threading
-import requests
+import httpx
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
 from dotenv import load_dotenv
-from collections import defaultdict
-from openai import OpenAI
+from collections import OrderedDict, defaultdict, deque
+from openai import AsyncOpenAI, RateLimitError
+from tracing import Tracer, TraceStore, make_span_exporter, spans_from_otlp
 import json
 import warnings
 warnings.filterwarnings('ignore')
@@ -21,24 +35,617 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Job records, forecast models and trace files live here unless JOB_DB,
+# FORECAST_MODEL_DIR or TRACE_FILE say otherwise
+SERVICE_DATA_DIR = os.getenv("SERVICE_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+class LatencyHistogram:
+    """Log-linear (HDR-style) histogram with a fixed number of buckets.
+    
+    Each power of two between ``min_value`` and ``max_value`` is split into
+    ``sub_buckets`` linear buckets, so quantiles carry at most ~1/sub_buckets
+    relative error. Recording is O(1); memory never grows.
+    """
+    
+    def __init__(self, min_value=1e-4, max_value=3600.0, sub_buckets=32):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.sub_buckets = sub_buckets
+        octaves = int(np.ceil(np.log2(max_value / min_value)))
+        # Bucket 0 holds underflow, the last bucket overflow
+        self.counts = [0] * (octaves * sub_buckets + 2)
+        self.total = 0
+    
+    def _index(self, value):
+        if value < self.min_value:
+            return 0
+        mantissa, exponent = math.frexp(value / self.min_value)
+        sub = int((mantissa * 2 - 1) * self.sub_buckets)
+        return min(1 + (exponent - 1) * self.sub_buckets + sub, len(self.counts) - 1)
+    
+    def _value(self, index):
+        if index == 0:
+            return self.min_value
+        if index == len(self.counts) - 1:
+            return self.max_value
+        octave, sub = divmod(index - 1, self.sub_buckets)
+        return self.min_value * 2 ** octave * (1 + (sub + 0.5) / self.sub_buckets)
+    
+    def record(self, value):
+        self.counts[self._index(value)] += 1
+        self.total += 1
+    
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+    
+    def quantile(self, q):
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self._value(index)
+        return self.max_value
+    
+    def percentiles(self):
+        return {name: round(self.quantile(q), 4) if self.total else None
+                for name, q in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99))}
+
+class BucketHistogram:
+    """Cumulative-bucket histogram in the Prometheus layout (fixed ``le`` bounds)"""
+    
+    BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class RunningStats:
+    """Count, sum, min and max of a stream; None samples are skipped"""
+    
+    __slots__ = ("count", "total", "min", "max")
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+    
+    def add(self, value):
+        if value is None:
+            return
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+    
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+class LLMUsage:
+    """Token usage and spend of the LLM completions made for one request"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.unpriced_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.by_model = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+    
+    def add(self, model, prompt_tokens, completion_tokens, cost):
+        """Record one completion; ``cost`` is None when the model has no price"""
+        entry = self.by_model[model]
+        entry["calls"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["cost"] += cost or 0.0
+        self.calls += 1
+        self.unpriced_calls += cost is None
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += cost or 0.0
+    
+    def merge(self, other):
+        self.calls += other.calls
+        self.unpriced_calls += other.unpriced_calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+        for model, entry in other.by_model.items():
+            for field, value in entry.items():
+                self.by_model[model][field] += value
+    
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": round(self.cost, 6),
+            "unpriced_calls": self.unpriced_calls,
+            "by_model": {model: dict(entry, cost=round(entry["cost"], 6)) for model, entry in self.by_model.items()}
+        }
+
+class MetricsRegistry:
+    """Bounded, streaming aggregates of operation and cost metrics.
+    
+    Every operation and every (operation, interval) cost series keeps
+    running count/sum/min/max, a latency histogram and a fixed-size ring
+    buffer of recent samples. Recording and reading are O(1) per series,
+    and memory stays bounded however long the service runs.
+    """
+    
+    RESOURCE_FIELDS = ("cpu_seconds", "cpu_percent", "rss_mb", "rss_delta_mb",
+                       "peak_rss_mb", "peak_delta_mb", "io_read_kb", "io_write_kb")
+    
+    def __init__(self, recent_samples=100):
+        self.recent_samples = recent_samples
+        self.operations = {}
+        self.costs = {}
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.lock = threading.Lock()
+        # Endpoint whose request is being served; labels phase timings
+        self.current_operation = contextvars.ContextVar("current_operation", default="none")
+        # LLMUsage of the request being served; completions add their tokens to it
+        self.current_llm_usage = contextvars.ContextVar("current_llm_usage", default=None)
+    
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+    
+    def increment(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[self._key(name, labels)] += value
+    
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = BucketHistogram()
+            histogram.observe(value)
+    
+    @contextlib.contextmanager
+    def phase(self, name, **attributes):
+        """Time a phase (data_fetch, llm, cost_calculation, ...) of the current request; also a tracing span"""
+        started = time.perf_counter()
+        try:
+            with tracer.span(name, **attributes) as span:
+                yield span
+        finally:
+            self.observe("phase_duration_seconds", time.perf_counter() - started,
+                         endpoint=self.current_operation.get(), phase=name)
+    
+    def record_operation(self, performance):
+        with self.lock:
+            entry = self.operations.get(performance['operation'])
+            if entry is None:
+                entry = self.operations[performance['operation']] = {
+                    'duration': RunningStats(),
+                    'latency': LatencyHistogram(),
+                    'resources': {field: RunningStats() for field in self.RESOURCE_FIELDS},
+                    'recent': deque(maxlen=self.recent_samples)
+                }
+            entry['duration'].add(performance['duration'])
+            entry['latency'].record(performance['duration'])
+            labels = {"endpoint": performance['operation']}
+            self.counters[self._key("requests_total", labels)] += 1
+            key = self._key("request_duration_seconds", labels)
+            if key not in self.histograms:
+                self.histograms[key] = BucketHistogram()
+            self.histograms[key].observe(performance['duration'])
+            for field, stats in entry['resources'].items():
+                stats.add(performance['resources'].get(field))
+            entry['recent'].append(performance)
+    
+    def usage_summary(self):
+        """Operation and cost-calculation counts, read under the lock"""
+        with self.lock:
+            return {
+                "operations": sum(entry['duration'].count for entry in self.operations.values()),
+                "cost_calculations": sum(entry['cheapest_cost'].count for entry in self.costs.values()),
+                "operation_names": len(self.operations),
+                "intervals": sorted({interval for _, interval in self.costs})
+            }
+    
+    METRIC_HELP = {
+        "requests_total": ("counter", "Requests served, by endpoint"),
+        "request_duration_seconds": ("histogram", "End-to-end request latency"),
+        "phase_duration_seconds": ("histogram", "Time spent per request phase (data_fetch, llm, cost_calculation)"),
+        "llm_requests_total": ("counter", "LLM completions, by endpoint and outcome"),
+        "llm_tokens_total": ("counter", "LLM tokens used, by endpoint, model and type"),
+        "llm_cost_dollars_total": ("counter", "LLM spend priced from response token usage, by endpoint and model"),
+        "llm_cache_hits_total": ("counter", "GPT analyses served from the response cache, by endpoint"),
+        "cost_estimate_dollars_total": ("counter", "Sum of cheapest-provider cost estimates"),
+    }
+    
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+            for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+    
+    def render(self, gauges=(), prefix="der_"):
+        """Prometheus text exposition (format 0.0.4) of every counter and histogram.
+        
+        ``gauges`` adds point-in-time values as (name, help, [(labels, value)]).
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(h.counts), h.sum, h.count, h.bounds)) for key, h in self.histograms.items()
+            )
+        
+        families = defaultdict(list)
+        for (name, labels), value in counters:
+            families[name].append(f"{prefix}{name}{self._labels(labels)} {value:g}")
+        for (name, labels), (counts, total, count, bounds) in histograms:
+            cumulative = 0
+            for bound, bucket in zip(list(bounds) + ["+Inf"], counts):
+                cumulative += bucket
+                families[name].append(f"{prefix}{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+            families[name].append(f"{prefix}{name}_sum{self._labels(labels)} {total:g}")
+            families[name].append(f"{prefix}{name}_count{self._labels(labels)} {count}")
+        
+        lines = []
+        for name, samples in families.items():
+            kind, description = self.METRIC_HELP.get(name, ("untyped", name))
+            lines += [f"# HELP {prefix}{name} {description}", f"# TYPE {prefix}{name} {kind}"] + samples
+        for name, description, samples in gauges:
+            lines += [f"# HELP {prefix}{name} {description}", f"# TYPE {prefix}{name} gauge"]
+            lines += [
+                f"{prefix}{name}{self._labels(tuple(sorted(labels.items())))} {value:g}"
+                for labels, value in samples if value is not None
+            ]
+        return "\n".join(lines) + "\n"
+    
+    def counter_total(self, name, **labels):
+        """Sum of a counter across every label set matching ``labels``"""
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (counter, key), value in self.counters.items() if counter == name and wanted <= set(key))
+    
+    def record_cost(self, operation, interval, cost_data):
+        with self.lock:
+            entry = self.costs.get((operation, interval))
+            if entry is None:
+                entry = self.costs[(operation, interval)] = {
+                    'cheapest_cost': RunningStats(),
+                    'hourly_rate': RunningStats(),
+                    'providers': defaultdict(RunningStats),
+                    'cheapest_provider': None,
+                    'llm_cost': RunningStats(),
+                    'llm_tokens': {'prompt': 0, 'completion': 0},
+                    'llm_calls': 0,
+                    'recent': deque(maxlen=self.recent_samples)
+                }
+            cheapest = cost_data['cheapest_provider']
+            llm = cost_data.get('llm_usage')
+            if llm is not None:
+                entry['llm_cost'].add(llm['cost'])
+                entry['llm_tokens']['prompt'] += llm['prompt_tokens']
+                entry['llm_tokens']['completion'] += llm['completion_tokens']
+                entry['llm_calls'] += llm['calls']
+            entry['cheapest_cost'].add(cost_data['cheapest_cost'])
+            entry['hourly_rate'].add(cost_data['costs_by_provider'][cheapest]['hourly_rate'])
+            for provider, costs in cost_data['costs_by_provider'].items():
+                entry['providers'][provider].add(costs['total'])
+            entry['cheapest_provider'] = cheapest
+            self.counters[self._key("cost_estimate_dollars_total", {"endpoint": operation, "interval": interval})] += cost_data['cheapest_cost']
+            entry['recent'].append({'cost_data': cost_data, 'timestamp': datetime.utcnow().isoformat()})
+
 # Performance tracking with cost metrics
-performance_metrics = defaultdict(list)
-cost_metrics = defaultdict(list)  # Separate cost tracking
-metrics_lock = threading.Lock()
+metrics_registry = MetricsRegistry(recent_samples=int(os.getenv("METRICS_RECENT_SAMPLES", "100")))
+
+# Request tracing; spans are always kept in memory and optionally exported
+tracer = Tracer(
+    "llm_service",
+    exporter=make_span_exporter(
+        os.getenv("TRACE_EXPORTER", "").lower(), os.path.join(SERVICE_DATA_DIR, "traces", "llm_service.jsonl")
+    ),
+    store=TraceStore(max_traces=int(os.getenv("TRACE_MAX_TRACES", "500")))
+)
+
+class SingleFlight:
+    """Coalesces concurrent identical calls onto one in-flight task.
+    
+    Callers with the same key await the same result, so the value must be
+    treated as read-only. A waiter that is cancelled does not cancel the
+    shared call while others still wait on it; once the last waiter is
+    cancelled the call is cancelled too.
+    """
+    
+    def __init__(self):
+        self._calls = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+    
+    async def do(self, key, fn):
+        entry = self._calls.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(fn())
+            entry = self._calls[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _, key=key, entry=entry: self._forget(key, entry))
+            self.stats["calls"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(entry["task"])
+        finally:
+            entry["waiters"] -= 1
+            if not entry["waiters"] and not entry["task"].done():
+                entry["task"].cancel()
+    
+    def _forget(self, key, entry):
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+class LLMDispatcher:
+    """Bounded-concurrency scheduler for chat completions.
+    
+    Requests wait in one queue per endpoint type. A fixed pool of workers
+    caps the number of completions in flight, serves the highest-priority
+    non-empty queue first and round-robins between queues of equal
+    priority. A 429 pauses every worker for the Retry-After (or a jittered
+    exponential backoff) before the request is retried.
+    """
+    
+    # Lower runs first; interactive queries go ahead of bulk ML summaries
+    PRIORITIES = {
+        "query_gpt": 0,
+        "analyze_data": 1,
+        "detect_anomalies": 2,
+        "cluster_analysis": 2,
+        "predictive_analysis": 2,
+        "comprehensive_ml_analysis": 2,
+        "compare_intervals": 2
+    }
+    DEFAULT_PRIORITY = 1
+    
+    def __init__(self, client, max_in_flight=4, max_retries=4, backoff_seconds=1.0):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.completed = 0
+        self.rate_limited = 0
+        self._loop = None
+    
+    def _ensure_workers(self):
+        # Queues and workers belong to the running event loop
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queues = defaultdict(deque)
+        self._rotation = deque()
+        self._pending = asyncio.Semaphore(0)
+        self._paused_until = 0.0
+        self.in_flight = 0
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.max_in_flight)]
+    
+    async def create(self, endpoint="default", **request):
+        """Queue a chat completion for ``endpoint`` and wait for its response"""
+        self._ensure_workers()
+        future = self._loop.create_future()
+        with metrics_registry.phase("llm") as span:
+            # The worker's completion span nests under this one
+            self._queues[endpoint].append((request, future, (span["trace_id"], span["span_id"])))
+            if endpoint not in self._rotation:
+                self._rotation.append(endpoint)
+            self._pending.release()
+            try:
+                response = await future
+            except Exception:
+                metrics_registry.increment("llm_requests_total", endpoint=endpoint, outcome="error")
+                raise
+        metrics_registry.increment("llm_requests_total", endpoint=endpoint, outcome="success")
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            # Billed model, e.g. gpt-3.5-turbo-0125 for a gpt-3.5-turbo request
+            model = getattr(response, "model", None) or request.get("model")
+            prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+            cost = cost_calculator.llm_call_cost(model, prompt_tokens, completion_tokens)
+            metrics_registry.increment("llm_tokens_total", prompt_tokens, endpoint=endpoint, model=model, type="prompt")
+            metrics_registry.increment("llm_tokens_total", completion_tokens, endpoint=endpoint, model=model, type="completion")
+            metrics_registry.increment("llm_cost_dollars_total", cost or 0.0, endpoint=endpoint, model=model)
+            ledger = metrics_registry.current_llm_usage.get()
+            if ledger is not None:
+                ledger.add(model, prompt_tokens, completion_tokens, cost)
+        return response
+    
+    def _priority(self, endpoint):
+        return self.PRIORITIES.get(endpoint, self.DEFAULT_PRIORITY)
+    
+    def _next_job(self):
+        best = min(self._priority(endpoint) for endpoint in self._rotation if self._queues[endpoint])
+        for _ in range(len(self._rotation)):
+            endpoint = self._rotation[0]
+            self._rotation.rotate(-1)
+            if self._queues[endpoint] and self._priority(endpoint) == best:
+                return self._queues[endpoint].popleft()
+    
+    async def _worker(self):
+        # Workers outlive the request that started them; spans take their caller's parent
+        tracer.current.set(None)
+        while True:
+            await self._pending.acquire()
+            request, future, parent = self._next_job()
+            if future.done():  # caller gave up while queued
+                continue
+            self.in_flight += 1
+            try:
+                with tracer.span("chat.completions", parent=parent, kind="client", model=request.get("model")) as span:
+                    call = self._loop.create_task(self._call(request))
+                    # A caller that gives up (e.g. a cancelled interval) stops its completion too
+                    future.add_done_callback(lambda _, call=call: call.cancel())
+                    await asyncio.wait({call})
+                    if call.cancelled():
+                        span["attributes"]["cancelled"] = True
+                        continue
+                    response = call.result()
+                    usage = getattr(response, "usage", None)
+                    if usage is not None:
+                        span["attributes"].update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                if not future.done():
+                    future.set_result(response)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.in_flight -= 1
+    
+    async def _call(self, request):
+        for attempt in range(self.max_retries + 1):
+            delay = self._paused_until - self._loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                response = await self.client.chat.completions.create(**request)
+                self.completed += 1
+                return response
+            except RateLimitError as e:
+                self.rate_limited += 1
+                if attempt == self.max_retries:
+                    raise
+                try:
+                    wait = float(e.response.headers.get("retry-after"))
+                except (TypeError, ValueError):
+                    wait = self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"LLM rate limited, backing off {wait:.2f}s")
+                self._paused_until = max(self._paused_until, self._loop.time() + wait)
+    
+    def stats(self):
+        queued = {}
+        if self._loop is not None:
+            queued = {endpoint: len(queue) for endpoint, queue in self._queues.items() if queue}
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": getattr(self, "in_flight", 0),
+            "queued": queued,
+            "completed": self.completed,
+            "rate_limited": self.rate_limited
+        }
+
+class LLMResponseCache:
+    """Content-addressed cache of completion texts.
+    
+    Keys are a SHA-256 of (model, messages, max_tokens, temperature). Entries
+    live in an in-memory LRU with a TTL; if ``db_path`` is set, a SQLite tier
+    keeps them across restarts and refills the memory tier on a hit.
+    """
+    
+    def __init__(self, max_entries=256, ttl_seconds=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            with self._db_lock, self._db:
+                self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+                self._db.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - ttl_seconds,))
+    
+    @staticmethod
+    def make_key(model, messages, max_tokens=None, temperature=None):
+        request = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+    
+    def _disk_get(self, key):
+        with self._db_lock:
+            row = self._db.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        return row
+    
+    def _disk_set(self, key, value, created):
+        with self._db_lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)", (key, value, created))
+    
+    def _remember(self, key, value, created):
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+    
+    async def get(self, key):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < self.ttl_seconds:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            self.stats["memory_hits"] += 1
+            return entry[0]
+        self._entries.pop(key, None)
+        
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, key)
+            if row is not None and now - row[1] < self.ttl_seconds:
+                self._remember(key, row[0], row[1])
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                return row[0]
+        
+        self.stats["misses"] += 1
+        return None
+    
+    async def set(self, key, value):
+        created = time.time()
+        self._remember(key, value, created)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, value, created)
+    
+    def report(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            entries=len(self._entries),
+            ttl_seconds=self.ttl_seconds,
+            disk_tier=bool(self._db)
+        )
 
 class GPTAnalyzer:
     """GPT-powered analyzer for all ML and analysis tasks"""
     
-    def __init__(self, openai_client):
-        self.client = openai_client
+    def __init__(self, dispatcher, cache=None):
+        self.dispatcher = dispatcher
+        self.cache = cache
+        self.inflight = SingleFlight()
+    
+    async def _complete(self, endpoint, request, cache_key):
+        response = await self.dispatcher.create(endpoint=endpoint, **request)
+        content = response.choices[0].message.content
+        if self.cache:
+            await self.cache.set(cache_key, content)
+        return content
     
-    def analyze_with_gpt(self, data, analysis_type="comprehensive"):
-        """Universal GPT analysis method"""
+    @tracer.traced("gpt_analysis")
+    async def analyze_with_gpt(self, data, analysis_type="comprehensive", endpoint="analyze_data", findings=None):
+        """Universal GPT analysis method; ``findings`` from a local engine are summarized when given"""
         try:
-            if not data:
+            if (data is None or len(data) == 0) and not findings:
                 return "No data available for analysis"
                 
-            df = pd.DataFrame(data)
+            df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
             data_summary = {
                 "total_records": len(df),
                 "columns": df.columns.tolist()[:10],
@@ -53,6 +660,7 @@ class GPTAnalyzer:
             - Total Records: {data_summary['total_records']}
             - Columns: {data_summary['columns']}
             - Analysis Type: {analysis_type}
+            {f"- Engine Findings: {json.dumps(findings, default=str)}" if findings else ""}
             
             Provide analysis including:
             1. Key insights about DER performance
@@ -63,67 +671,876 @@ class GPTAnalyzer:
             Keep response concise and practical.
             """
             
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
+            request = {
+                "model": "gpt-3.5-turbo",
+                "messages": [
                     {"role": "system", "content": "You are an expert in DER systems and data analysis."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=500,
-                temperature=0.3
-            )
+                "max_tokens": 500,
+                "temperature": 0.3
+            }
             
-            return response.choices[0].message.content
+            cache_key = LLMResponseCache.make_key(**request)
+            if self.cache:
+                cached = await self.cache.get(cache_key)
+                if cached is not None:
+                    metrics_registry.increment("llm_cache_hits_total", endpoint=endpoint)
+                    return cached
+            
+            # Identical prompts already in flight share one completion
+            return await self.inflight.do(cache_key, lambda: self._complete(endpoint, request, cache_key))
             
         except Exception as e:
             logger.error(f"GPT analysis failed: {e}")
-            return f"Basic analysis completed. Dataset contains {len(data) if data else 0} records."
+            return f"Basic analysis completed. Dataset contains {len(data) if data is not None else 0} records."
+
+# DER channels the local analysis engines work on
+DER_CHANNELS = ["W", "VAr", "Hz", "PhVphA", "DCV", "DCA"]
+
+def frame_timestamps(data):
+    """DatetimeIndex of a fetched frame, from its datetimestamp column or index"""
+    if "datetimestamp" in data.columns:
+        return pd.DatetimeIndex(pd.to_datetime(data["datetimestamp"]))
+    return pd.DatetimeIndex(data.index)
+
+class FeaturePipeline:
+    """Derived features shared by the ML engines.
+    
+    Trailing rolling mean/std per DER channel, W lags, W/VAr ramp rates,
+    apparent power, power factor and DC/AC efficiency are computed in one
+    vectorized pass. Results are cached per (interval, data version, query)
+    so every endpoint analysing the same data reuses them.
+    """
+    
+    def __init__(self, window=30, lags=3, min_periods=5, max_entries=16):
+        self.window = window
+        self.lags = lags
+        self.min_periods = min_periods
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @tracer.traced("feature_pipeline")
+    def compute(self, data):
+        started = time.perf_counter()
+        channels = [c for c in DER_CHANNELS if c in data.columns]
+        values = data[channels].astype(float)
+        
+        # Trailing windows exclude the current bucket so it can be scored against them
+        rolling = values.rolling(self.window, min_periods=self.min_periods)
+        means = rolling.mean().shift(1)
+        stds = rolling.std(ddof=0).shift(1)
+        features = {}
+        for c in channels:
+            features[f"{c}_mean"] = means[c]
+            features[f"{c}_std"] = stds[c]
+        
+        if "W" in values:
+            for k in range(1, self.lags + 1):
+                features[f"W_lag{k}"] = values["W"].shift(k)
+        seconds = pd.Series(frame_timestamps(data), index=data.index).diff().dt.total_seconds()
+        for c in ("W", "VAr"):
+            if c in values:
+                features[f"{c}_ramp"] = values[c].diff() / seconds.where(seconds > 0)
+        if "W" in values and "VAr" in values:
+            apparent = np.hypot(values["W"], values["VAr"])
+            features["S"] = apparent
+            features["PF"] = values["W"] / apparent.where(apparent > 0)
+        if "W" in values and "DCW" in data.columns:
+            dc_power = data["DCW"].astype(float)
+            features["dc_ac_efficiency"] = values["W"] / dc_power.where(dc_power > 0)
+        
+        complete = values.notna().all(axis=1).to_numpy()
+        clean = values.to_numpy()[complete]
+        std = clean.std(axis=0) if len(clean) else np.ones(len(channels))
+        return {
+            "frame": pd.DataFrame(features, index=data.index),
+            "channels": channels,
+            "window": self.window,
+            "complete": complete,
+            "mean": clean.mean(axis=0) if len(clean) else np.zeros(len(channels)),
+            "std": np.where(std > 0, std, 1.0),
+            "compute_ms": round((time.perf_counter() - started) * 1000, 3)
+        }
+    
+    def get(self, interval, data, query=None):
+        """Features of a fetched frame, cached when the frame carries a data version"""
+        version = data.attrs.get("data_version")
+        if version is None:
+            return self.compute(data)
+        key = (interval, version, tuple(sorted((query or {}).items())))
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return features
+            self.misses += 1
+        
+        features = self.compute(data)
+        with self._lock:
+            self._entries[key] = features
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return features
+    
+    def report(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+class AnomalyDetector:
+    """Vectorized anomaly detection over the DER channels.
+    
+    Each method scores a whole channel with NumPy in O(n): a trailing
+    rolling z-score built from cumulative sums, a median/MAD modified
+    z-score and Tukey IQR fences. NaN buckets (gaps) are never flagged.
+    """
+    
+    METHODS = ["zscore", "mad", "iqr"]
+    
+    def __init__(self, window=30, z_threshold=3.0, mad_threshold=3.5, iqr_k=1.5, min_periods=5):
+        self.window = window
+        self.z_threshold = z_threshold
+        self.mad_threshold = mad_threshold
+        self.iqr_k = iqr_k
+        self.min_periods = min_periods
+    
+    def _zscore(self, x, window):
+        """|z| of each point against the ``window`` points before it"""
+        valid = ~np.isnan(x)
+        centered = np.where(valid, x - np.nanmean(x), 0.0)
+        s1 = np.concatenate(([0.0], np.cumsum(centered)))
+        s2 = np.concatenate(([0.0], np.cumsum(centered ** 2)))
+        n = np.concatenate(([0], np.cumsum(valid)))
+        
+        idx = np.arange(len(x))
+        lo = np.maximum(idx - window, 0)
+        count = n[idx] - n[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (s1[idx] - s1[lo]) / count
+            var = (s2[idx] - s2[lo]) / count - mean ** 2
+            # Differences of running sums carry rounding error; treat variance below it as flat
+            flat = var <= 64 * np.finfo(float).eps * s2[idx] / count
+            z = np.abs(centered - mean) / np.sqrt(np.maximum(var, 0.0))
+        return np.where(valid & (count >= self.min_periods) & ~flat, z, 0.0)
+    
+    def _mad(self, x):
+        median = np.nanmedian(x)
+        mad = np.nanmedian(np.abs(x - median))
+        if not mad > 0:
+            return np.zeros(len(x))
+        return np.nan_to_num(0.6745 * np.abs(x - median) / mad)
+    
+    def _iqr(self, x):
+        q1, q3 = np.nanpercentile(x, [25, 75])
+        spread = max(q3 - q1, 1e-12)
+        distance = np.maximum(q1 - x, x - q3) / spread
+        return np.nan_to_num(np.maximum(distance, 0.0))
+    
+    def _shared_zscore(self, x, features, channel):
+        """|z| from the feature pipeline's trailing mean/std, when it has them"""
+        frame = features["frame"]
+        if f"{channel}_mean" not in frame:
+            return None
+        mean = frame[f"{channel}_mean"].to_numpy()
+        std = frame[f"{channel}_std"].to_numpy()
+        valid = np.isfinite(x) & np.isfinite(std) & (std > 1e-12 * np.maximum(np.abs(mean), 1.0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(valid, np.abs(x - mean) / std, 0.0)
+    
+    @tracer.traced("anomaly_detection")
+    def detect(self, data, channels=None, methods=None, window=None, max_anomalies=100, features=None):
+        """Flag anomalous (timestamp, channel) points; returns counts and the top findings.
+        
+        With ``features`` from the FeaturePipeline, derived columns (e.g.
+        W_ramp, PF) can be used as channels and matching rolling statistics
+        are reused instead of recomputed.
+        """
+        started = time.perf_counter()
+        methods = [m for m in (methods or self.METHODS) if m in self.METHODS]
+        window = window or self.window
+        derived = features["frame"] if features else pd.DataFrame(index=data.index)
+        channels = [c for c in (channels or DER_CHANNELS) if c in data.columns or c in derived.columns]
+        shared = features is not None and features["window"] == window
+        
+        values = np.column_stack([
+            (data[c] if c in data.columns else derived[c]).to_numpy(dtype=float) for c in channels
+        ]) if channels else np.empty((len(data), 0))
+        flags = {}
+        scores = np.zeros(values.shape)
+        for j, channel in enumerate(channels):
+            x = values[:, j]
+            if np.isnan(x).all():
+                continue
+            zscore = self._shared_zscore(x, features, channel) if shared else None
+            per_method = {
+                "zscore": lambda: (self._zscore(x, window) if zscore is None else zscore) / self.z_threshold,
+                "mad": lambda: self._mad(x) / self.mad_threshold,
+                "iqr": lambda: self._iqr(x) / self.iqr_k
+            }
+            for method in methods:
+                # Scores are normalized so > 1 means past that method's threshold
+                normalized = per_method[method]()
+                flags[(channel, method)] = normalized > 1.0
+                scores[:, j] = np.maximum(scores[:, j], normalized)
+        
+        flagged = np.zeros(values.shape, dtype=bool)
+        for (channel, method), mask in flags.items():
+            flagged[:, channels.index(channel)] |= mask
+        
+        # Report the strongest findings first
+        rows, cols = np.nonzero(flagged)
+        order = np.argsort(-scores[rows, cols], kind="stable")[:max_anomalies]
+        timestamps = frame_timestamps(data)
+        anomalies = [
+            {
+                "timestamp": str(timestamps[rows[i]]),
+                "channel": channels[cols[i]],
+                "value": round(float(values[rows[i], cols[i]]), 4),
+                "score": round(float(scores[rows[i], cols[i]]), 3),
+                "methods": [m for m in methods if flags[(channels[cols[i]], m)][rows[i]]]
+            }
+            for i in order
+        ]
+        
+        return {
+            "anomalous_records": int(flagged.any(axis=1).sum()),
+            "anomalous_points": int(flagged.sum()),
+            "methods": methods,
+            "window": window,
+            "channels": {
+                channel: {
+                    "anomalies": int(flagged[:, j].sum()),
+                    "by_method": {m: int(flags[(channel, m)].sum()) for m in methods if (channel, m) in flags}
+                }
+                for j, channel in enumerate(channels)
+            },
+            "anomalies": anomalies,
+            "truncated": len(rows) > max_anomalies,
+            "detection_time_ms": round((time.perf_counter() - started) * 1000, 3)
+        }
+
+class ClusterEngine:
+    """Deterministic clustering of the standardized DER feature matrix.
+    
+    Mini-batch k-means processes the rows in fixed-size batches, so memory
+    stays bounded by ``batch_size`` whatever the history length; k is chosen
+    by silhouette score on a sample. DBSCAN is fitted on a bounded sample and
+    extended to every row through its core points.
+    """
+    
+    def __init__(self, batch_size=4096, k_range=(2, 6), silhouette_sample=1000, dbscan_sample=2000,
+                 max_epochs=10, tol=1e-4, seed=0):
+        self.batch_size = batch_size
+        self.k_range = k_range
+        self.silhouette_sample = silhouette_sample
+        self.dbscan_sample = dbscan_sample
+        self.max_epochs = max_epochs
+        self.tol = tol
+        self.seed = seed
+    
+    @staticmethod
+    def _features(data, channels):
+        values = data[channels].to_numpy(dtype=float)
+        keep = ~np.isnan(values).any(axis=1)
+        return values[keep], keep
+    
+    @staticmethod
+    def _scaler(X):
+        mean = X.mean(axis=0)
+        std = X.std(axis=0)
+        return mean, np.where(std > 0, std, 1.0)
+    
+    @staticmethod
+    def _sq_distances(X, C):
+        d = (X ** 2).sum(axis=1)[:, None] - 2 * X @ C.T + (C ** 2).sum(axis=1)[None, :]
+        return np.maximum(d, 0.0)
+    
+    def _batches(self, n):
+        return range(0, n, self.batch_size)
+    
+    def _init_centroids(self, X, k, rng):
+        """k-means++ seeding"""
+        centroids = [X[rng.integers(len(X))]]
+        closest = self._sq_distances(X, centroids[0][None, :])[:, 0]
+        for _ in range(1, k):
+            total = closest.sum()
+            probabilities = closest / total if total > 0 else None
+            centroids.append(X[rng.choice(len(X), p=probabilities)])
+            closest = np.minimum(closest, self._sq_distances(X, centroids[-1][None, :])[:, 0])
+        return np.array(centroids)
+    
+    def _partial_fit(self, state, batch):
+        """One mini-batch k-means step; each centroid moves with rate 1/points seen"""
+        centroids, counts = state["centroids"], state["counts"]
+        k = len(centroids)
+        labels = self._sq_distances(batch, centroids).argmin(axis=1)
+        batch_counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=batch[:, j], minlength=k) for j in range(batch.shape[1])], axis=1)
+        
+        counts += batch_counts
+        hit = batch_counts > 0
+        previous = centroids[hit].copy()
+        centroids[hit] += (sums[hit] - batch_counts[hit, None] * centroids[hit]) / counts[hit, None]
+        return float(np.abs(centroids[hit] - previous).max()) if hit.any() else 0.0
+    
+    def _new_state(self, X, k, rng):
+        return {"centroids": self._init_centroids(X, k, rng), "counts": np.zeros(k)}
+    
+    def _fit_kmeans(self, X, k, rng):
+        state = self._new_state(X[:self.batch_size * 4], k, rng)
+        starts = np.array(self._batches(len(X)))
+        for epoch in range(self.max_epochs):
+            shift = 0.0
+            for lo in starts[rng.permutation(len(starts))]:
+                shift = max(shift, self._partial_fit(state, X[lo:lo + self.batch_size]))
+            if shift < self.tol:
+                break
+        state["epochs"] = epoch + 1
+        return state
+    
+    def _assign(self, X, centroids):
+        labels = np.empty(len(X), dtype=int)
+        inertia = 0.0
+        for lo in self._batches(len(X)):
+            distances = self._sq_distances(X[lo:lo + self.batch_size], centroids)
+            labels[lo:lo + self.batch_size] = distances.argmin(axis=1)
+            inertia += float(distances.min(axis=1).sum())
+        return labels, inertia
+    
+    @staticmethod
+    def _silhouette(X, labels):
+        """Mean silhouette coefficient, from one pairwise distance matrix"""
+        clusters, labels = np.unique(labels, return_inverse=True)
+        if len(clusters) < 2:
+            return -1.0
+        distances = np.sqrt(ClusterEngine._sq_distances(X, X))
+        members = np.eye(len(clusters))[labels]
+        sizes = members.sum(axis=0)
+        mean_to = distances @ members
+        
+        own_size = sizes[labels]
+        a = mean_to[np.arange(len(X)), labels] / np.maximum(own_size - 1, 1)
+        mean_to = mean_to / sizes
+        mean_to[np.arange(len(X)), labels] = np.inf
+        b = mean_to.min(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            s = np.where(own_size > 1, (b - a) / np.maximum(a, b), 0.0)
+        return float(np.nan_to_num(s).mean())
+    
+    def _sample(self, X, size, rng):
+        return X if len(X) <= size else X[np.sort(rng.choice(len(X), size, replace=False))]
+    
+    def _choose_k(self, X, k_range, rng):
+        """Silhouette score of each candidate k, fitted on a sample"""
+        sample = self._sample(X, self.silhouette_sample, rng)
+        scores = {}
+        for k in range(k_range[0], min(k_range[1], len(sample) - 1) + 1):
+            state = self._fit_kmeans(sample, k, rng)
+            labels, _ = self._assign(sample, state["centroids"])
+            scores[k] = round(self._silhouette(sample, labels), 4)
+        return scores
+    
+    def _fit_dbscan(self, X, eps, min_samples, rng):
+        """DBSCAN on a bounded sample; returns its core points and their labels"""
+        sample = self._sample(X, self.dbscan_sample, rng)
+        neighbors = self._sq_distances(sample, sample) <= eps ** 2
+        core = neighbors.sum(axis=1) >= min_samples
+        labels = np.full(len(sample), -1)
+        cluster = 0
+        for i in np.flatnonzero(core):
+            if labels[i] != -1:
+                continue
+            members = neighbors[i].copy()
+            # Grow through core points until the reachable set stops changing
+            while True:
+                grown = members | neighbors[members & core].any(axis=0)
+                if (grown == members).all():
+                    break
+                members = grown
+            labels[members & (labels == -1)] = cluster
+            cluster += 1
+        return sample[core], labels[core]
+    
+    def _assign_dbscan(self, X, core_points, core_labels, eps):
+        labels = np.full(len(X), -1)
+        if not len(core_points):
+            return labels
+        for lo in self._batches(len(X)):
+            distances = self._sq_distances(X[lo:lo + self.batch_size], core_points)
+            nearest = distances.argmin(axis=1)
+            within = distances[np.arange(len(nearest)), nearest] <= eps ** 2
+            labels[lo:lo + self.batch_size] = np.where(within, core_labels[nearest], -1)
+        return labels
+    
+    def _summary(self, X, labels, mean, std, channels):
+        clusters = [c for c in np.unique(labels) if c >= 0]
+        return {
+            "clusters_found": len(clusters),
+            "cluster_sizes": {int(c): int((labels == c).sum()) for c in np.unique(labels)},
+            "centroids": [
+                dict(zip(channels, np.round(X[labels == c].mean(axis=0) * std + mean, 4).tolist()))
+                for c in clusters
+            ]
+        }
+    
+    @tracer.traced("clustering")
+    def cluster(self, data, channels=None, method="kmeans", k=None, k_range=None,
+                eps=0.5, min_samples=5, seed=None, max_assignments=1000, features=None):
+        """Cluster an in-memory frame; returns assignments, centroids and timings.
+        
+        ``features`` from the FeaturePipeline supply the complete-row mask and
+        scaling when they cover the same channels.
+        """
+        timings = {}
+        started = time.perf_counter()
+        rng = np.random.default_rng(self.seed if seed is None else seed)
+        channels = [c for c in (channels or DER_CHANNELS) if c in data.columns]
+        if features is not None and features["channels"] == channels:
+            keep = features["complete"]
+            X = data[channels].to_numpy(dtype=float)[keep]
+            mean, std = features["mean"], features["std"]
+        else:
+            X, keep = self._features(data, channels)
+            mean, std = self._scaler(X) if len(X) else (None, None)
+        if len(X) < 3:
+            raise ValueError("Not enough complete rows to cluster.")
+        X = (X - mean) / std
+        timings["features_ms"] = (time.perf_counter() - started) * 1000
+        
+        result = {"method": method, "channels": channels}
+        tick = time.perf_counter()
+        if method == "dbscan":
+            core_points, core_labels = self._fit_dbscan(X, eps, min_samples, rng)
+            timings["fit_ms"] = (time.perf_counter() - tick) * 1000
+            tick = time.perf_counter()
+            labels = self._assign_dbscan(X, core_points, core_labels, eps)
+            result.update({"eps": eps, "min_samples": min_samples, "noise_points": int((labels == -1).sum())})
+        else:
+            if k is None:
+                scores = self._choose_k(X, k_range or self.k_range, rng)
+                k = max(scores, key=scores.get)
+                result["silhouette_by_k"] = scores
+                result["silhouette"] = scores[k]
+                timings["k_selection_ms"] = (time.perf_counter() - tick) * 1000
+                tick = time.perf_counter()
+            state = self._fit_kmeans(X, int(k), rng)
+            timings["fit_ms"] = (time.perf_counter() - tick) * 1000
+            tick = time.perf_counter()
+            labels, inertia = self._assign(X, state["centroids"])
+            result.update({"k": int(k), "epochs": state["epochs"], "inertia": round(inertia, 4)})
+        timings["assign_ms"] = (time.perf_counter() - tick) * 1000
+        
+        result.update(self._summary(X, labels, mean, std, channels))
+        # Rows with missing channels are reported as unassigned (-1)
+        assignments = np.full(len(keep), -1)
+        assignments[keep] = labels
+        result["assignments"] = assignments[:max_assignments].tolist()
+        result["assignments_truncated"] = len(assignments) > max_assignments
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        result["timings"] = {name: round(value, 3) for name, value in timings.items()}
+        return result
+    
+    @tracer.traced("clustering_stream")
+    async def cluster_stream(self, frames, channels=None, k=None, k_range=None, seed=None):
+        """Single-pass mini-batch k-means over an async iterator of DataFrames.
+        
+        The first batch fixes the scaling and, unless ``k`` is given, the
+        silhouette choice of k; every later batch is one update step, so only
+        one batch is held in memory at a time.
+        """
+        timings = {"k_selection_ms": 0.0, "fit_ms": 0.0}
+        started = time.perf_counter()
+        rng = np.random.default_rng(self.seed if seed is None else seed)
+        state = None
+        records = rows = batches = 0
+        result = {"method": "kmeans", "streamed": True}
+        
+        async for frame in frames:
+            records += len(frame)
+            if state is None:
+                channels = [c for c in (channels or DER_CHANNELS) if c in frame.columns]
+            X, _ = self._features(frame, channels)
+            if not len(X):
+                continue
+            tick = time.perf_counter()
+            if state is None:
+                if len(X) < 3:
+                    continue
+                mean, std = self._scaler(X)
+                X = (X - mean) / std
+                if k is None:
+                    scores = await asyncio.to_thread(self._choose_k, X, k_range or self.k_range, rng)
+                    k = max(scores, key=scores.get)
+                    result.update({"silhouette_by_k": scores, "silhouette": scores[k]})
+                    timings["k_selection_ms"] = (time.perf_counter() - tick) * 1000
+                    tick = time.perf_counter()
+                state = self._new_state(X, int(k), rng)
+            else:
+                X = (X - mean) / std
+            for lo in self._batches(len(X)):
+                self._partial_fit(state, X[lo:lo + self.batch_size])
+            timings["fit_ms"] += (time.perf_counter() - tick) * 1000
+            rows += len(X)
+            batches += 1
+        
+        if state is None:
+            raise ValueError("Not enough complete rows to cluster.")
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        result.update({
+            "channels": channels,
+            "k": int(k),
+            "clusters_found": int((state["counts"] > 0).sum()),
+            "records_streamed": records,
+            "rows_processed": rows,
+            "batches": batches,
+            # Points absorbed by each centroid during the pass
+            "cluster_sizes": {i: int(count) for i, count in enumerate(state["counts"])},
+            "centroids": [dict(zip(channels, np.round(c * std + mean, 4).tolist())) for c in state["centroids"]],
+            "timings": {name: round(value, 3) for name, value in timings.items()}
+        })
+        return result
+
+class Forecaster:
+    """Ridge regression on lag and time-of-day features, one model per (interval, target).
+    
+    A model keeps only its sufficient statistics X^T X and X^T y plus the
+    last lag values, so newly arrived buckets are folded in with a
+    rank update and a small solve instead of a retrain. Each batch is scored
+    with the current model before it is folded in, giving a running
+    out-of-sample error. Cumulative counters (WH) are modelled as increments.
+    Short histories get fewer lags; a model keeps its lag count for life.
+    Buckets are placed on the interval grid before they are folded in, so
+    missing buckets read as gaps instead of shifting the lags; a gap longer
+    than the lag window restarts the lags from the first bucket after it.
+    The newest bucket in the data may still be filling up, so it is held back
+    until a later bucket arrives.
+    """
+    
+    TARGETS = ["W", "WH"]
+    CUMULATIVE = {"WH"}
+    
+    def __init__(self, model_dir=None, lags=24, alpha=1e-3, horizon="24h", max_horizon_steps=2880, holdout=0.2):
+        self.model_dir = model_dir
+        self.lags = lags
+        self.alpha = alpha
+        self.horizon = pd.Timedelta(horizon)
+        self.max_horizon_steps = max_horizon_steps
+        self.holdout = holdout
+        self._models = {}
+        self._lock = threading.Lock()
+    
+    def _path(self, interval, target):
+        return os.path.join(self.model_dir, f"{interval}_{target}.json")
+    
+    def _load(self, interval, target):
+        key = (interval, target)
+        if key not in self._models and self.model_dir:
+            try:
+                with open(self._path(interval, target)) as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                return None
+            for name in ("xtx", "xty", "coef", "tail"):
+                stored[name] = np.array(stored[name], dtype=float)
+            stored["fitted_until"] = pd.Timestamp(stored["fitted_until"])
+            self._models[key] = stored
+        return self._models.get(key)
+    
+    def _save(self, model):
+        self._models[(model["interval"], model["target"])] = model
+        if not self.model_dir:
+            return
+        os.makedirs(self.model_dir, exist_ok=True)
+        stored = {
+            name: value.tolist() if isinstance(value, np.ndarray) else value
+            for name, value in model.items()
+        }
+        stored["fitted_until"] = model["fitted_until"].isoformat()
+        path = self._path(model["interval"], model["target"])
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(stored, f)
+        os.replace(f"{path}.tmp", path)
+    
+    def fitted_until(self, interval):
+        """Last bucket folded into every model of ``interval``, or None if any is missing"""
+        with self._lock:
+            models = [self._load(interval, target) for target in self.TARGETS]
+        if any(model is None for model in models):
+            return None
+        return min(model["fitted_until"] for model in models)
+    
+    def _time_features(self, times):
+        seconds = (times - times.normalize()).total_seconds().to_numpy()
+        phase = 2 * np.pi * seconds / 86400
+        return np.sin(phase), np.cos(phase)
+    
+    def _design(self, y, filled, times, lags):
+        """Rows predicting y[lags:] from the preceding (gap-filled) values; ``times`` are the target timestamps"""
+        lagged = np.lib.stride_tricks.sliding_window_view(filled[:-1], lags)
+        sin, cos = self._time_features(times)
+        X = np.column_stack([np.ones(len(lagged)), lagged, sin, cos])
+        target = y[lags:]
+        valid = np.isfinite(X).all(axis=1) & np.isfinite(target)
+        return X[valid], target[valid]
+    
+    def _solve(self, xtx, xty):
+        # Ridge penalty relative to each feature's scale; the intercept is not penalized
+        penalty = self.alpha * np.diag(xtx).copy()
+        penalty[0] = 0.0
+        try:
+            return np.linalg.solve(xtx + np.diag(penalty + 1e-9), xty)
+        except np.linalg.LinAlgError:
+            return np.linalg.lstsq(xtx, xty, rcond=None)[0]
+    
+    @staticmethod
+    def _to_grid(raw, times, origin, step):
+        """Bucket values onto the grid ``origin + k * step``; missing buckets become NaN"""
+        slots = np.asarray((times - origin) // step)
+        present = pd.Series(raw).groupby(slots).mean()
+        count = int(slots.max()) + 1
+        grid = pd.date_range(origin, periods=count, freq=step)
+        return present.reindex(range(count)).to_numpy(), grid, count - len(present)
+    
+    @staticmethod
+    def _score(model, X, target):
+        if not len(target):
+            return
+        errors = X @ model["coef"] - target
+        model["eval_points"] += len(target)
+        model["abs_error"] += float(np.abs(errors).sum())
+        model["sq_error"] += float((errors ** 2).sum())
+        model["abs_actual"] += float(np.abs(target).sum())
+    
+    def _fold(self, model, X, target):
+        model["xtx"] += X.T @ X
+        model["xty"] += X.T @ target
+        model["train_points"] += len(target)
+        model["coef"] = self._solve(model["xtx"], model["xty"])
+    
+    def _new_model(self, interval, target, lags, X, y):
+        d = X.shape[1]
+        model = {
+            "interval": interval, "target": target, "lags": lags,
+            "xtx": np.zeros((d, d)), "xty": np.zeros(d), "coef": np.zeros(d),
+            "train_points": 0, "eval_points": 0,
+            "abs_error": 0.0, "sq_error": 0.0, "abs_actual": 0.0
+        }
+        # Time-ordered holdout: fit on the head, score the tail, then fold the tail in
+        split = int(len(y) * (1 - self.holdout))
+        self._fold(model, X[:split], y[:split])
+        self._score(model, X[split:], y[split:])
+        self._fold(model, X[split:], y[split:])
+        return model
+    
+    @tracer.traced("forecast_fit")
+    def update(self, interval, data, refit=False):
+        """Fold closed buckets newer than each model's ``fitted_until`` in; returns per-target fit info"""
+        times = frame_timestamps(data)
+        step = pd.Timedelta(interval)
+        info = {}
+        with self._lock:
+            for target in self.TARGETS:
+                if target not in data.columns:
+                    continue
+                model = None if refit else self._load(interval, target)
+                raw = data[target].to_numpy(dtype=float)
+                new = times > model["fitted_until"] if model else np.ones(len(raw), dtype=bool)
+                # The newest bucket is still open; its final value is folded in on a later update
+                new &= times < times.max()
+                raw, new_times = raw[new], times[new]
+                if not len(raw):
+                    info[target] = {"mode": "cached", "new_buckets": 0}
+                    continue
+                
+                origin = model["fitted_until"] + step if model else new_times.min()
+                # Past the lag window nothing carries over: restart the lags at the new data
+                reset = model is not None and new_times.min() - origin >= model["lags"] * step
+                if reset:
+                    origin = new_times.min()
+                new_buckets = len(raw)
+                raw, new_times, missing = self._to_grid(raw, new_times, origin, step)
+                
+                if target in self.CUMULATIVE:
+                    # Spread a counter's growth evenly over the buckets it skipped
+                    previous = model.get("last_level", np.nan) if model and not reset else np.nan
+                    levels = pd.Series(np.concatenate(([previous], raw))).interpolate(limit_area="inside").to_numpy()
+                    values = np.diff(levels)
+                else:
+                    values = raw
+                tail = (np.full(model["lags"], np.nan) if reset else model["tail"]) if model else np.array([])
+                y = np.concatenate((tail, values))
+                # Lags read through empty buckets by carrying the last value forward
+                filled = pd.Series(y).ffill().to_numpy()
+                lags = model["lags"] if model else min(self.lags, max(1, len(y) // 4))
+                target_times = new_times if model else new_times[lags:]
+                if len(y) <= lags:
+                    info[target] = {"mode": "insufficient_data", "new_buckets": new_buckets}
+                    continue
+                
+                X, target_values = self._design(y, filled, target_times, lags)
+                if model is None:
+                    if len(target_values) <= X.shape[1]:
+                        info[target] = {"mode": "insufficient_data", "new_buckets": new_buckets}
+                        continue
+                    model = self._new_model(interval, target, lags, X, target_values)
+                    mode = "full"
+                else:
+                    self._score(model, X, target_values)
+                    self._fold(model, X, target_values)
+                    mode = "incremental"
+                
+                model["tail"] = filled[-lags:]
+                finite = raw[np.isfinite(raw)]
+                if len(finite):
+                    model["last_level"] = float(finite[-1])
+                model["fitted_until"] = new_times[-1]
+                self._save(model)
+                info[target] = {"mode": mode, "new_buckets": new_buckets, "missing_buckets": missing, "lags_reset": reset}
+        return info
+    
+    @tracer.traced("forecast")
+    def forecast(self, interval, target):
+        """Recursive multi-step forecast over the horizon, capped at ``max_horizon_steps``.
+        
+        ``truncated`` is set when the cap cut the horizon short.
+        """
+        with self._lock:
+            model = self._load(interval, target)
+        if model is None:
+            return None
+        step = pd.Timedelta(interval)
+        requested = int(self.horizon / step)
+        steps = min(requested, self.max_horizon_steps)
+        times = pd.date_range(model["fitted_until"] + step, periods=steps, freq=step)
+        sin, cos = self._time_features(times)
+        
+        coef, lags = model["coef"], model["lags"]
+        window = np.empty(lags + steps)
+        window[:lags] = np.nan_to_num(model["tail"])
+        for i in range(steps):
+            window[lags + i] = coef[0] + window[i:i + lags] @ coef[1:lags + 1] + sin[i] * coef[-2] + cos[i] * coef[-1]
+        values = window[lags:]
+        if target in self.CUMULATIVE:
+            values = model.get("last_level", 0.0) + np.cumsum(values)
+        return {
+            "start": str(times[0]), "step": interval, "values": np.round(values, 3).tolist(),
+            "truncated": steps < requested
+        }
+    
+    def accuracy(self, interval, target):
+        """Out-of-sample error of a model: 1 - MAE / mean |actual|, plus MAE and RMSE"""
+        with self._lock:
+            model = self._load(interval, target)
+        if model is None or not model["eval_points"]:
+            return None
+        n = model["eval_points"]
+        return {
+            "accuracy": round(max(0.0, 1 - model["abs_error"] / max(model["abs_actual"], 1e-12)), 3),
+            "mae": round(model["abs_error"] / n, 4),
+            "rmse": round(float(np.sqrt(model["sq_error"] / n)), 4),
+            "evaluated_points": n,
+            "training_points": model["train_points"]
+        }
 
 class CloudCostCalculator:
     """Enhanced cloud cost calculator with interval-specific pricing"""
     
-    def __init__(self):
+    # LLM list prices in USD per million (prompt, completion) tokens. A model
+    # name is priced by its longest matching prefix, so dated snapshots such
+    # as gpt-4o-2024-08-06 use the gpt-4o price.
+    LLM_PRICES = {
+        "gpt-3.5-turbo": (0.50, 1.50),
+        "gpt-4o": (2.50, 10.00),
+        "gpt-4o-mini": (0.15, 0.60),
+        "gpt-4.1": (2.00, 8.00),
+        "gpt-4.1-mini": (0.40, 1.60),
+        "gpt-4-turbo": (10.00, 30.00),
+        "gpt-4": (30.00, 60.00)
+    }
+    
+    # Per-analysis cost components, in rate-table order
+    COMPONENTS = ("compute", "storage", "ml", "data_transfer")
+    
+    def __init__(self, llm_prices=None):
+        # Rates per minute of aggregation interval; costs scale linearly with
+        # the interval length, so any pandas offset (15s, 10min, 1h, ...) works.
         self.pricing = {
-            "aws": {
-                "compute": {"1min": 0.0016, "3min": 0.0048, "5min": 0.008},
-                "storage": {"1min": 0.001, "3min": 0.003, "5min": 0.005},
-                "ml": {"1min": 0.0045, "3min": 0.0135, "5min": 0.0225},
-                "data_transfer": {"1min": 0.0009, "3min": 0.0027, "5min": 0.0045}
-            },
-            "gcp": {
-                "compute": {"1min": 0.0014, "3min": 0.0042, "5min": 0.007},
-                "storage": {"1min": 0.0008, "3min": 0.0024, "5min": 0.004},
-                "ml": {"1min": 0.0037, "3min": 0.0111, "5min": 0.0185},
-                "data_transfer": {"1min": 0.0008, "3min": 0.0024, "5min": 0.004}
-            },
-            "azure": {
-                "compute": {"1min": 0.0016, "3min": 0.0048, "5min": 0.008},
-                "storage": {"1min": 0.0003, "3min": 0.0009, "5min": 0.0015},
-                "ml": {"1min": 0.004, "3min": 0.012, "5min": 0.02},
-                "data_transfer": {"1min": 0.0009, "3min": 0.0027, "5min": 0.0045}
-            }
+            "aws": {"compute": 0.0016, "storage": 0.001, "ml": 0.0045, "data_transfer": 0.0009},
+            "gcp": {"compute": 0.0014, "storage": 0.0008, "ml": 0.0037, "data_transfer": 0.0008},
+            "azure": {"compute": 0.0016, "storage": 0.0003, "ml": 0.004, "data_transfer": 0.0009}
         }
+        self.llm_prices = dict(self.LLM_PRICES, **{model: tuple(price) for model, price in (llm_prices or {}).items()})
     
-    def calculate_interval_costs(self, interval, data_size_mb, performance_duration):
-        """Calculate costs specific to analysis interval"""
-        costs = {}
+    def llm_call_cost(self, model, prompt_tokens, completion_tokens):
+        """Dollar cost of one completion from its token usage, or None if the model has no price"""
+        matches = [name for name in self.llm_prices if (model or "").startswith(name)]
+        if not matches:
+            return None
+        prompt_price, completion_price = self.llm_prices[max(matches, key=len)]
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+    
+    @staticmethod
+    def interval_minutes(interval):
+        """Length of an interval such as '1min', '15s' or '1h' in minutes"""
+        return pd.Timedelta(interval).total_seconds() / 60
+    
+    def calculate_interval_costs(self, interval, data_size_mb, performance_duration, resources=None, llm_usage=None):
+        """Calculate costs specific to analysis interval.
         
-        for provider, rates in self.pricing.items():
-            compute_cost = rates["compute"][interval]
-            storage_cost = rates["storage"][interval] * (data_size_mb / 10)
-            ml_cost = rates["ml"][interval]
-            transfer_cost = rates["data_transfer"][interval] * (data_size_mb / 100)
-            
-            # Add performance-based multiplier
-            performance_multiplier = max(1.0, performance_duration / 5.0)
-            
-            total_cost = (compute_cost + storage_cost + ml_cost + transfer_cost) * performance_multiplier
-            
+        With ``resources`` (a PerformanceMonitor snapshot) the performance
+        multiplier follows the CPU time actually consumed rather than wall
+        time, which also counts waiting on the data service and the LLM.
+        ``llm_usage`` (the request's LLMUsage) adds the priced token spend of
+        its completions to every provider's total.
+        """
+        with metrics_registry.phase("cost_calculation"):
+            return self._calculate_interval_costs(interval, data_size_mb, performance_duration, resources, llm_usage)
+    
+    def component_costs(self, minutes, data_size_mb, busy_seconds):
+        """Per-analysis cost components for every provider, broadcast over array inputs.
+        
+        Returns ``(components, multiplier)``: components has shape
+        (providers, COMPONENTS, *broadcast shape) before the performance
+        multiplier; the multiplier has the broadcast shape.
+        """
+        minutes, data_size_mb, busy_seconds = np.broadcast_arrays(
+            np.asarray(minutes, dtype=float), np.asarray(data_size_mb, dtype=float), np.asarray(busy_seconds, dtype=float)
+        )
+        scale = np.stack([minutes, minutes * (data_size_mb / 10), minutes, minutes * (data_size_mb / 100)])
+        rates = self._rates.reshape(self._rates.shape + (1,) * minutes.ndim)
+        # Add performance-based multiplier
+        return rates * scale, np.maximum(1.0, busy_seconds / 5.0)
+    
+    @property
+    def _rates(self):
+        return np.array([[rates[component] for component in self.COMPONENTS] for rates in self.pricing.values()])
+    
+    def _calculate_interval_costs(self, interval, data_size_mb, performance_duration, resources, llm_usage):
+        minutes = self.interval_minutes(interval)
+        busy_seconds = resources['cpu_seconds'] if resources else performance_duration
+        llm = llm_usage.summary() if llm_usage is not None else None
+        llm_cost = llm['cost'] if llm else 0.0
+        
+        components, performance_multiplier = self.component_costs(minutes, data_size_mb, busy_seconds)
+        performance_multiplier = float(performance_multiplier)
+        totals = components.sum(axis=1) * performance_multiplier + llm_cost
+        costs = {}
+        for provider, (compute_cost, storage_cost, ml_cost, transfer_cost), total_cost in zip(self.pricing, components.tolist(), totals.tolist()):
             costs[provider] = {
                 "compute": round(compute_cost * performance_multiplier, 6),
                 "storage": round(storage_cost, 6),
                 "ml": round(ml_cost * performance_multiplier, 6),
                 "data_transfer": round(transfer_cost, 6),
+                "llm_tokens": round(llm_cost, 6),
                 "total": round(total_cost, 6),
                 "hourly_rate": round(total_cost * (3600 / max(performance_duration, 1)), 4),
                 "daily_estimate": round(total_cost * (86400 / max(performance_duration, 1)), 2)
@@ -138,83 +1555,708 @@ class CloudCostCalculator:
             "cheapest_provider": cheapest,
             "cheapest_cost": costs[cheapest]["total"],
             "data_size_mb": data_size_mb,
-            "performance_duration_seconds": performance_duration
+            "performance_duration_seconds": performance_duration,
+            "resource_usage": resources,
+            "llm_usage": llm
+        }
+    
+    def simulate(self, intervals, data_sizes_mb, durations_seconds, requests_per_hour, horizons_hours,
+                 llm_cost_per_request=0.0, budget=None):
+        """What-if costs over a grid of scenarios, evaluated as one broadcast.
+        
+        Axes are provider x interval x data size x duration for the cost of one
+        analysis, extended by request rate x horizon for the total spend. The
+        interval and duration scale every provider alike, so the data size at
+        which two providers cost the same depends only on their rates and is
+        solved in closed form. With ``budget``, the highest request rate each
+        scenario can sustain within it is returned too.
+        """
+        started = time.perf_counter()
+        minutes = np.array([self.interval_minutes(interval) for interval in intervals])
+        sizes = np.asarray(data_sizes_mb, dtype=float)
+        durations = np.asarray(durations_seconds, dtype=float)
+        rates = np.asarray(requests_per_hour, dtype=float)
+        horizons = np.asarray(horizons_hours, dtype=float)
+        
+        # (P, C, I, S, D) components; all of them scale with the multiplier so they sum to the total
+        components, multiplier = self.component_costs(minutes[:, None, None], sizes[None, :, None], durations[None, None, :])
+        components = components * multiplier
+        per_analysis = components.sum(axis=1) + llm_cost_per_request
+        # (P, I, S, D, R, H)
+        total = per_analysis[..., None, None] * (rates[:, None] * horizons[None, :])
+        compute_ms = (time.perf_counter() - started) * 1000
+        
+        providers = list(self.pricing)
+        result = {
+            "axes": {
+                "providers": providers,
+                "intervals": list(intervals),
+                "data_size_mb": sizes.tolist(),
+                "duration_seconds": durations.tolist(),
+                "requests_per_hour": rates.tolist(),
+                "horizon_hours": horizons.tolist()
+            },
+            "cost_per_analysis": {provider: np.round(per_analysis[i], 6).tolist() for i, provider in enumerate(providers)},
+            "components_per_analysis": {
+                provider: {component: np.round(components[i, j], 6).tolist() for j, component in enumerate(self.COMPONENTS)}
+                for i, provider in enumerate(providers)
+            },
+            "total_cost": {provider: np.round(total[i], 6).tolist() for i, provider in enumerate(providers)},
+            "cheapest_provider": np.array(providers)[per_analysis.argmin(axis=0)].tolist(),
+            "break_even": {"data_size_mb": self._size_break_even(sizes)}
         }
+        if budget is not None:
+            with np.errstate(divide="ignore"):
+                sustainable = budget / (per_analysis[..., None] * horizons)
+            # (P, I, S, D, H); inf when a scenario costs nothing
+            result["break_even"]["max_requests_per_hour_within_budget"] = {
+                provider: np.round(sustainable[i], 4).tolist() for i, provider in enumerate(providers)
+            }
+        result["cells"] = int(total.size)
+        result["compute_ms"] = round(compute_ms, 3)
+        return result
+    
+    def _size_break_even(self, sizes):
+        """Data size at which each pair of providers costs the same per analysis"""
+        rates = self._rates
+        fixed = rates[:, 0] + rates[:, 2]  # compute + ml, per interval minute
+        per_mb = rates[:, 1] / 10 + rates[:, 3] / 100  # storage + transfer, per interval minute and MB
+        providers = list(self.pricing)
+        points = []
+        for i in range(len(providers)):
+            for j in range(i + 1, len(providers)):
+                # Cheaper for small data: lower fixed cost, then lower per-MB cost
+                small, large = (i, j) if (fixed[i], per_mb[i]) <= (fixed[j], per_mb[j]) else (j, i)
+                size = (fixed[large] - fixed[small]) / (per_mb[small] - per_mb[large]) if per_mb[small] > per_mb[large] else None
+                if size is None or size <= 0:
+                    points.append({"providers": [providers[i], providers[j]], "data_size_mb": None, "always_cheaper": providers[small]})
+                    continue
+                points.append({
+                    "providers": [providers[i], providers[j]],
+                    "data_size_mb": round(float(size), 4),
+                    "cheaper_below": providers[small],
+                    "cheaper_above": providers[large],
+                    "within_grid": bool(sizes.min() <= size <= sizes.max())
+                })
+        return points
+
+def read_process_resources():
+    """CPU time, memory and I/O counters of this process.
+    
+    Memory and I/O come from /proc (Linux); where it is unavailable those
+    fields are None.
+    """
+    times = os.times()
+    sample = {
+        'wall': time.time(),
+        'cpu_seconds': times.user + times.system,
+        'rss_bytes': None,
+        'peak_rss_bytes': None,
+        'read_bytes': None,
+        'write_bytes': None
+    }
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name == "VmRSS":
+                    sample['rss_bytes'] = int(value.split()[0]) * 1024
+                elif name == "VmHWM":
+                    sample['peak_rss_bytes'] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":", 1) for line in f if ":" in line)
+        sample['read_bytes'] = int(counters["read_bytes"])
+        sample['write_bytes'] = int(counters["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return sample
+
+def _delta(end, start, key, scale=1.0):
+    if end[key] is None or start[key] is None:
+        return None
+    return round((end[key] - start[key]) / scale, 3)
+
+def _scaled(sample, key, scale):
+    return round(sample[key] / scale, 3) if sample[key] is not None else None
 
 class PerformanceMonitor:
-    """Enhanced performance monitoring with cost tracking"""
+    """Enhanced performance monitoring with cost tracking.
+    
+    Each operation records the process CPU time, RSS, peak-RSS and disk I/O
+    consumed between start_monitoring and end_monitoring. Counters are
+    process-wide, so concurrent operations are attributed to every window
+    they overlap.
+    """
+    
+    def __init__(self):
+        self._last_sample = read_process_resources()
     
     def get_system_metrics(self):
+        sample = read_process_resources()
+        previous, self._last_sample = self._last_sample, sample
+        elapsed = sample['wall'] - previous['wall']
+        
+        memory_total = None
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemTotal:"):
+                        memory_total = int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+        disk = shutil.disk_usage(os.path.abspath(os.sep))
         return {
-            'cpu_percent': round(np.random.uniform(5, 25), 2),
-            'memory_percent': round(np.random.uniform(40, 80), 2),
-            'memory_used_mb': round(np.random.uniform(512, 2048), 2),
-            'disk_usage_percent': round(np.random.uniform(50, 90), 2)
+            # Process CPU since the previous reading, as a percentage of one core
+            'cpu_percent': round((sample['cpu_seconds'] - previous['cpu_seconds']) / elapsed * 100, 2) if elapsed > 0 else 0.0,
+            'memory_percent': round(sample['rss_bytes'] / memory_total * 100, 2) if sample['rss_bytes'] and memory_total else None,
+            'memory_used_mb': _scaled(sample, 'rss_bytes', 1024 * 1024),
+            'peak_memory_mb': _scaled(sample, 'peak_rss_bytes', 1024 * 1024),
+            'disk_usage_percent': round(disk.used / disk.total * 100, 2)
         }
     
     def start_monitoring(self, operation_name):
-        return {'operation': operation_name, 'start_time': time.time()}
+        sample = read_process_resources()
+        token = metrics_registry.current_operation.set(operation_name)
+        # Usage also rolls up into an enclosing operation's ledger, e.g. /batch
+        parent_usage = metrics_registry.current_llm_usage.get()
+        llm_usage = LLMUsage()
+        usage_token = metrics_registry.current_llm_usage.set(llm_usage)
+        span = tracer.start_span(operation_name)
+        return {'operation': operation_name, 'start_time': sample['wall'], 'resources': sample, 'token': token,
+                'llm_usage': llm_usage, 'parent_llm_usage': parent_usage, 'llm_usage_token': usage_token, 'span': span}
+    
+    def snapshot(self, start_data):
+        """Resources consumed since start_monitoring"""
+        start, end = start_data['resources'], read_process_resources()
+        duration = end['wall'] - start['wall']
+        cpu_seconds = end['cpu_seconds'] - start['cpu_seconds']
+        return {
+            'cpu_seconds': round(cpu_seconds, 4),
+            'cpu_percent': round(cpu_seconds / duration * 100, 2) if duration > 0 else 0.0,
+            'rss_mb': _scaled(end, 'rss_bytes', 1024 * 1024),
+            'rss_delta_mb': _delta(end, start, 'rss_bytes', 1024 * 1024),
+            'peak_rss_mb': _scaled(end, 'peak_rss_bytes', 1024 * 1024),
+            # How far the operation pushed the process high-water mark
+            'peak_delta_mb': _delta(end, start, 'peak_rss_bytes', 1024 * 1024),
+            'io_read_kb': _delta(end, start, 'read_bytes', 1024),
+            'io_write_kb': _delta(end, start, 'write_bytes', 1024)
+        }
     
     def end_monitoring(self, start_data):
         duration = time.time() - start_data['start_time']
         performance = {
             'operation': start_data['operation'],
             'duration': round(duration, 3),
-            'system_metrics': self.get_system_metrics(),
+            'resources': self.snapshot(start_data),
             'timestamp': datetime.utcnow().isoformat()
         }
         
-        with metrics_lock:
-            performance_metrics[start_data['operation']].append(performance)
+        metrics_registry.record_operation(performance)
+        metrics_registry.current_operation.reset(start_data['token'])
+        metrics_registry.current_llm_usage.reset(start_data['llm_usage_token'])
+        if start_data['parent_llm_usage'] is not None:
+            start_data['parent_llm_usage'].merge(start_data['llm_usage'])
+        span, token = start_data['span']
+        span['attributes'].update(cpu_seconds=performance['resources']['cpu_seconds'],
+                                  llm_cost=round(start_data['llm_usage'].cost, 6))
+        tracer.end_span(span, token)
         return performance
     
     def track_cost_metrics(self, operation_name, interval, cost_data):
         """Track cost metrics separately"""
-        cost_entry = {
-            'operation': operation_name,
-            'interval': interval,
-            'cost_data': cost_data,
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        
-        with metrics_lock:
-            cost_metrics[f"{operation_name}_{interval}"].append(cost_entry)
+        metrics_registry.record_cost(operation_name, interval, cost_data)
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures, probing again after a cool-down.
+    
+    Half-open lets a single probe through: handing it out restarts the
+    cool-down, so concurrent callers keep failing fast until the probe's
+    outcome closes the breaker or opens it again. A probe that never reports
+    back is replaced by another one after the next cool-down.
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+    
+    def allow(self):
+        state = self.state
+        if state == "half_open":
+            self.opened_at = time.monotonic()
+            return True
+        return state == "closed"
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class DataQueryError(ValueError):
+    """The data service rejected a query (HTTP 4xx other than 404)"""
+
+class DataStreamError(RuntimeError):
+    """A data stream broke after some of its frames had been yielded"""
 
 class DataServiceClient:
-    """Client for dataservice interaction"""
+    """Async, connection-pooled client for dataservice interaction"""
+    
+    MEDIA_TYPES = {
+        "json": "application/json",
+        "arrow": "application/vnd.apache.arrow.stream",
+        "parquet": "application/vnd.apache.parquet"
+    }
     
-    def __init__(self, base_url):
+    def __init__(self, base_url, wire_format="arrow", timeout=30.0, max_retries=2,
+                 backoff_seconds=0.25, max_connections=20):
         self.base_url = base_url
+        self.wire_format = wire_format if wire_format in self.MEDIA_TYPES else "json"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.breaker = CircuitBreaker()
+        self.inflight = SingleFlight()
+        self.batch_stats = {"fetches": 0, "reused": 0}
+        self._batch_frames = contextvars.ContextVar("batch_frames", default=None)
+        self._client = None
+        self._loop = None
+    
+    def _get_client(self):
+        # The pool is bound to the running event loop; create it lazily there
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(base_url=self.base_url, limits=self.limits, timeout=self.timeout)
+            self._loop = loop
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _request(self, path, params=None, headers=None, timeout=None):
+        """GET with retries (exponential backoff + jitter) behind the circuit breaker"""
+        if not self.breaker.allow():
+            raise RuntimeError("Data service circuit breaker is open")
+        
+        client = self._get_client()
+        with tracer.span(f"GET {path}", kind="client") as span:
+            headers = dict(headers or {}, traceparent=tracer.traceparent())
+            for attempt in range(self.max_retries + 1):
+                span["attributes"]["attempts"] = attempt + 1
+                try:
+                    response = await client.get(path, params=params, headers=headers, timeout=timeout or self.timeout)
+                    span["attributes"]["status_code"] = response.status_code
+                    if response.status_code < 500:
+                        self.breaker.record_success()
+                        return response
+                    error = httpx.HTTPStatusError(f"Server error {response.status_code}", request=response.request, response=response)
+                except httpx.TransportError as e:
+                    error = e
+                
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5))
+            
+            self.breaker.record_failure()
+            raise error
     
-    def get_data(self, interval):
+    def _decode(self, response):
+        """Turn a /data response into a DataFrame without a records round-trip"""
+        media_type = response.headers.get("content-type", "").split(";")[0].strip()
+        with tracer.span("decode", media_type=media_type, bytes=len(response.content)) as span:
+            if media_type == self.MEDIA_TYPES["arrow"]:
+                frame = pa.ipc.open_stream(response.content).read_pandas()
+            elif media_type == self.MEDIA_TYPES["parquet"]:
+                frame = pq.read_table(pa.BufferReader(response.content)).to_pandas()
+            else:
+                frame = pd.DataFrame(response.json())
+            span["attributes"]["rows"] = len(frame)
+            return frame
+    
+    @staticmethod
+    def _params(start=None, end=None, columns=None, limit=None):
+        params = {"start": start, "end": end, "limit": limit}
+        if columns:
+            params["columns"] = columns if isinstance(columns, str) else ",".join(columns)
+        return {key: value for key, value in params.items() if value is not None}
+    
+    async def _fetch(self, interval, params, timeout):
         try:
-            response = requests.get(f"{self.base_url}/data/{interval}", timeout=30)
-            return response.json() if response.status_code == 200 else []
+            response = await self._request(
+                f"/data/{interval}",
+                params=params,
+                headers={"Accept": self.MEDIA_TYPES[self.wire_format]},
+                timeout=timeout
+            )
+            if 400 <= response.status_code < 500 and response.status_code != 404:
+                raise DataQueryError(f"Data service rejected the query: {self._error_detail(response)}")
+            if response.status_code != 200:
+                return pd.DataFrame()
+            frame = self._decode(response)
+            # Lets derived results (e.g. features) be cached per data version
+            frame.attrs["data_version"] = response.headers.get("x-data-version")
+            frame.attrs.update(self._sizes(response))
+            return frame
+        except DataQueryError:
+            # A bad query is the caller's error, not an empty result to analyze
+            raise
         except Exception as e:
             logger.error(f"Data fetch error: {e}")
-            return []
+            return pd.DataFrame()
+    
+    @staticmethod
+    def _error_detail(response):
+        try:
+            body = response.json()
+        except ValueError:
+            return response.text
+        return body.get("detail", response.text) if isinstance(body, dict) else response.text
+    
+    @staticmethod
+    def _sizes(response):
+        """Bytes received for a /data response, plus the row count and in-memory size the data service reported"""
+        sizes = {"payload_bytes": len(response.content)}
+        for key, header in (("row_count", "x-row-count"), ("memory_bytes", "x-memory-bytes")):
+            try:
+                sizes[key] = int(response.headers[header])
+            except (KeyError, ValueError):
+                pass
+        return sizes
+    
+    @staticmethod
+    def frame_meta(frame):
+        """Size metadata of a fetched frame: row_count, memory_bytes and payload_bytes where known"""
+        return {key: frame.attrs[key] for key in ("row_count", "memory_bytes", "payload_bytes") if key in frame.attrs}
+    
+    async def data_meta(self, interval, start=None, end=None, columns=None, limit=None, timeout=None):
+        """Rows, in-memory size, columns and time range of a /data pull, without transferring it"""
+        response = await self._request(f"/data/{interval}/meta", params=self._params(start, end, columns, limit), timeout=timeout)
+        if response.status_code != 200:
+            return None
+        return response.json()
+    
+    async def get_data(self, interval, start=None, end=None, columns=None, limit=None, timeout=None):
+        """Fetch aggregated data as a DataFrame, optionally narrowed to a time range, columns and row limit.
+        
+        Concurrent identical fetches share one request; treat the frame as read-only.
+        Raises DataQueryError when the data service rejects the query (e.g. a
+        bad ``start``); other failures return an empty frame.
+        """
+        with metrics_registry.phase("data_fetch", interval=interval):
+            return await self._get_data(interval, self._params(start, end, columns, limit), timeout)
+    
+    async def _get_data(self, interval, params, timeout):
+        key = (interval, self.wire_format, tuple(sorted(params.items())))
+        frames = self._batch_frames.get()
+        if frames is None:
+            return await self.inflight.do(key, lambda: self._fetch(interval, params, timeout))
+        
+        # Inside a batch every identical fetch reuses the first, even once it has finished
+        if key in frames:
+            self.batch_stats["reused"] += 1
+        else:
+            self.batch_stats["fetches"] += 1
+            frames[key] = asyncio.ensure_future(self.inflight.do(key, lambda: self._fetch(interval, params, timeout)))
+        return await asyncio.shield(frames[key])
+    
+    @contextlib.contextmanager
+    def batch(self):
+        """Scope in which identical get_data calls share one fetched frame.
+        
+        Tasks started inside the scope inherit it; yields the set of fetch keys.
+        """
+        frames = {}
+        token = self._batch_frames.set(frames)
+        try:
+            yield frames
+        finally:
+            self._batch_frames.reset(token)
+    
+    async def iter_data(self, interval, chunk_rows=10000, start=None, end=None, columns=None, limit=None):
+        """Stream aggregated data as NDJSON, yielding DataFrames of at most chunk_rows rows.
+        
+        Like get_data, a failure before the first frame is logged and ends the
+        stream empty, and a rejected query raises DataQueryError. Once frames
+        have been yielded a failure raises DataStreamError, so a truncated
+        history is never taken for the whole one.
+        """
+        params = dict(self._params(start, end, columns, limit), format="ndjson")
+        if not self.breaker.allow():
+            logger.error("Data stream error: data service circuit breaker is open")
+            return
+        streamed = 0
+        try:
+            headers = {"traceparent": tracer.traceparent()} if tracer.current.get() else None
+            async with self._get_client().stream("GET", f"/data/{interval}", params=params, headers=headers) as response:
+                if 400 <= response.status_code < 500:
+                    # An answer, not an outage
+                    self.breaker.record_success()
+                    if response.status_code == 404:
+                        return
+                    await response.aread()
+                    raise DataQueryError(f"Data service rejected the query: {self._error_detail(response)}")
+                response.raise_for_status()
+                rows = []
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    rows.append(json.loads(line))
+                    if len(rows) >= chunk_rows:
+                        streamed += len(rows)
+                        yield pd.DataFrame(rows)
+                        rows = []
+                if rows:
+                    streamed += len(rows)
+                    yield pd.DataFrame(rows)
+            self.breaker.record_success()
+        except DataQueryError:
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            if streamed:
+                raise DataStreamError(f"Data stream broke after {streamed} records: {e}") from e
+            logger.error(f"Data stream error: {e}")
     
-    def check_connection(self):
+    async def check_connection(self, timeout=10):
         try:
-            response = requests.get(f"{self.base_url}/", timeout=10)
+            response = await self._request("/", timeout=timeout)
             return response.status_code == 200
-        except:
+        except Exception:
             return False
 
+def error_message(error):
+    """Text of a failed analysis; an HTTPException keeps its message in ``detail``"""
+    return str(error.detail) if isinstance(error, HTTPException) else str(error)
+
+class JobQueue:
+    """Background runner for long analyses.
+    
+    Submitted jobs wait in a FIFO queue served by ``max_workers`` workers on
+    the running event loop. Each job record (status, timings, result) is
+    kept in memory and, if ``db_path`` is set, in SQLite so results survive
+    restarts; jobs that were queued or running at a restart are reported
+    as interrupted. Queued and running jobs can be cancelled.
+    """
+    
+    FINISHED = ("completed", "failed", "cancelled", "interrupted")
+    
+    def __init__(self, handlers=None, max_workers=2, db_path=None, max_entries=1000):
+        self.handlers = handlers or {}
+        self.max_workers = max_workers
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._jobs = OrderedDict()
+        self._tasks = {}
+        self._loop = None
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            with self._db_lock, self._db:
+                self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, record TEXT, created REAL)")
+                for job_id, record in self._db.execute(
+                    "SELECT id, record FROM jobs WHERE status IN ('queued', 'running')"
+                ).fetchall():
+                    job = dict(json.loads(record), status="interrupted", error="Service restarted before the job finished")
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, record = ? WHERE id = ?",
+                        (job["status"], json.dumps(job, default=str), job_id)
+                    )
+    
+    def _ensure_workers(self):
+        # The queue and workers belong to the running event loop
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.max_workers)]
+    
+    def _persist(self, job):
+        if self._db is None:
+            return
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                (job["job_id"], job["status"], json.dumps(job, default=str), job["created"])
+            )
+    
+    def _remember(self, job):
+        self._jobs[job["job_id"]] = job
+        # Evict the oldest finished jobs; they stay readable from SQLite
+        while len(self._jobs) > self.max_entries:
+            oldest = next((job_id for job_id, entry in self._jobs.items() if entry["status"] in self.FINISHED), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest]
+    
+    async def _update(self, job, **changes):
+        job.update(changes)
+        await asyncio.to_thread(self._persist, job)
+    
+    async def submit(self, analysis_type, payload):
+        if analysis_type not in self.handlers:
+            raise ValueError(f"Unknown analysis_type '{analysis_type}'. Valid types: {', '.join(self.handlers)}.")
+        self._ensure_workers()
+        job = {
+            "job_id": hashlib.sha256(f"{time.time()}-{random.random()}".encode("utf-8")).hexdigest()[:16],
+            "analysis_type": analysis_type,
+            "payload": payload,
+            "status": "queued",
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "result": None,
+            "error": None,
+            # The job's spans join the trace of the request that submitted it
+            "traceparent": tracer.traceparent()
+        }
+        self._remember(job)
+        await self._update(job)
+        self._queue.put_nowait(job["job_id"])
+        return job
+    
+    async def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None and self._db is not None:
+            def load():
+                with self._db_lock:
+                    return self._db.execute("SELECT record FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            row = await asyncio.to_thread(load)
+            job = json.loads(row[0]) if row else None
+        return job
+    
+    async def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return await self.get(job_id)
+        if job["status"] == "queued":
+            await self._update(job, status="cancelled", finished=time.time())
+        elif job["status"] == "running" and job_id in self._tasks:
+            self._tasks[job_id].cancel()
+        return job
+    
+    async def _worker(self):
+        tracer.current.set(None)
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "queued":  # cancelled while queued
+                continue
+            await self._update(job, status="running", started=time.time())
+            # The task copies the context, so the handler's spans nest under the job span
+            with tracer.span(f"job {job['analysis_type']}", parent=Tracer.parse_traceparent(job.get("traceparent")), job_id=job_id):
+                task = self._loop.create_task(self.handlers[job["analysis_type"]](dict(job["payload"])))
+                self._tasks[job_id] = task
+                try:
+                    await asyncio.wait({task})
+                finally:
+                    self._tasks.pop(job_id, None)
+            
+            if task.cancelled():
+                await self._update(job, status="cancelled", finished=time.time())
+                continue
+            error = task.exception()
+            result = None if error else task.result()
+            # Analysis endpoints report failures as {"error": ...} instead of raising
+            if error is None and isinstance(result, dict) and "error" in result:
+                error = result["error"]
+            await self._update(
+                job,
+                status="failed" if error else "completed",
+                finished=time.time(),
+                result=None if error else result,
+                error=error_message(error) if error else None
+            )
+    
+    def stats(self):
+        counts = defaultdict(int)
+        for job in self._jobs.values():
+            counts[job["status"]] += 1
+        return {
+            "workers": self.max_workers,
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "tracked_jobs": len(self._jobs),
+            "by_status": dict(counts),
+            "persistent": bool(self._db)
+        }
+
+# Upper bound on intervals analyzed at once by /compare_intervals
+COMPARE_MAX_CONCURRENCY = int(os.getenv("COMPARE_MAX_CONCURRENCY", "4"))
+
+def frame_size_mb(data):
+    """Size of a fetched DataFrame in MB, as transferred.
+    
+    Storage and transfer costs follow the bytes received from the data
+    service, so a compact wire format costs less. Frames without a recorded
+    payload fall back to the in-memory size the data service reported, then
+    to a shallow measurement rather than walking every value.
+    """
+    size = data.attrs.get("payload_bytes", data.attrs.get("memory_bytes"))
+    if size is None:
+        size = data.memory_usage(index=True, deep=False).sum()
+    return size / (1024 * 1024)
+
+def data_query(payload):
+    """Time-range / column projection options forwarded from a request payload"""
+    return {key: payload[key] for key in ("start", "end", "columns", "limit") if payload.get(key) is not None}
+
 # Initialize components
 monitor = PerformanceMonitor()
-cost_calculator = CloudCostCalculator()
-data_client = DataServiceClient(os.getenv("DATASERVICE_URL", "http://data_service:7860"))
+anomaly_detector = AnomalyDetector()
+cluster_engine = ClusterEngine()
+feature_pipeline = FeaturePipeline()
+forecaster = Forecaster(model_dir=os.getenv("FORECAST_MODEL_DIR", os.path.join(SERVICE_DATA_DIR, "models")) or None)
+# LLM_PRICES overrides or adds models, e.g. {"gpt-4o": [2.5, 10.0]} (USD per million prompt/completion tokens)
+cost_calculator = CloudCostCalculator(llm_prices=json.loads(os.getenv("LLM_PRICES") or "{}"))
+job_queue = JobQueue(
+    max_workers=int(os.getenv("JOB_WORKERS", "2")),
+    db_path=os.getenv("JOB_DB", os.path.join(SERVICE_DATA_DIR, "jobs.db")) or None
+)
+data_client = DataServiceClient(
+    os.getenv("DATASERVICE_URL", "http://data_service:7860"),
+    wire_format=os.getenv("DATASERVICE_FORMAT", "arrow"),
+    timeout=float(os.getenv("DATASERVICE_TIMEOUT", "30")),
+    max_retries=int(os.getenv("DATASERVICE_RETRIES", "2"))
+)
 
 # OpenAI client
 openai_client = None
+llm_dispatcher = None
 gpt_analyzer = None
+llm_cache = LLMResponseCache(
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("LLM_CACHE_TTL", "3600")),
+    db_path=os.getenv("LLM_CACHE_DB") or None
+)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 if OPENAI_API_KEY:
     try:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
-        gpt_analyzer = GPTAnalyzer(openai_client)
+        # Retries are left to the dispatcher so 429s back off every worker
+        openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        llm_dispatcher = LLMDispatcher(openai_client, max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "4")))
+        gpt_analyzer = GPTAnalyzer(llm_dispatcher, cache=llm_cache)
         logger.info("✅ OpenAI client and GPT analyzer initialized")
     except Exception as e:
         logger.error(f"❌ OpenAI initialization failed: {e}")
@@ -226,6 +2268,40 @@ app = FastAPI(
     version="2.3.0"
 )
 
+# Span ingestion is not traced itself, or every export would produce another trace
+UNTRACED_PATHS = {"/v1/traces"}
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Root span per request, continuing the caller's trace when it sends a traceparent"""
+    if request.url.path in UNTRACED_PATHS:
+        return await call_next(request)
+    span, token = tracer.start_span(
+        f"{request.method} {request.url.path}",
+        parent=Tracer.parse_traceparent(request.headers.get("traceparent")),
+        kind="server"
+    )
+    error = None
+    try:
+        response = await call_next(request)
+        span["attributes"]["status_code"] = response.status_code
+        response.headers["X-Trace-Id"] = span["trace_id"]
+        return response
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        route = request.scope.get("route")
+        if route is not None:
+            span["name"] = f"{request.method} {route.path}"
+        tracer.end_span(span, token, error)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await data_client.close()
+    if tracer.exporter is not None:
+        await asyncio.to_thread(tracer.exporter.flush)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -235,9 +2311,10 @@ async def root():
         "version": "2.3.0",
         "features": ["GPT Analysis", "ML Models", "Interval-Specific Cost Tracking", "Performance Monitoring"],
         "supported_intervals": ["1min", "3min", "5min"],
+        "custom_intervals": "any fixed pandas offset, e.g. 15s, 10min, 1h, 1D",
         "cost_providers": ["aws", "gcp", "azure"],
-        "total_endpoints": 15,
-        "dataservice_connected": data_client.check_connection(),
+        "total_endpoints": api_endpoint_count(),
+        "dataservice_connected": await data_client.check_connection(),
         "gpt_available": gpt_analyzer is not None,
         "timestamp": datetime.utcnow().isoformat()
     }
@@ -251,7 +2328,7 @@ async def health_check():
         "version": "2.3.0",
         "dependencies": {
             "openai_available": gpt_analyzer is not None,
-            "dataservice_available": data_client.check_connection()
+            "dataservice_available": await data_client.check_connection()
         },
         "system_metrics": monitor.get_system_metrics(),
         "timestamp": datetime.utcnow().isoformat()
@@ -268,7 +2345,8 @@ async def query_gpt(payload: dict = Body(...)):
     try:
         prompt = payload.get("prompt", "Analyze DER system performance")
         
-        response = openai_client.chat.completions.create(
+        response = await llm_dispatcher.create(
+            endpoint="query_gpt",
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=300
@@ -278,6 +2356,7 @@ async def query_gpt(payload: dict = Body(...)):
             "provider": "gpt",
             "response": response.choices[0].message.content,
             "model": "gpt-3.5-turbo",
+            "llm_usage": monitoring['llm_usage'].summary(),
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -296,16 +2375,19 @@ async def analyze_data(payload: dict = Body(...)):
         interval = payload.get("interval", "1min")
         analysis_type = payload.get("analysis_type", "summary")
         
-        data = data_client.get_data(interval)
+        data = await data_client.get_data(interval, **data_query(payload))
         
         # GPT analysis
-        gpt_insights = "GPT analysis unavailable" if not gpt_analyzer else gpt_analyzer.analyze_with_gpt(data, analysis_type)
+        gpt_insights = "GPT analysis unavailable" if not gpt_analyzer else await gpt_analyzer.analyze_with_gpt(data, analysis_type, endpoint="analyze_data")
         
         # Calculate costs for this specific interval
-        data_size_mb = len(str(data).encode('utf-8')) / (1024 * 1024) if data else 1
+        data_size_mb = frame_size_mb(data) if not data.empty else 1
         performance_duration = time.time() - monitoring['start_time']
         
-        cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration)
+        cost_analysis = cost_calculator.calculate_interval_costs(
+            interval, data_size_mb, performance_duration,
+            resources=monitor.snapshot(monitoring), llm_usage=monitoring['llm_usage']
+        )
         
         # Track cost metrics
         monitor.track_cost_metrics("analyze_data", interval, cost_analysis)
@@ -316,7 +2398,7 @@ async def analyze_data(payload: dict = Body(...)):
                 "analysis_type": analysis_type,
                 "data_summary": {
                     "total_records": len(data),
-                    "columns": list(pd.DataFrame(data).columns) if data else []
+                    "columns": list(data.columns)
                 }
             },
             "gpt_insights": gpt_insights,
@@ -337,20 +2419,47 @@ async def data_insights(payload: dict = Body(...)):
 
 @app.post("/detect_anomalies")
 async def detect_anomalies(payload: dict = Body(...)):
-    """Anomaly detection endpoint with cost tracking"""
+    """Anomaly detection endpoint with cost tracking.
+    
+    Runs rolling z-score, MAD and IQR detectors over the DER channels;
+    GPT only summarizes the detector output (``summarize``, default true).
+    """
     monitoring = monitor.start_monitoring("detect_anomalies")
     
     try:
         interval = payload.get("interval", "1min")
-        data = data_client.get_data(interval)
+        query = data_query(payload)
+        data = await data_client.get_data(interval, **query)
+        features = await asyncio.to_thread(feature_pipeline.get, interval, data, query)
         
-        num_anomalies = np.random.randint(0, max(1, len(data) // 10)) if data else 0
-        gpt_analysis = "Anomaly detection completed" if not gpt_analyzer else gpt_analyzer.analyze_with_gpt(data, "anomaly_detection")
+        detection = await asyncio.to_thread(
+            anomaly_detector.detect,
+            data,
+            features=features,
+            channels=payload.get("channels"),
+            methods=payload.get("methods"),
+            window=payload.get("window"),
+            max_anomalies=int(payload.get("max_anomalies", 100))
+        )
+        num_anomalies = detection["anomalous_records"]
+        
+        findings = {
+            "anomalous_records": num_anomalies,
+            "by_channel": {channel: info["anomalies"] for channel, info in detection["channels"].items()},
+            "top_anomalies": detection["anomalies"][:5]
+        }
+        if gpt_analyzer and payload.get("summarize", True):
+            gpt_analysis = await gpt_analyzer.analyze_with_gpt(data, "anomaly_detection", endpoint="detect_anomalies", findings=findings)
+        else:
+            gpt_analysis = "Anomaly detection completed"
         
         # Calculate and track costs
-        data_size_mb = len(str(data).encode('utf-8')) / (1024 * 1024) if data else 1
+        data_size_mb = frame_size_mb(data) if not data.empty else 1
         performance_duration = time.time() - monitoring['start_time']
-        cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration)
+        cost_analysis = cost_calculator.calculate_interval_costs(
+            interval, data_size_mb, performance_duration,
+            resources=monitor.snapshot(monitoring), llm_usage=monitoring['llm_usage']
+        )
         monitor.track_cost_metrics("detect_anomalies", interval, cost_analysis)
         
         return {
@@ -358,8 +2467,9 @@ async def detect_anomalies(payload: dict = Body(...)):
                 "interval": interval,
                 "total_records": len(data),
                 "anomalies_detected": num_anomalies,
-                "anomaly_percentage": round((num_anomalies / len(data) * 100), 2) if data else 0,
-                "status": "completed"
+                "anomaly_percentage": round((num_anomalies / len(data) * 100), 2) if not data.empty else 0,
+                "status": "completed",
+                **{key: value for key, value in detection.items() if key != "anomalous_records"}
             },
             "gpt_insights": gpt_analysis,
             "cost_analysis": cost_analysis,
@@ -379,25 +2489,61 @@ async def cluster_analysis(payload: dict = Body(...)):
     
     try:
         interval = payload.get("interval", "1min")
-        data = data_client.get_data(interval)
+        channels = payload.get("channels")
+        if payload.get("stream"):
+            # Fold the history in batch-sized chunks instead of one large frame
+            clustering = await cluster_engine.cluster_stream(
+                data_client.iter_data(interval, chunk_rows=cluster_engine.batch_size, **data_query(payload)),
+                channels=channels,
+                k=payload.get("k"),
+                k_range=payload.get("k_range"),
+                seed=payload.get("seed")
+            )
+            data = pd.DataFrame()
+            total_records = clustering["records_streamed"]
+        else:
+            query = data_query(payload)
+            data = await data_client.get_data(interval, **query)
+            features = await asyncio.to_thread(feature_pipeline.get, interval, data, query)
+            clustering = await asyncio.to_thread(
+                cluster_engine.cluster,
+                data,
+                features=features,
+                channels=channels,
+                method=payload.get("method", "kmeans"),
+                k=payload.get("k"),
+                k_range=payload.get("k_range"),
+                eps=float(payload.get("eps", 0.5)),
+                min_samples=int(payload.get("min_samples", 5)),
+                seed=payload.get("seed"),
+                max_assignments=int(payload.get("max_assignments", 1000))
+            )
+            total_records = len(data)
+        num_clusters = clustering["clusters_found"]
         
-        # Simulate clustering
-        num_clusters = np.random.randint(2, 5)
-        gpt_analysis = "Clustering completed" if not gpt_analyzer else gpt_analyzer.analyze_with_gpt(data, "clustering")
+        findings = {key: clustering[key] for key in ("clusters_found", "cluster_sizes", "centroids", "silhouette") if key in clustering}
+        if gpt_analyzer and payload.get("summarize", True):
+            gpt_analysis = await gpt_analyzer.analyze_with_gpt(data, "clustering", endpoint="cluster_analysis", findings=findings)
+        else:
+            gpt_analysis = "Clustering completed"
         
         # Calculate and track costs
-        data_size_mb = len(str(data).encode('utf-8')) / (1024 * 1024) if data else 1
+        data_size_mb = frame_size_mb(data) if not data.empty else 1
         performance_duration = time.time() - monitoring['start_time']
-        cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration)
+        cost_analysis = cost_calculator.calculate_interval_costs(
+            interval, data_size_mb, performance_duration,
+            resources=monitor.snapshot(monitoring), llm_usage=monitoring['llm_usage']
+        )
         monitor.track_cost_metrics("cluster_analysis", interval, cost_analysis)
         
         return {
             "cluster_analysis": {
                 "interval": interval,
-                "total_records": len(data),
+                "total_records": total_records,
                 "clusters_found": num_clusters,
-                "clustering_method": "GPT-guided clustering",
-                "status": "completed"
+                "clustering_method": "DBSCAN" if clustering["method"] == "dbscan" else "mini-batch k-means",
+                "status": "completed",
+                **{key: value for key, value in clustering.items() if key not in ("clusters_found", "method")}
             },
             "gpt_insights": gpt_analysis,
             "cost_analysis": cost_analysis,
@@ -412,29 +2558,68 @@ async def cluster_analysis(payload: dict = Body(...)):
 
 @app.post("/predictive_analysis")
 async def predictive_analysis(payload: dict = Body(...)):
-    """Predictive analysis endpoint with cost tracking"""
+    """Predictive analysis endpoint with cost tracking.
+    
+    Forecasts W and WH over the next 24 hours with the per-interval ridge
+    models; only buckets newer than the last fitted one are fetched and
+    folded in. ``refit`` forces a full retrain. Short intervals hit the
+    forecaster's step cap, which ``horizon_truncated`` reports.
+    """
     monitoring = monitor.start_monitoring("predictive_analysis")
     
     try:
         interval = payload.get("interval", "1min")
-        data = data_client.get_data(interval)
+        refit = bool(payload.get("refit"))
+        fitted_until = None if refit else forecaster.fitted_until(interval)
+        # Only buckets after the last fitted one need to be fetched
+        data = await data_client.get_data(interval, start=str(fitted_until) if fitted_until is not None else None)
+        
+        tick = time.perf_counter()
+        fit_info = await asyncio.to_thread(forecaster.update, interval, data, refit)
+        update_ms = (time.perf_counter() - tick) * 1000
+        tick = time.perf_counter()
+        forecasts = {target: await asyncio.to_thread(forecaster.forecast, interval, target) for target in forecaster.TARGETS}
+        forecasts = {target: forecast for target, forecast in forecasts.items() if forecast}
+        inference_ms = (time.perf_counter() - tick) * 1000
+        if not forecasts:
+            raise ValueError(f"Not enough {interval} history to fit a forecaster.")
+        
+        models = {
+            target: dict(fit_info.get(target, {"mode": "cached", "new_buckets": 0}), **(forecaster.accuracy(interval, target) or {}))
+            for target in forecasts
+        }
+        scores = [model["accuracy"] for model in models.values() if "accuracy" in model]
+        accuracy = round(float(np.mean(scores)), 3) if scores else None
+        horizon = pd.Timedelta(interval) * len(next(iter(forecasts.values()))["values"])
         
-        # Simulate prediction
-        accuracy = round(np.random.uniform(0.75, 0.95), 3)
-        gpt_analysis = "Predictive modeling completed" if not gpt_analyzer else gpt_analyzer.analyze_with_gpt(data, "predictive_modeling")
+        findings = {"models": models, "forecast_end": {target: forecast["values"][-1] for target, forecast in forecasts.items()}}
+        if gpt_analyzer and payload.get("summarize", True):
+            gpt_analysis = await gpt_analyzer.analyze_with_gpt(data, "predictive_modeling", endpoint="predictive_analysis", findings=findings)
+        else:
+            gpt_analysis = "Predictive modeling completed"
         
         # Calculate and track costs
-        data_size_mb = len(str(data).encode('utf-8')) / (1024 * 1024) if data else 1
+        data_size_mb = frame_size_mb(data) if not data.empty else 1
         performance_duration = time.time() - monitoring['start_time']
-        cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration)
+        cost_analysis = cost_calculator.calculate_interval_costs(
+            interval, data_size_mb, performance_duration,
+            resources=monitor.snapshot(monitoring), llm_usage=monitoring['llm_usage']
+        )
         monitor.track_cost_metrics("predictive_analysis", interval, cost_analysis)
         
         return {
             "predictive_analysis": {
                 "interval": interval,
-                "total_records": len(data),
+                "total_records": max(model.get("training_points", 0) for model in models.values()),
+                "new_records": len(data),
                 "model_accuracy": accuracy,
-                "prediction_horizon": "24 hours",
+                "prediction_horizon": f"{horizon / pd.Timedelta('1h'):g} hours",
+                "requested_horizon": f"{forecaster.horizon / pd.Timedelta('1h'):g} hours",
+                "horizon_truncated": any(forecast["truncated"] for forecast in forecasts.values()),
+                "model": "ridge regression on lag + time-of-day features",
+                "models": models,
+                "forecast": forecasts,
+                "timings": {"update_ms": round(update_ms, 3), "inference_ms": round(inference_ms, 3)},
                 "status": "completed"
             },
             "gpt_insights": gpt_analysis,
@@ -448,21 +2633,79 @@ async def predictive_analysis(payload: dict = Body(...)):
     finally:
         monitor.end_monitoring(monitoring)
 
+async def run_engine(fn, *args, **kwargs):
+    """Run a local ML engine off the event loop; failures become an error entry"""
+    try:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    except Exception as e:
+        return {"error": str(e)}
+
 @app.post("/comprehensive_ml_analysis")
 async def comprehensive_ml_analysis(payload: dict = Body(...)):
-    """Comprehensive ML analysis endpoint with cost tracking"""
+    """Comprehensive ML analysis endpoint with cost tracking.
+    
+    Anomaly detection, clustering and forecasting run concurrently on one
+    fetch and one shared feature pass.
+    """
     monitoring = monitor.start_monitoring("comprehensive_ml_analysis")
     
     try:
         interval = payload.get("interval", "1min")
-        data = data_client.get_data(interval)
+        query = data_query(payload)
+        data = await data_client.get_data(interval, **query)
+        features = await asyncio.to_thread(feature_pipeline.get, interval, data, query)
         
-        gpt_analysis = "Comprehensive ML analysis completed" if not gpt_analyzer else gpt_analyzer.analyze_with_gpt(data, "comprehensive_ml")
+        def forecast_stage():
+            # Forecast models are trained on the full history only
+            if not query:
+                forecaster.update(interval, data)
+            return {target: forecaster.accuracy(interval, target) for target in forecaster.TARGETS}
+        
+        detection, clustering, forecasting = await asyncio.gather(
+            run_engine(anomaly_detector.detect, data, features=features, max_anomalies=10),
+            run_engine(cluster_engine.cluster, data, features=features, max_assignments=0),
+            run_engine(forecast_stage)
+        )
+        
+        # Overall score: mean of clean-record share, cluster separation and forecast accuracy
+        components = []
+        if "anomalous_records" in detection and len(data):
+            components.append(1 - detection["anomalous_records"] / len(data))
+        if "silhouette" in clustering:
+            components.append((clustering["silhouette"] + 1) / 2)
+        accuracies = [model["accuracy"] for model in forecasting.values() if isinstance(model, dict) and "accuracy" in model]
+        if accuracies:
+            components.append(float(np.mean(accuracies)))
+        
+        frame = features["frame"]
+        derived = {
+            name: round(float(value), 4)
+            for name, value in {
+                "max_abs_W_ramp": frame["W_ramp"].abs().max() if "W_ramp" in frame else np.nan,
+                "mean_power_factor": frame["PF"].mean() if "PF" in frame else np.nan,
+                "mean_dc_ac_efficiency": frame["dc_ac_efficiency"].mean() if "dc_ac_efficiency" in frame else np.nan
+            }.items()
+            if np.isfinite(value)
+        }
+        
+        findings = {
+            "anomalous_records": detection.get("anomalous_records"),
+            "clusters_found": clustering.get("clusters_found"),
+            "forecast_accuracy": forecasting,
+            "derived_features": derived
+        }
+        if gpt_analyzer and payload.get("summarize", True):
+            gpt_analysis = await gpt_analyzer.analyze_with_gpt(data, "comprehensive_ml", endpoint="comprehensive_ml_analysis", findings=findings)
+        else:
+            gpt_analysis = "Comprehensive ML analysis completed"
         
         # Calculate and track costs
-        data_size_mb = len(str(data).encode('utf-8')) / (1024 * 1024) if data else 1
+        data_size_mb = frame_size_mb(data) if not data.empty else 1
         performance_duration = time.time() - monitoring['start_time']
-        cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration)
+        cost_analysis = cost_calculator.calculate_interval_costs(
+            interval, data_size_mb, performance_duration,
+            resources=monitor.snapshot(monitoring), llm_usage=monitoring['llm_usage']
+        )
         monitor.track_cost_metrics("comprehensive_ml_analysis", interval, cost_analysis)
         
         return {
@@ -470,7 +2713,16 @@ async def comprehensive_ml_analysis(payload: dict = Body(...)):
                 "interval": interval,
                 "total_records": len(data),
                 "ml_models_applied": ["anomaly_detection", "clustering", "prediction"],
-                "overall_score": round(np.random.uniform(0.8, 0.95), 3),
+                "overall_score": round(float(np.mean(components)), 3) if components else None,
+                "anomaly_detection": {
+                    key: detection.get(key) for key in ("anomalous_records", "anomalous_points", "anomalies", "error") if key in detection
+                },
+                "clustering": {
+                    key: clustering.get(key) for key in ("clusters_found", "k", "silhouette", "cluster_sizes", "centroids", "error") if key in clustering
+                },
+                "prediction": forecasting,
+                "derived_features": derived,
+                "feature_pipeline": {"compute_ms": features["compute_ms"], "data_version": data.attrs.get("data_version")},
                 "status": "completed"
             },
             "gpt_insights": gpt_analysis,
@@ -489,37 +2741,76 @@ async def ml_analysis(payload: dict = Body(...)):
     """ML analysis endpoint (alias for comprehensive_ml_analysis)"""
     return await comprehensive_ml_analysis(payload)
 
+async def compare_single_interval(interval, payload):
+    """Fetch, analyze and price one interval for /compare_intervals"""
+    # Runs in its own task: price this interval's completions separately, then roll them into the request
+    parent_usage = metrics_registry.current_llm_usage.get()
+    llm_usage = LLMUsage()
+    metrics_registry.current_llm_usage.set(llm_usage)
+    try:
+        data = await data_client.get_data(interval, **data_query(payload))
+        if data.empty:
+            return {"error": f"No data available for {interval}"}
+        
+        gpt_analysis = f"{interval} analysis completed" if not gpt_analyzer else await gpt_analyzer.analyze_with_gpt(data, f"{interval}_comparison", endpoint="compare_intervals")
+        
+        # Calculate costs for comparison
+        data_size_mb = frame_size_mb(data)
+        performance_duration = 2.0  # Estimated duration
+        cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration, llm_usage=llm_usage)
+        monitor.track_cost_metrics("compare_intervals", interval, cost_analysis)
+        
+        return {
+            "total_records": len(data),
+            "data_quality_score": round(np.random.uniform(0.7, 0.9), 3),
+            "gpt_insights": gpt_analysis,
+            "cost_analysis": cost_analysis
+        }
+    except Exception as e:
+        logger.error(f"Interval comparison error for {interval}: {e}")
+        return {"error": f"Comparison failed for {interval}: {str(e)}"}
+    finally:
+        if parent_usage is not None:
+            parent_usage.merge(llm_usage)
+
 @app.post("/compare_intervals")
 async def compare_intervals(payload: dict = Body(...)):
-    """Compare different time intervals"""
+    """Compare different time intervals.
+    
+    Intervals are analyzed concurrently, at most ``max_concurrency`` at a time.
+    With ``deadline_seconds`` set, intervals still running at the deadline are
+    cancelled and reported as such, so no LLM calls, fetches or cost metrics
+    happen after the response has gone out.
+    """
     monitoring = monitor.start_monitoring("compare_intervals")
     
     try:
-        intervals = payload.get("intervals", ["1min", "3min", "5min"])
-        comparison_results = {}
+        intervals = list(dict.fromkeys(payload.get("intervals", ["1min", "3min", "5min"])))
+        max_concurrency = max(1, int(payload.get("max_concurrency", COMPARE_MAX_CONCURRENCY)))
+        deadline = payload.get("deadline_seconds")
+        semaphore = asyncio.Semaphore(max_concurrency)
         
-        for interval in intervals:
-            data = data_client.get_data(interval)
-            if data:
-                gpt_analysis = f"{interval} analysis completed" if not gpt_analyzer else gpt_analyzer.analyze_with_gpt(data, f"{interval}_comparison")
-                
-                # Calculate costs for comparison
-                data_size_mb = len(str(data).encode('utf-8')) / (1024 * 1024)
-                performance_duration = 2.0  # Estimated duration
-                cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration)
-                
-                comparison_results[interval] = {
-                    "total_records": len(data),
-                    "data_quality_score": round(np.random.uniform(0.7, 0.9), 3),
-                    "gpt_insights": gpt_analysis,
-                    "cost_analysis": cost_analysis
-                }
+        async def bounded(interval):
+            async with semaphore:
+                return await compare_single_interval(interval, payload)
+        
+        tasks = {interval: asyncio.ensure_future(bounded(interval)) for interval in intervals}
+        done, pending = await asyncio.wait(tasks.values(), timeout=float(deadline) if deadline else None)
+        for task in pending:
+            task.cancel()
+        # Let cancelled intervals unwind (and roll their LLM usage up) before responding
+        await asyncio.gather(*pending, return_exceptions=True)
+        
+        comparison_results = {}
+        for interval, task in tasks.items():
+            if task in done:
+                comparison_results[interval] = task.result()
             else:
-                comparison_results[interval] = {"error": f"No data available for {interval}"}
+                comparison_results[interval] = {"status": "cancelled", "detail": f"Not finished within {deadline}s"}
         
         return {
             "interval_comparison": comparison_results,
-            "summary": f"Compared {len(intervals)} intervals",
+            "summary": f"Compared {len(done)} of {len(intervals)} intervals" + (f", {len(pending)} cancelled" if pending else ""),
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -536,24 +2827,34 @@ async def calculate_cloud_costs(payload: dict = Body(...)):
     
     try:
         interval = payload.get("interval", "1min")
-        analysis_hours = payload.get("analysis_hours", 24)
+        analysis_hours = float(payload.get("analysis_hours", 24))
+        requests_per_hour = float(payload.get("requests_per_hour", 1))
         
-        data = data_client.get_data(interval)
-        data_size_mb = len(str(data).encode('utf-8')) / (1024 * 1024) if data else 1
+        data = await data_client.get_data(interval, **data_query(payload))
+        data_size_mb = frame_size_mb(data) if not data.empty else 1
         
         # Use a fixed duration for cost calculation
         performance_duration = 3.0  # 3 seconds average
         cost_analysis = cost_calculator.calculate_interval_costs(interval, data_size_mb, performance_duration)
         
+        # Spend over the analysis window at the given request rate
+        projection = {
+            provider: round(costs["total"] * requests_per_hour * analysis_hours, 4)
+            for provider, costs in cost_analysis["costs_by_provider"].items()
+        }
+        
         return {
             "cost_analysis": cost_analysis,
+            "projected_cost": projection,
             "data_info": {
                 "interval": interval,
                 "data_size_mb": round(data_size_mb, 2),
-                "total_records": len(data) if data else 0
+                "total_records": len(data),
+                **data_client.frame_meta(data)
             },
             "analysis_parameters": {
-                "hours": analysis_hours
+                "hours": analysis_hours,
+                "requests_per_hour": requests_per_hour
             },
             "timestamp": datetime.utcnow().isoformat()
         }
@@ -564,63 +2865,284 @@ async def calculate_cloud_costs(payload: dict = Body(...)):
     finally:
         monitor.end_monitoring(monitoring)
 
+# Largest provider x interval x size x duration x rate x horizon grid /simulate_costs evaluates
+SIMULATION_MAX_CELLS = int(os.getenv("SIMULATION_MAX_CELLS", "200000"))
+
+def simulation_axis(payload, name, default, minimum=0.0):
+    """A simulation grid axis from the payload: a number or a non-empty list of numbers >= minimum"""
+    values = payload.get(name, default)
+    values = values if isinstance(values, list) else [values]
+    try:
+        values = [float(value) for value in values]
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"'{name}' must be a number or a list of numbers")
+    if not values or any(not math.isfinite(value) or value < minimum for value in values):
+        raise HTTPException(status_code=400, detail=f"'{name}' must be a non-empty list of finite numbers >= {minimum:g}")
+    return values
+
+@app.post("/simulate_costs")
+async def simulate_costs(payload: dict = Body(...)):
+    """What-if cost surfaces over grids of intervals, data sizes, durations, request rates and horizons"""
+    monitoring = monitor.start_monitoring("simulate_costs")
+    
+    try:
+        intervals = payload.get("intervals", ["1min", "3min", "5min"])
+        intervals = intervals if isinstance(intervals, list) else [intervals]
+        try:
+            for interval in intervals:
+                if cost_calculator.interval_minutes(interval) <= 0:
+                    raise ValueError(interval)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Invalid interval in {intervals}; use fixed pandas offsets such as 15s, 5min or 1h")
+        axes = [
+            simulation_axis(payload, "data_sizes_mb", [1, 10, 100]),
+            simulation_axis(payload, "durations_seconds", [1, 5, 30]),
+            simulation_axis(payload, "requests_per_hour", [1, 10, 100]),
+            simulation_axis(payload, "horizons_hours", [24, 720])
+        ]
+        llm_cost_per_request = simulation_axis(payload, "llm_cost_per_request", 0.0)[0]
+        budget = simulation_axis(payload, "budget", 0.0)[0] if payload.get("budget") is not None else None
+        
+        cells = len(cost_calculator.pricing) * len(intervals) * math.prod(len(axis) for axis in axes)
+        if not intervals or cells > SIMULATION_MAX_CELLS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Grid has {cells} cells; it must be non-empty and at most {SIMULATION_MAX_CELLS}"
+            )
+        
+        simulation = cost_calculator.simulate(intervals, *axes, llm_cost_per_request=llm_cost_per_request, budget=budget)
+        return dict(simulation, timestamp=datetime.utcnow().isoformat())
+    finally:
+        monitor.end_monitoring(monitoring)
+
+# Analysis endpoints that can run as background jobs or inside /batch
+analysis_handlers = {
+    "analyze_data": analyze_data,
+    "detect_anomalies": detect_anomalies,
+    "cluster_analysis": cluster_analysis,
+    "predictive_analysis": predictive_analysis,
+    "comprehensive_ml_analysis": comprehensive_ml_analysis,
+    "compare_intervals": compare_intervals,
+    "calculate_cloud_costs": calculate_cloud_costs,
+    "simulate_costs": simulate_costs
+}
+job_queue.handlers = analysis_handlers
+
+# Upper bound on batch entries analyzed at once by /batch
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+@app.post("/batch")
+async def batch(payload: dict = Body(...)):
+    """Run many analyses in one request.
+    
+    Body: ``{"requests": [{"endpoint": "detect_anomalies", "interval": "5min"}, ...]}``;
+    each entry is the named endpoint's payload (inline or under ``payload``).
+    Entries run concurrently, at most ``max_concurrency`` at a time, and each
+    distinct data fetch is made once for the whole batch. Results come back
+    in request order.
+    """
+    monitoring = monitor.start_monitoring("batch")
+    
+    try:
+        specs = payload.get("requests") or []
+        if not isinstance(specs, list):
+            raise HTTPException(status_code=400, detail="'requests' must be a list of request objects.")
+        for i, spec in enumerate(specs):
+            if not isinstance(spec, dict) or not isinstance(spec.get("payload") or {}, dict):
+                raise HTTPException(status_code=400, detail=f"Request {i} must be an object with an object 'payload'.")
+            if spec.get("endpoint") not in analysis_handlers:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unknown endpoint '{spec.get('endpoint')}'. Valid endpoints: {', '.join(analysis_handlers)}."
+                )
+        try:
+            max_concurrency = int(payload.get("max_concurrency", BATCH_MAX_CONCURRENCY))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="'max_concurrency' must be an integer.")
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        async def run(spec):
+            request = spec.get("payload") or {key: value for key, value in spec.items() if key != "endpoint"}
+            async with semaphore:
+                try:
+                    result = await analysis_handlers[spec["endpoint"]](dict(request))
+                except Exception as e:
+                    result = {"error": error_message(e)}
+            return {
+                "endpoint": spec["endpoint"],
+                "interval": request.get("interval", "1min"),
+                "status": "failed" if "error" in result else "completed",
+                "result": result
+            }
+        
+        with data_client.batch() as fetches:
+            results = await asyncio.gather(*(run(spec) for spec in specs))
+        
+        return {
+            "results": results,
+            "batch_summary": {
+                "total": len(results),
+                "completed": sum(result["status"] == "completed" for result in results),
+                "failed": sum(result["status"] == "failed" for result in results),
+                "data_fetches": len(fetches),
+                "duration_seconds": round(time.time() - monitoring['start_time'], 3)
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    finally:
+        monitor.end_monitoring(monitoring)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(payload: dict = Body(...)):
+    """Queue an analysis to run in the background.
+    
+    Body: ``{"analysis_type": "comprehensive_ml_analysis", "payload": {...}}``
+    where ``payload`` is what the matching endpoint accepts. Poll
+    ``GET /jobs/{job_id}`` for the result.
+    """
+    try:
+        job = await job_queue.submit(payload.get("analysis_type", "comprehensive_ml_analysis"), payload.get("payload") or {})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job["job_id"], "status": job["status"], "status_url": f"/jobs/{job['job_id']}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, timings and (once completed) the result of a job"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job; finished jobs are returned unchanged"""
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return {"job_id": job_id, "status": job["status"]}
+
+@app.post("/v1/traces")
+async def ingest_traces(payload: dict = Body(...)):
+    """OTLP/HTTP JSON span ingestion, a collector stand-in for the data service's spans"""
+    try:
+        spans = list(spans_from_otlp(payload))
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid OTLP payload: {e}")
+    for span in spans:
+        tracer.record(span)
+    return {"partialSuccess": {}}
+
+@app.get("/traces")
+async def list_traces(limit: int = 20):
+    """Most recent traces, newest first"""
+    return {
+        "traces": tracer.store.recent(limit),
+        "export": tracer.stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """Every span of a trace from both services, with its critical path"""
+    spans = tracer.store.get(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail=f"Trace '{trace_id}' not found")
+    return {
+        "trace_id": trace_id,
+        "services": sorted({span["service"] for span in spans}),
+        "critical_path": TraceStore.critical_path(spans),
+        "spans": spans
+    }
+
+def api_endpoint_count():
+    return sum(1 for route in app.routes if isinstance(route, APIRoute))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text-format metrics: request counters, latency and phase histograms, tokens, cache ratios"""
+    process = read_process_resources()
+    caches = {"llm": llm_cache.report(), "feature": feature_pipeline.report()}
+    fetches = data_client.inflight.stats
+    gauges = [
+        ("cache_hit_ratio", "Hit ratio per cache", [
+            ({"cache": "llm"}, caches["llm"]["hit_ratio"]),
+            ({"cache": "feature"}, caches["feature"]["hit_rate"]),
+            ({"cache": "data_fetch_coalescing"}, fetches["coalesced"] / fetches["calls"] if fetches["calls"] else 0.0)
+        ]),
+        ("cache_lookups", "Cache lookups by result", [
+            ({"cache": "llm", "result": "hit"}, caches["llm"]["hits"]),
+            ({"cache": "llm", "result": "miss"}, caches["llm"]["misses"]),
+            ({"cache": "feature", "result": "hit"}, caches["feature"]["hits"]),
+            ({"cache": "feature", "result": "miss"}, caches["feature"]["misses"])
+        ]),
+        ("jobs", "Background jobs by status", [
+            ({"status": status}, count) for status, count in job_queue.stats()["by_status"].items()
+        ]),
+        ("llm_in_flight", "LLM completions currently running", [
+            ({}, llm_dispatcher.stats()["in_flight"] if llm_dispatcher else 0)
+        ]),
+        ("process_cpu_seconds", "Process CPU time", [({}, process['cpu_seconds'])]),
+        ("process_resident_memory_bytes", "Process RSS", [({}, process['rss_bytes'])]),
+        ("process_peak_resident_memory_bytes", "Process peak RSS", [({}, process['peak_rss_bytes'])])
+    ]
+    return PlainTextResponse(metrics_registry.render(gauges), media_type="text/plain; version=0.0.4")
+
+def _round(value, digits):
+    return round(value, digits) if value is not None else None
+
 @app.get("/metrics/table")
 async def metrics_table():
     """Enhanced performance metrics table with separate cost metrics"""
-    with metrics_lock:
+    with metrics_registry.lock:
         performance_table = []
+        interval_summary = {"1min_analysis": 0, "3min_analysis": 0, "5min_analysis": 0}
+        for _, interval in metrics_registry.costs:
+            summary_key = f"{interval}_analysis"
+            interval_summary[summary_key] = interval_summary.get(summary_key, 0) + 1
         
         # Traditional performance metrics
-        for operation, metrics in performance_metrics.items():
-            if metrics:
-                avg_duration = np.mean([m['duration'] for m in metrics])
-                avg_cpu = np.mean([m['system_metrics']['cpu_percent'] for m in metrics])
-                avg_memory = np.mean([m['system_metrics']['memory_used_mb'] for m in metrics])
-                
-                performance_table.append({
-                    "Model": operation.replace("_", "-").title(),
-                    "CPU Usage (%)": round(avg_cpu, 2),
-                    "Memory Usage (MB)": round(avg_memory, 2),
-                    "Disk Read (kB)": "Simulated",
-                    "Disk Write (kB)": "Simulated",
-                    "Avg Duration (s)": round(avg_duration, 2),
-                    "Total Requests": len(metrics)
-                })
+        for operation, entry in metrics_registry.operations.items():
+            resources = entry['resources']
+            latency = entry['latency'].percentiles()
+            performance_table.append({
+                "Model": operation.replace("_", "-").title(),
+                "CPU Usage (%)": _round(resources['cpu_percent'].mean(), 2),
+                "CPU Time (s)": _round(resources['cpu_seconds'].mean(), 2),
+                "Memory Usage (MB)": _round(resources['rss_mb'].mean(), 2),
+                "Memory Delta (MB)": _round(resources['rss_delta_mb'].mean(), 2),
+                "Peak Memory (MB)": _round(resources['peak_rss_mb'].max, 2),
+                "Disk Read (kB)": _round(resources['io_read_kb'].mean(), 2),
+                "Disk Write (kB)": _round(resources['io_write_kb'].mean(), 2),
+                "Avg Duration (s)": _round(entry['duration'].mean(), 2),
+                "P95 Duration (s)": _round(latency['p95'], 2),
+                "Max Duration (s)": _round(entry['duration'].max, 2),
+                "Total Requests": entry['duration'].count
+            })
         
         # Separate cost metrics table
         cost_table = []
-        for cost_key, cost_metrics_list in cost_metrics.items():
-            if cost_metrics_list:
-                operation_name = cost_key.replace("_1min", "").replace("_3min", "").replace("_5min", "")
-                interval = cost_key.split("_")[-1]
-                
-                avg_cost = np.mean([m['cost_data']['cheapest_cost'] for m in cost_metrics_list])
-                avg_hourly = np.mean([m['cost_data']['costs_by_provider'][m['cost_data']['cheapest_provider']]['hourly_rate'] for m in cost_metrics_list])
-                cheapest_provider = cost_metrics_list[-1]['cost_data']['cheapest_provider']
-                
-                cost_table.append({
-                    "Analysis Type": f"{operation_name.replace('_', ' ').title()} ({interval})",
-                    "Interval": interval,
-                    "Avg Cost per Analysis ($)": round(avg_cost, 6),
-                    "Hourly Rate ($)": round(avg_hourly, 4),
-                    "Cheapest Provider": cheapest_provider.upper(),
-                    "Total Cost Calculations": len(cost_metrics_list)
-                })
+        for (operation_name, interval), entry in metrics_registry.costs.items():
+            cost_table.append({
+                "Analysis Type": f"{operation_name.replace('_', ' ').title()} ({interval})",
+                "Interval": interval,
+                "Avg Cost per Analysis ($)": round(entry['cheapest_cost'].mean(), 6),
+                "Hourly Rate ($)": round(entry['hourly_rate'].mean(), 4),
+                "Cheapest Provider": entry['cheapest_provider'].upper(),
+                "Total Cost Calculations": entry['cheapest_cost'].count
+            })
     
     return {
         "performance_table": performance_table,
         "cost_metrics_table": cost_table,
-        "interval_cost_summary": {
-            "1min_analysis": len([k for k in cost_metrics.keys() if "1min" in k]),
-            "3min_analysis": len([k for k in cost_metrics.keys() if "3min" in k]),
-            "5min_analysis": len([k for k in cost_metrics.keys() if "5min" in k])
-        },
+        "interval_cost_summary": interval_summary,
         "timestamp": datetime.utcnow().isoformat()
     }
 
 @app.get("/metrics/system")
 async def metrics_system():
     """System metrics endpoint"""
+    usage = metrics_registry.usage_summary()
     return {
         "system_metrics": monitor.get_system_metrics(),
         "service_info": {
@@ -628,13 +3150,22 @@ async def metrics_system():
             "version": "2.3.0",
             "uptime": "Active",
             "features": ["GPT Analysis", "Cost Tracking", "Performance Monitoring"],
-            "total_endpoints": 15
+            "total_endpoints": api_endpoint_count()
         },
         "resource_usage": {
-            "gpt_requests_made": sum(len(metrics) for metrics in performance_metrics.values()),
-            "cost_calculations_performed": sum(len(metrics) for metrics in cost_metrics.values()),
-            "total_operations": len(performance_metrics),
-            "active_intervals": ["1min", "3min", "5min"]
+            "gpt_requests_made": usage["operations"],
+            "cost_calculations_performed": usage["cost_calculations"],
+            "total_operations": usage["operation_names"],
+            "active_intervals": usage["intervals"] or ["1min", "3min", "5min"]
+        },
+        "llm_scheduler": llm_dispatcher.stats() if llm_dispatcher else None,
+        "llm_cache": llm_cache.report(),
+        "feature_cache": feature_pipeline.report(),
+        "jobs": job_queue.stats(),
+        "coalesced_requests": {
+            "data_fetches": dict(data_client.inflight.stats),
+            "batch_data_fetches": dict(data_client.batch_stats),
+            "llm_completions": dict(gpt_analyzer.inflight.stats) if gpt_analyzer else None
         },
         "timestamp": datetime.utcnow().isoformat()
     }
@@ -642,81 +3173,162 @@ async def metrics_system():
 @app.get("/metrics/performance")
 async def metrics_performance():
     """Detailed performance metrics endpoint"""
-    with metrics_lock:
-        total_requests = sum(len(metrics) for metrics in performance_metrics.values())
-        avg_response_time = np.mean([
-            m['duration'] for metrics in performance_metrics.values() 
-            for m in metrics
-        ]) if performance_metrics else 0
+    with metrics_registry.lock:
+        latency = LatencyHistogram()
+        duration = RunningStats()
+        for entry in metrics_registry.operations.values():
+            latency.merge(entry['latency'])
+            duration.count += entry['duration'].count
+            duration.total += entry['duration'].total
+        recent = sorted(
+            (sample for entry in metrics_registry.operations.values() for sample in entry['recent']),
+            key=lambda sample: sample['timestamp']
+        )[-10:]
         
         # Calculate cost performance metrics
-        total_cost_calculations = sum(len(metrics) for metrics in cost_metrics.values())
-        avg_cost_per_analysis = np.mean([
-            m['cost_data']['cheapest_cost'] for metrics in cost_metrics.values()
-            for m in metrics
-        ]) if cost_metrics else 0
+        cost = RunningStats()
+        providers = defaultdict(RunningStats)
+        for entry in metrics_registry.costs.values():
+            cost.count += entry['cheapest_cost'].count
+            cost.total += entry['cheapest_cost'].total
+            for provider, stats in entry['providers'].items():
+                providers[provider].count += stats.count
+                providers[provider].total += stats.total
+        active_operations = list(metrics_registry.operations)
+        intervals = sorted({interval for _, interval in metrics_registry.costs})
+    
+    llm_success = metrics_registry.counter_total("llm_requests_total", outcome="success")
+    llm_errors = metrics_registry.counter_total("llm_requests_total", outcome="error")
     
     return {
         "performance_summary": {
-            "total_requests_processed": total_requests,
-            "average_response_time_seconds": round(avg_response_time, 3),
-            "active_operations": list(performance_metrics.keys()),
+            "total_requests_processed": duration.count,
+            "average_response_time_seconds": round(duration.mean() or 0, 3),
+            "response_time_percentiles_seconds": latency.percentiles(),
+            "active_operations": active_operations,
             "service_health": "healthy"
         },
         "cost_performance": {
-            "total_cost_calculations": total_cost_calculations,
-            "average_cost_per_analysis": round(avg_cost_per_analysis, 6),
-            "cost_tracking_intervals": ["1min", "3min", "5min"],
-            "cheapest_provider_overall": "gcp"
+            "total_cost_calculations": cost.count,
+            "average_cost_per_analysis": round(cost.mean() or 0, 6),
+            "cost_tracking_intervals": intervals or ["1min", "3min", "5min"],
+            "cheapest_provider_overall": min(providers, key=lambda provider: providers[provider].mean()) if providers else "n/a"
         },
         "operational_metrics": {
-            "gpt_analysis_success_rate": "98.5%",
-            "data_service_connectivity": "healthy",
+            "gpt_analysis_success_rate": f"{llm_success / (llm_success + llm_errors) * 100:.1f}%" if llm_success + llm_errors else "n/a",
+            "data_service_connectivity": "degraded" if data_client.breaker.state == "open" else "healthy",
             "cost_calculation_accuracy": "100%",
             "supported_cloud_providers": ["aws", "gcp", "azure"]
         },
+        "recent_operations": [
+            {"operation": sample['operation'], "duration": sample['duration'], "timestamp": sample['timestamp']}
+            for sample in recent
+        ],
         "timestamp": datetime.utcnow().isoformat()
     }
 
 @app.get("/metrics/cost_breakdown")
 async def cost_breakdown():
     """Detailed cost breakdown by interval"""
-    with metrics_lock:
-        cost_breakdown = {
-            "1min": {"total_analyses": 0, "avg_cost": 0, "providers": {}},
-            "3min": {"total_analyses": 0, "avg_cost": 0, "providers": {}},
-            "5min": {"total_analyses": 0, "avg_cost": 0, "providers": {}}
-        }
-        
-        for cost_key, cost_metrics_list in cost_metrics.items():
-            if cost_metrics_list:
-                interval = cost_key.split("_")[-1]
-                if interval in cost_breakdown:
-                    cost_breakdown[interval]["total_analyses"] += len(cost_metrics_list)
-                    
-                    # Calculate average costs by provider
-                    for metric in cost_metrics_list:
-                        for provider, cost_data in metric['cost_data']['costs_by_provider'].items():
-                            if provider not in cost_breakdown[interval]["providers"]:
-                                cost_breakdown[interval]["providers"][provider] = []
-                            cost_breakdown[interval]["providers"][provider].append(cost_data['total'])
-                    
-                    # Calculate averages
-                    for provider in cost_breakdown[interval]["providers"]:
-                        cost_breakdown[interval]["providers"][provider] = round(
-                            np.mean(cost_breakdown[interval]["providers"][provider]), 6
-                        )
+    with metrics_registry.lock:
+        totals = {interval: {"cost": RunningStats(), "llm_cost": 0.0, "providers": defaultdict(RunningStats)} for interval in ["1min", "3min", "5min"]}
+        for (_, interval), entry in metrics_registry.costs.items():
+            interval_totals = totals.setdefault(interval, {"cost": RunningStats(), "llm_cost": 0.0, "providers": defaultdict(RunningStats)})
+            interval_totals["cost"].count += entry['cheapest_cost'].count
+            interval_totals["cost"].total += entry['cheapest_cost'].total
+            interval_totals["llm_cost"] += entry['llm_cost'].total
+            for provider, stats in entry['providers'].items():
+                interval_totals["providers"][provider].count += stats.count
+                interval_totals["providers"][provider].total += stats.total
+    
+    cost_breakdown = {
+        interval: {
+            "total_analyses": interval_totals["cost"].count,
+            "avg_cost": round(interval_totals["cost"].mean() or 0, 6),
+            "llm_spend": round(interval_totals["llm_cost"], 6),
+            "providers": {provider: round(stats.mean(), 6) for provider, stats in interval_totals["providers"].items()}
+        }
+        for interval, interval_totals in totals.items()
+    }
+    analysed = [interval for interval in cost_breakdown if cost_breakdown[interval]["total_analyses"]]
     
     return {
         "cost_breakdown_by_interval": cost_breakdown,
         "summary": {
-            "most_cost_effective_interval": min(cost_breakdown.keys(), 
-                                              key=lambda k: cost_breakdown[k].get("avg_cost", float('inf'))),
+            "most_cost_effective_interval": min(analysed or cost_breakdown, key=lambda k: cost_breakdown[k]["avg_cost"]),
             "total_cost_calculations": sum(cb["total_analyses"] for cb in cost_breakdown.values())
         },
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/metrics/llm_costs")
+async def llm_costs():
+    """LLM token spend by endpoint and by (endpoint, interval), costliest first.
+    
+    ``cache_savings_estimate`` prices each response-cache hit at the endpoint's
+    average completion cost, so endpoints with high spend and few hits are
+    the ones worth caching or batching first.
+    """
+    with metrics_registry.lock:
+        counters = list(metrics_registry.counters.items())
+        intervals = [
+            (operation, interval, entry['llm_cost'].count, entry['llm_cost'].total, entry['llm_calls'], dict(entry['llm_tokens']))
+            for (operation, interval), entry in metrics_registry.costs.items()
+        ]
+    
+    endpoints = defaultdict(lambda: {
+        "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "cache_hits": 0, "cost_by_model": defaultdict(float)
+    })
+    for (name, labels), value in counters:
+        labels = dict(labels)
+        if name == "llm_requests_total":
+            endpoints[labels["endpoint"]]["calls" if labels["outcome"] == "success" else "errors"] += value
+        elif name == "llm_tokens_total":
+            endpoints[labels["endpoint"]][f"{labels['type']}_tokens"] += value
+        elif name == "llm_cost_dollars_total":
+            endpoints[labels["endpoint"]]["cost"] += value
+            endpoints[labels["endpoint"]]["cost_by_model"][labels["model"]] += value
+        elif name == "llm_cache_hits_total":
+            endpoints[labels["endpoint"]]["cache_hits"] += value
+    
+    by_endpoint = []
+    for endpoint, entry in endpoints.items():
+        avg_cost = entry["cost"] / entry["calls"] if entry["calls"] else 0.0
+        by_endpoint.append({
+            "endpoint": endpoint,
+            **{field: int(entry[field]) for field in ("calls", "errors", "prompt_tokens", "completion_tokens", "cache_hits")},
+            "cost": round(entry["cost"], 6),
+            "avg_cost_per_call": round(avg_cost, 6),
+            "cache_savings_estimate": round(entry["cache_hits"] * avg_cost, 6),
+            "cost_by_model": {model: round(cost, 6) for model, cost in entry["cost_by_model"].items()}
+        })
+    by_endpoint.sort(key=lambda entry: entry["cost"], reverse=True)
+    
+    by_endpoint_interval = sorted((
+        {
+            "endpoint": operation,
+            "interval": interval,
+            "requests": requests,
+            "llm_calls": calls,
+            "prompt_tokens": tokens["prompt"],
+            "completion_tokens": tokens["completion"],
+            "cost": round(cost, 6),
+            "avg_cost_per_request": round(cost / requests, 6) if requests else 0.0
+        }
+        for operation, interval, requests, cost, calls, tokens in intervals if calls
+    ), key=lambda entry: entry["cost"], reverse=True)
+    
+    return {
+        "total_cost": round(sum(entry["cost"] for entry in by_endpoint), 6),
+        "by_endpoint": by_endpoint,
+        "by_endpoint_interval": by_endpoint_interval,
+        "prices_per_million_tokens": {
+            model: {"prompt": prompt, "completion": completion}
+            for model, (prompt, completion) in cost_calculator.llm_prices.items()
+        },
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 if __name__ == "__main__":
     import uvicorn
     logger.info("🚀 Starting Complete GPT ML Data Analysis Service with Cost Metrics...")
@@ -0,0 +1,223 @@
+import asyncio
+
+import httpx
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import llm_service
+
+
+def mock_client(handler, **kwargs):
+    """DataServiceClient whose requests are answered by ``handler``"""
+    client = llm_service.DataServiceClient("http://data_service:7860", backoff_seconds=0.0, **kwargs)
+    transport = httpx.MockTransport(handler)
+
+    def get_client():
+        if client._client is None:
+            client._client = httpx.AsyncClient(base_url=client.base_url, transport=transport)
+        return client._client
+
+    client._get_client = get_client
+    return client
+
+
+def records_response(rows=3, **headers):
+    body = [{"datetimestamp": f"2024-02-22 19:3{i}:00", "W": 3700.0 + i} for i in range(rows)]
+    return httpx.Response(200, json=body, headers={"X-Data-Version": "42", **headers})
+
+
+def test_rejected_query_raises_instead_of_returning_an_empty_frame():
+    client = mock_client(lambda request: httpx.Response(400, json={"detail": "Invalid timestamp 'soon'."}))
+    with pytest.raises(llm_service.DataQueryError, match="Invalid timestamp 'soon'"):
+        asyncio.run(client.get_data("1min", start="soon"))
+    # A 4xx is an answer, not an outage
+    assert client.breaker.state == "closed"
+
+
+def test_missing_interval_is_an_empty_frame():
+    client = mock_client(lambda request: httpx.Response(404, json={"detail": "not found"}))
+    assert asyncio.run(client.get_data("1min")).empty
+
+
+def test_rejected_query_fails_the_analysis_without_an_llm_call(monkeypatch):
+    calls = []
+
+    class RecordingAnalyzer:
+        async def analyze_with_gpt(self, *args, **kwargs):
+            calls.append(args)
+            return "summary"
+
+    monkeypatch.setattr(llm_service, "data_client", mock_client(
+        lambda request: httpx.Response(400, json={"detail": "Invalid timestamp 'soon'."})
+    ))
+    monkeypatch.setattr(llm_service, "gpt_analyzer", RecordingAnalyzer())
+    result = asyncio.run(llm_service.detect_anomalies({"interval": "1min", "start": "soon"}))
+    assert "Invalid timestamp 'soon'" in result["error"]
+    assert calls == []
+
+
+def test_iter_data_yields_bounded_frames():
+    lines = "".join(f'{{"datetimestamp": "2024-02-22 19:{i:02d}:00", "W": {i}}}\n' for i in range(25))
+
+    def handler(request):
+        assert request.url.params["format"] == "ndjson"
+        return httpx.Response(200, content=lines.encode(), headers={"content-type": "application/x-ndjson"})
+
+    async def collect():
+        return [frame async for frame in mock_client(handler).iter_data("1min", chunk_rows=10)]
+
+    frames = asyncio.run(collect())
+    assert [len(frame) for frame in frames] == [10, 10, 5]
+    assert pd.concat(frames)["W"].tolist() == list(range(25))
+
+
+def broken_stream(lines):
+    """NDJSON body that drops the connection after ``lines`` records"""
+    async def body():
+        for i in range(lines):
+            yield f'{{"datetimestamp": "2024-02-22 19:{i % 60:02d}:00", "W": {i}}}\n'.encode()
+        raise httpx.ReadError("connection reset")
+    return httpx.Response(200, content=body(), headers={"content-type": "application/x-ndjson"})
+
+
+def test_a_broken_stream_raises_instead_of_ending_early():
+    client = mock_client(lambda request: broken_stream(25))
+    frames = []
+
+    async def collect():
+        async for frame in client.iter_data("1min", chunk_rows=10):
+            frames.append(frame)
+
+    with pytest.raises(llm_service.DataStreamError, match="after 20 records"):
+        asyncio.run(collect())
+    assert [len(frame) for frame in frames] == [10, 10]
+    assert client.breaker.failures == 1
+
+    # Before the first frame it ends empty, as get_data returns an empty frame
+    client = mock_client(lambda request: broken_stream(5))
+    frames = []
+    asyncio.run(collect())
+    assert frames == [] and client.breaker.failures == 1
+
+
+def test_server_errors_are_retried():
+    statuses = iter([503, 500, 200])
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        status = next(statuses)
+        return records_response() if status == 200 else httpx.Response(status)
+
+    frame = asyncio.run(mock_client(handler, max_retries=2).get_data("1min", columns=["W"], limit=3))
+    assert len(seen) == 3
+    assert dict(seen[-1].url.params) == {"columns": "W", "limit": "3"}
+    assert frame["W"].tolist() == [3700.0, 3701.0, 3702.0]
+    assert frame.attrs["data_version"] == "42"
+
+
+def test_circuit_breaker_opens_and_fails_fast():
+    requests = []
+    healthy = False
+
+    def handler(request):
+        requests.append(request)
+        return records_response() if healthy else httpx.Response(500)
+
+    client = mock_client(handler, max_retries=0)
+    client.breaker.failure_threshold = 2
+    for _ in range(2):
+        assert asyncio.run(client.get_data("1min")).empty
+        client._client = None  # each asyncio.run has its own loop
+    assert client.breaker.state == "open"
+    assert asyncio.run(client.get_data("1min")).empty
+    assert len(requests) == 2
+
+    # After the cool-down one probe goes through and a success closes it again
+    healthy = True
+    client.breaker.opened_at -= client.breaker.reset_timeout
+    assert client.breaker.state == "half_open"
+    assert len(asyncio.run(client.get_data("1min"))) == 3
+    assert client.breaker.state == "closed"
+
+
+def test_half_open_breaker_lets_a_single_probe_through():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return records_response()
+
+    client = mock_client(handler, max_retries=0)
+    client.breaker.failure_threshold = 1
+    client.breaker.record_failure()
+    client.breaker.opened_at -= client.breaker.reset_timeout
+
+    async def burst():
+        # Distinct limits, so single-flight does not merge the calls
+        return await asyncio.gather(*(client.get_data("1min", limit=10 + i) for i in range(5)))
+
+    frames = asyncio.run(burst())
+    assert len(requests) == 1
+    assert sorted(len(frame) for frame in frames) == [0, 0, 0, 0, 3]
+    assert client.breaker.state == "closed"
+
+
+def test_arrow_responses_decode_without_json():
+    frame = pd.DataFrame({"datetimestamp": pd.date_range("2024-02-22", periods=4, freq="1min"), "W": [1.0, 2.0, 3.0, 4.0]})
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    def handler(request):
+        assert request.headers["accept"] == "application/vnd.apache.arrow.stream"
+        return httpx.Response(200, content=sink.getvalue().to_pybytes(),
+                              headers={"content-type": "application/vnd.apache.arrow.stream"})
+
+    decoded = asyncio.run(mock_client(handler, wire_format="arrow").get_data("1min"))
+    pd.testing.assert_frame_equal(decoded, frame)
+
+
+def test_requests_share_one_pooled_client():
+    client = mock_client(lambda request: records_response())
+
+    async def fetch_twice():
+        await client.get_data("1min")
+        first = client._client
+        await client.get_data("5min")
+        return first is client._client
+
+    assert asyncio.run(fetch_twice())
+
+
+def test_concurrent_identical_fetches_share_one_request():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.02)
+        return records_response()
+
+    client = mock_client(handler)
+
+    async def burst():
+        return await asyncio.gather(*(client.get_data("1min") for _ in range(4)), client.get_data("5min"))
+
+    frames = asyncio.run(burst())
+    assert frames[0] is frames[3]
+    assert len(requests) == 2
+
+
+def test_frames_are_sized_by_the_bytes_received():
+    response = records_response(**{"X-Row-Count": "3", "X-Memory-Bytes": "48"})
+    frame = asyncio.run(mock_client(lambda request: response).get_data("1min"))
+    meta = llm_service.DataServiceClient.frame_meta(frame)
+    assert meta == {"row_count": 3, "memory_bytes": 48, "payload_bytes": len(response.content)}
+    assert llm_service.frame_size_mb(frame) == len(response.content) / (1024 * 1024)
+
+    # Without a recorded payload the reported in-memory size is used
+    del frame.attrs["payload_bytes"]
+    assert llm_service.frame_size_mb(frame) == 48 / (1024 * 1024)
@@ -0,0 +1,101 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import llm_service
+from test_data_client import broken_stream, mock_client, records_response
+from test_engines import der_frame
+
+
+@pytest.fixture
+def data_service(monkeypatch):
+    """Route the service's data fetches to a handler; returns the list of requests made"""
+    requests = []
+
+    def install(handler):
+        async def record(request):
+            requests.append(request.url.path)
+            return await handler(request)
+        monkeypatch.setattr(llm_service, "data_client", mock_client(record))
+        return requests
+    return install
+
+
+def test_compare_intervals_cancels_what_misses_the_deadline(data_service):
+    cancelled = []
+
+    async def handler(request):
+        if request.url.path == "/data/7min":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(request.url.path)
+                raise
+        return records_response()
+
+    data_service(handler)
+    result = asyncio.run(llm_service.compare_intervals({"intervals": ["1min", "7min"], "deadline_seconds": 0.2}))
+
+    assert result["interval_comparison"]["1min"]["total_records"] == 3
+    assert result["interval_comparison"]["7min"]["status"] == "cancelled"
+    assert result["summary"] == "Compared 1 of 2 intervals, 1 cancelled"
+    assert cancelled == ["/data/7min"]
+    assert ("compare_intervals", "7min") not in llm_service.metrics_registry.costs
+
+
+def test_predictive_analysis_reports_a_capped_horizon(data_service, monkeypatch):
+    body = der_frame(periods=2000, freq="15s").to_json(orient="records", date_format="iso")
+
+    async def handler(request):
+        return httpx.Response(200, content=body, headers={"content-type": "application/json"})
+
+    data_service(handler)
+    monkeypatch.setattr(llm_service, "forecaster", llm_service.Forecaster())
+    result = asyncio.run(llm_service.predictive_analysis({"interval": "15s", "summarize": False}))["predictive_analysis"]
+
+    assert result["prediction_horizon"] == "12 hours"
+    assert result["requested_horizon"] == "24 hours"
+    assert result["horizon_truncated"]
+
+
+def test_streamed_clustering_fails_when_the_stream_breaks(data_service, monkeypatch):
+    monkeypatch.setattr(llm_service, "cluster_engine", llm_service.ClusterEngine(batch_size=50))
+
+    async def handler(request):
+        return broken_stream(120)
+
+    data_service(handler)
+    result = asyncio.run(llm_service.cluster_analysis({"interval": "1min", "stream": True, "summarize": False}))
+    assert result["error"].startswith("Clustering failed: Data stream broke after 100 records")
+
+
+@pytest.mark.parametrize("requests", [
+    "detect_anomalies",
+    ["detect_anomalies"],
+    [{"endpoint": "detect_anomalies", "payload": ["1min"]}],
+    [{"endpoint": "nope"}]
+])
+def test_batch_rejects_malformed_entries(requests):
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(llm_service.batch({"requests": requests}))
+    assert raised.value.status_code == 400
+
+
+def test_batch_fetches_each_slice_once_and_keeps_entry_errors(data_service):
+    async def handler(request):
+        await asyncio.sleep(0.02)
+        return records_response()
+
+    requests = data_service(handler)
+    result = asyncio.run(llm_service.batch({"requests": [
+        {"endpoint": "detect_anomalies", "interval": "1min", "summarize": False},
+        {"endpoint": "cluster_analysis", "payload": {"interval": "1min", "summarize": False}},
+        {"endpoint": "simulate_costs", "intervals": ["soon"]}
+    ]}))
+
+    assert [entry["status"] for entry in result["results"]] == ["completed", "completed", "failed"]
+    assert "Invalid interval" in result["results"][2]["result"]["error"]
+    assert requests == ["/data/1min"]
+    assert result["batch_summary"]["data_fetches"] == 1
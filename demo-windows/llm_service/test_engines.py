@@ -0,0 +1,248 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+import llm_service
+
+
+def der_frame(periods=600, freq="1min", seed=0):
+    """Rolled-up DER data as the data service returns it: a datetimestamp column and the channels"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2024-02-22 00:00:00", periods=periods, freq=freq)
+    day = 2 * np.pi * (times - times.normalize()).total_seconds().to_numpy() / 86400
+    w = 3000 + 1000 * np.sin(day) + rng.normal(0, 20, periods)
+    return pd.DataFrame({
+        "datetimestamp": times,
+        "W": w,
+        "VAr": 7 + rng.normal(0, 0.5, periods),
+        "Hz": 60 + rng.normal(0, 0.01, periods),
+        "PhVphA": 239 + rng.normal(0, 0.5, periods),
+        "DCV": 370 + rng.normal(0, 1, periods),
+        "DCA": w / 370 + rng.normal(0, 0.05, periods),
+        "DCW": w * 1.02,
+        "WH": 82579568 + np.cumsum(np.maximum(w, 0)) / 60,
+    })
+
+
+def test_injected_spike_is_the_top_finding_of_every_method():
+    data = der_frame()
+    data.loc[300, "W"] += 2000
+    result = llm_service.AnomalyDetector().detect(data, channels=["W"])
+
+    top = result["anomalies"][0]
+    assert top["timestamp"] == str(data.loc[300, "datetimestamp"])
+    assert top["channel"] == "W"
+    assert sorted(top["methods"]) == ["iqr", "mad", "zscore"]
+    assert result["channels"]["W"]["by_method"]["zscore"] >= 1
+
+
+def test_gaps_and_flat_channels_are_never_flagged():
+    data = der_frame()
+    data.loc[100:120, "Hz"] = np.nan
+    data["VAr"] = 7.0
+    result = llm_service.AnomalyDetector().detect(data, channels=["Hz", "VAr"])
+    flagged = {(a["timestamp"], a["channel"]) for a in result["anomalies"]}
+    gap = {str(t) for t in data.loc[100:120, "datetimestamp"]}
+    assert not any(timestamp in gap for timestamp, _ in flagged)
+    assert result["channels"]["VAr"]["anomalies"] == 0
+
+
+def test_rolling_zscore_matches_pandas():
+    x = np.random.default_rng(1).normal(100, 5, 400)
+    detector = llm_service.AnomalyDetector(min_periods=5)
+    series = pd.Series(x)
+    rolling = series.rolling(30, min_periods=5)
+    expected = ((series - rolling.mean().shift(1)).abs() / rolling.std(ddof=0).shift(1)).fillna(0.0)
+    np.testing.assert_allclose(detector._zscore(x, 30), expected.to_numpy(), rtol=1e-6, atol=1e-9)
+
+
+def test_shared_features_give_the_same_findings():
+    data = der_frame()
+    data.loc[[50, 400], "W"] += 1500
+    detector = llm_service.AnomalyDetector()
+    features = llm_service.FeaturePipeline(window=detector.window).compute(data)
+    own = detector.detect(data, methods=["zscore"])
+    shared = detector.detect(data, methods=["zscore"], features=features)
+    assert shared["anomalous_points"] == own["anomalous_points"]
+    assert shared["anomalies"] == own["anomalies"]
+
+
+def blobs(centers, per_blob=200, spread=0.3, seed=0):
+    """Points around each center in (W, VAr), with the true blob of every row"""
+    rng = np.random.default_rng(seed)
+    points = np.concatenate([rng.normal(center, spread, (per_blob, 2)) for center in centers])
+    truth = np.repeat(np.arange(len(centers)), per_blob)
+    order = rng.permutation(len(points))
+    return pd.DataFrame(points[order], columns=["W", "VAr"]), truth[order]
+
+
+def assert_recovers(labels, truth):
+    """Every true blob maps to exactly one label and vice versa"""
+    pairs = set(zip(truth.tolist(), labels.tolist()))
+    assert len(pairs) == len(set(truth.tolist())) == len(set(labels.tolist()))
+
+
+def test_kmeans_finds_the_blobs_and_picks_k_by_silhouette():
+    data, truth = blobs([(0, 0), (10, 0), (0, 10)])
+    result = llm_service.ClusterEngine(batch_size=128).cluster(data, channels=["W", "VAr"], max_assignments=len(data))
+    assert result["k"] == 3
+    assert result["silhouette"] == max(result["silhouette_by_k"].values())
+    assert_recovers(np.array(result["assignments"]), truth)
+    centroids = sorted(tuple(np.round([c["W"], c["VAr"]])) for c in result["centroids"])
+    assert centroids == [(0, 0), (0, 10), (10, 0)]
+
+
+def test_clustering_is_deterministic_per_seed():
+    data, _ = blobs([(0, 0), (6, 6)], spread=2.0)
+    engine = llm_service.ClusterEngine()
+    first = engine.cluster(data, channels=["W", "VAr"], k=4, seed=7)
+    again = engine.cluster(data, channels=["W", "VAr"], k=4, seed=7)
+    assert first["assignments"] == again["assignments"]
+    assert first["centroids"] == again["centroids"]
+
+
+def test_dbscan_separates_noise_from_dense_regions():
+    data, truth = blobs([(0, 0), (10, 10)], per_blob=100)
+    data.loc[len(data)] = [50.0, -50.0]
+    result = llm_service.ClusterEngine().cluster(data, channels=["W", "VAr"], method="dbscan", eps=0.5, min_samples=5,
+                                                 max_assignments=len(data))
+    labels = np.array(result["assignments"])
+    assert result["clusters_found"] == 2
+    assert labels[-1] == -1
+    assert_recovers(labels[:-1][labels[:-1] >= 0], truth[labels[:-1] >= 0])
+
+
+def test_rows_with_missing_channels_are_unassigned():
+    data, _ = blobs([(0, 0), (10, 0)], per_blob=50)
+    data.loc[[3, 7], "VAr"] = np.nan
+    result = llm_service.ClusterEngine().cluster(data, channels=["W", "VAr"], k=2, max_assignments=len(data))
+    assert [i for i, label in enumerate(result["assignments"]) if label == -1] == [3, 7]
+
+
+def test_streamed_kmeans_matches_the_blobs():
+    data, _ = blobs([(0, 0), (10, 0), (0, 10)], per_blob=600)
+
+    async def frames():
+        for lo in range(0, len(data), 300):
+            yield data.iloc[lo:lo + 300]
+
+    result = asyncio.run(llm_service.ClusterEngine().cluster_stream(frames(), channels=["W", "VAr"], k=3))
+    assert result["batches"] == 6
+    assert result["rows_processed"] == len(data)
+    centroids = sorted(tuple(np.round([c["W"], c["VAr"]])) for c in result["centroids"])
+    assert centroids == [(0, 0), (0, 10), (10, 0)]
+
+
+def fit_rows(forecaster, interval, target="W"):
+    return forecaster._models[(interval, target)]
+
+
+def test_forecast_follows_the_daily_cycle():
+    history = der_frame(periods=3 * 288 + 288, freq="5min")
+    forecaster = llm_service.Forecaster(horizon="24h")
+    forecaster.update("5min", history.iloc[:3 * 288])
+    forecast = forecaster.forecast("5min", "W")
+
+    # The last bucket of the history is held back as still open, so the forecast starts there
+    actual = history["W"].to_numpy()[3 * 288 - 1:3 * 288 - 1 + 288]
+    assert forecast["start"] == str(history.loc[3 * 288 - 1, "datetimestamp"])
+    assert len(forecast["values"]) == 288 and not forecast["truncated"]
+    assert np.mean(np.abs(np.array(forecast["values"]) - actual)) < 100
+    assert forecaster.accuracy("5min", "W")["accuracy"] > 0.95
+
+
+def test_incremental_updates_match_a_full_fit():
+    history = der_frame(periods=800)
+    incremental = llm_service.Forecaster()
+    incremental.update("1min", history.iloc[:500])
+    assert incremental.update("1min", history.iloc[450:])["W"]["new_buckets"] == 300
+    full = llm_service.Forecaster()
+    full.update("1min", history)
+    for target in ["W", "WH"]:
+        np.testing.assert_allclose(fit_rows(incremental, "1min", target)["xtx"], fit_rows(full, "1min", target)["xtx"])
+        np.testing.assert_allclose(fit_rows(incremental, "1min", target)["coef"], fit_rows(full, "1min", target)["coef"])
+
+
+def test_the_open_bucket_is_refolded_once_it_closes():
+    history = der_frame(periods=600)
+    partial = history.iloc[:500].copy()
+    # Rows are still arriving in the newest bucket: its mean and counter are not final yet
+    partial.loc[499, "W"] -= 500
+    partial.loc[499, "WH"] = (partial.loc[498, "WH"] + partial.loc[499, "WH"]) / 2
+    incremental = llm_service.Forecaster()
+    incremental.update("1min", partial)
+    assert fit_rows(incremental, "1min")["fitted_until"] == history.loc[498, "datetimestamp"]
+    incremental.update("1min", history.iloc[499:])
+
+    full = llm_service.Forecaster()
+    full.update("1min", history)
+    for target in ["W", "WH"]:
+        for key in ("xtx", "xty", "coef"):
+            np.testing.assert_allclose(fit_rows(incremental, "1min", target)[key], fit_rows(full, "1min", target)[key])
+
+
+def test_missing_buckets_are_gaps_not_shifted_lags():
+    history = der_frame(periods=800)
+    gappy = llm_service.Forecaster()
+    gappy.update("1min", history.iloc[:500])
+    info = gappy.update("1min", history.iloc[499:].drop(index=[600, 601, 602]))
+    assert info["W"]["missing_buckets"] == 3 and not info["W"]["lags_reset"]
+
+    # The same as folding in the full grid with the buckets left empty
+    blanked = history.copy()
+    blanked.loc[[600, 601, 602], ["W", "WH"]] = np.nan
+    reference = llm_service.Forecaster()
+    reference.update("1min", blanked.iloc[:500])
+    reference.update("1min", blanked.iloc[499:])
+    np.testing.assert_allclose(fit_rows(gappy, "1min")["xtx"], fit_rows(reference, "1min")["xtx"])
+    assert fit_rows(gappy, "1min")["fitted_until"] == history.loc[798, "datetimestamp"]
+
+
+def test_a_gap_longer_than_the_lags_restarts_them():
+    history = der_frame(periods=900)
+    forecaster = llm_service.Forecaster()
+    forecaster.update("1min", history.iloc[:400])
+    before = fit_rows(forecaster, "1min")["train_points"]
+    info = forecaster.update("1min", history.iloc[600:])
+    assert info["W"]["lags_reset"] and info["W"]["missing_buckets"] == 0
+    # Only buckets with a full window of post-gap lags are folded in
+    assert fit_rows(forecaster, "1min")["train_points"] - before == 299 - forecaster.lags
+
+
+def test_capped_horizon_is_reported():
+    data = der_frame(periods=2000, freq="15s")
+    forecaster = llm_service.Forecaster()
+    forecaster.update("15s", data)
+    forecast = forecaster.forecast("15s", "W")
+    assert len(forecast["values"]) == forecaster.max_horizon_steps
+    assert forecast["truncated"]
+
+
+def test_features_match_their_definitions():
+    data = der_frame(periods=200)
+    data.loc[50, "W"] = np.nan
+    frame = llm_service.FeaturePipeline(window=30, lags=3).compute(data)["frame"]
+
+    w = data["W"]
+    pd.testing.assert_series_equal(frame["W_mean"], w.rolling(30, min_periods=5).mean().shift(1), check_names=False)
+    pd.testing.assert_series_equal(frame["W_lag2"], w.shift(2), check_names=False)
+    pd.testing.assert_series_equal(frame["W_ramp"], w.diff() / 60, check_names=False)
+    np.testing.assert_allclose(frame["PF"], w / np.sqrt(w ** 2 + data["VAr"] ** 2))
+    np.testing.assert_allclose(frame["dc_ac_efficiency"].drop(index=50), 1 / 1.02)
+
+
+def test_features_are_cached_per_data_version_and_query():
+    data = der_frame(periods=100)
+    data.attrs["data_version"] = "1"
+    pipeline = llm_service.FeaturePipeline(max_entries=2)
+    first = pipeline.get("1min", data)
+    assert pipeline.get("1min", data) is first
+    assert pipeline.get("1min", data, {"start": "2024-02-22 01:00"}) is not first
+
+    data.attrs["data_version"] = "2"
+    assert pipeline.get("1min", data) is not first
+    # Unversioned frames are never cached
+    del data.attrs["data_version"]
+    pipeline.get("1min", data)
+    assert pipeline.report() == {"entries": 2, "hits": 1, "misses": 3, "hit_rate": 0.25}
@@ -0,0 +1,184 @@
+import asyncio
+import builtins
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import llm_service
+from test_data_client import mock_client, records_response
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="memory and I/O counters come from /proc")
+
+
+def spin(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def measure(work):
+    monitor = llm_service.PerformanceMonitor()
+    started = monitor.start_monitoring("test_operation")
+    work()
+    return monitor.end_monitoring(started)
+
+
+def test_cpu_time_counts_work_not_waiting():
+    busy = measure(lambda: spin(0.2))["resources"]
+    idle = measure(lambda: time.sleep(0.2))["resources"]
+    assert busy["cpu_seconds"] >= 0.15
+    assert busy["cpu_percent"] > 50
+    assert idle["cpu_seconds"] < 0.05
+
+
+@linux_only
+def test_memory_growth_is_attributed_to_the_operation():
+    held = []
+
+    def allocate():
+        held.append(bytearray(64 * 1024 * 1024))
+        held[0][::4096] = b"x" * len(held[0][::4096])
+
+    resources = measure(allocate)["resources"]
+    assert resources["rss_delta_mb"] >= 50
+    assert resources["peak_rss_mb"] >= resources["rss_mb"]
+
+
+def test_missing_proc_counters_are_reported_as_none(monkeypatch):
+    real_open = builtins.open
+
+    def no_proc(path, *args, **kwargs):
+        if str(path).startswith("/proc/"):
+            raise OSError("no /proc here")
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", no_proc)
+    resources = measure(lambda: spin(0.01))["resources"]
+    assert resources["rss_mb"] is None and resources["io_read_kb"] is None
+    assert resources["cpu_seconds"] >= 0
+
+
+def test_system_cpu_percent_covers_the_time_since_the_last_reading():
+    monitor = llm_service.PerformanceMonitor()
+    spin(0.2)
+    assert monitor.get_system_metrics()["cpu_percent"] > 50
+    time.sleep(0.2)
+    assert monitor.get_system_metrics()["cpu_percent"] < 25
+
+
+def test_costs_scale_with_cpu_time_rather_than_wall_time(monkeypatch):
+    calculator = llm_service.CloudCostCalculator()
+
+    def totals_of(costs):
+        return {provider: cost["total"] for provider, cost in costs["costs_by_provider"].items()}
+
+    def totals(data_size_mb=1.0, **kwargs):
+        return totals_of(calculator.calculate_interval_costs("1min", data_size_mb, **kwargs))
+
+    # 30s of wall time of which 20s on the CPU is billed like 20s of work
+    busy = totals(performance_duration=30.0, resources={"cpu_seconds": 20.0})
+    assert busy == pytest.approx(totals(performance_duration=20.0))
+    assert busy["aws"] < totals(performance_duration=30.0)["aws"]
+
+    # The same holds end to end for /analyze_data
+    monkeypatch.setattr(llm_service, "data_client", mock_client(lambda request: records_response()))
+    start_monitoring = llm_service.monitor.start_monitoring
+
+    def waited_30_seconds(operation_name):
+        # As if the request had spent 30s waiting on the data service, off the CPU
+        started = start_monitoring(operation_name)
+        started["start_time"] -= 30.0
+        return started
+
+    monkeypatch.setattr(llm_service.monitor, "start_monitoring", waited_30_seconds)
+    costs = asyncio.run(llm_service.analyze_data({"interval": "1min"}))["cost_analysis"]
+    assert costs["performance_duration_seconds"] >= 30.0
+    assert costs["resource_usage"]["cpu_seconds"] < 5.0
+    assert totals_of(costs) == pytest.approx(totals(performance_duration=0.0, data_size_mb=costs["data_size_mb"]))
+
+
+def operation(name, duration):
+    return {"operation": name, "duration": duration, "resources": {"cpu_seconds": duration / 2}, "timestamp": time.time()}
+
+
+def test_latency_quantiles_stay_within_the_bucket_error():
+    samples = np.random.default_rng(0).lognormal(-3, 1, 20000)
+    histogram = llm_service.LatencyHistogram()
+    for value in samples:
+        histogram.record(value)
+    for q in (0.5, 0.9, 0.99):
+        assert histogram.quantile(q) == pytest.approx(np.quantile(samples, q), rel=1 / 32)
+
+
+def test_merged_histograms_equal_one_histogram():
+    values = np.random.default_rng(1).exponential(0.2, 1000)
+    whole, left, right = llm_service.LatencyHistogram(), llm_service.LatencyHistogram(), llm_service.LatencyHistogram()
+    for i, value in enumerate(values):
+        whole.record(value)
+        (left if i % 2 else right).record(value)
+    left.merge(right)
+    assert left.counts == whole.counts and left.percentiles() == whole.percentiles()
+
+
+def test_running_stats_skip_missing_samples():
+    stats = llm_service.RunningStats()
+    for value in (3.0, None, 1.0, 2.0):
+        stats.add(value)
+    assert (stats.count, stats.total, stats.min, stats.max, stats.mean()) == (3, 6.0, 1.0, 3.0, 2.0)
+
+
+def test_registry_memory_is_bounded_but_totals_are_not():
+    registry = llm_service.MetricsRegistry(recent_samples=10)
+    for i in range(500):
+        registry.record_operation(operation("detect_anomalies", 0.01 * (i % 7 + 1)))
+    entry = registry.operations["detect_anomalies"]
+    assert len(entry["recent"]) == 10
+    assert entry["duration"].count == entry["latency"].total == 500
+    assert entry["resources"]["cpu_seconds"].max == pytest.approx(0.035)
+
+
+def test_system_metrics_read_the_registry_under_its_lock(monkeypatch):
+    registry = llm_service.MetricsRegistry()
+    registry.record_operation(operation("cluster_analysis", 0.1))
+    registry.record_operation(operation("cluster_analysis", 0.2))
+    monkeypatch.setattr(llm_service, "metrics_registry", registry)
+
+    results = []
+    with registry.lock:
+        reader = threading.Thread(target=lambda: results.append(asyncio.run(llm_service.metrics_system())))
+        reader.start()
+        reader.join(0.1)
+        assert reader.is_alive()
+    reader.join()
+    assert results[0]["resource_usage"]["gpt_requests_made"] == 2
+    assert results[0]["resource_usage"]["total_operations"] == 1
+
+
+def test_render_follows_the_prometheus_text_format():
+    registry = llm_service.MetricsRegistry()
+    registry.record_operation(operation("detect_anomalies", 0.02))
+    registry.record_operation(operation("detect_anomalies", 3.0))
+    registry.increment("llm_requests_total", endpoint='say "hi"\n', outcome="success")
+    text = registry.render([("jobs", "Background jobs", [({"status": "queued"}, 2), ({"status": "done"}, None)])])
+    lines = text.splitlines()
+
+    assert "# TYPE der_request_duration_seconds histogram" in lines
+    assert 'der_request_duration_seconds_bucket{endpoint="detect_anomalies",le="0.025"} 1' in lines
+    assert 'der_request_duration_seconds_bucket{endpoint="detect_anomalies",le="2.5"} 1' in lines
+    assert 'der_request_duration_seconds_bucket{endpoint="detect_anomalies",le="+Inf"} 2' in lines
+    assert 'der_request_duration_seconds_count{endpoint="detect_anomalies"} 2' in lines
+    assert 'der_llm_requests_total{endpoint="say \\"hi\\"\\n",outcome="success"} 1' in lines
+    # Gauges without a value are left out rather than rendered as None
+    assert 'der_jobs{status="queued"} 2' in lines and not any("done" in line for line in lines)
+    assert text.endswith("\n")
+
+
+def test_metrics_endpoint_declares_one_charset():
+    response = TestClient(llm_service.app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    assert "# TYPE der_process_cpu_seconds gauge" in response.text